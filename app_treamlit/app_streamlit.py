@@ -1,5 +1,9 @@
+import contextlib
+
 import streamlit as st
 
+from core import metrics, warmup
+
 # --- PAGE SETUP ---    
 about_page = st.Page(
     page="views/about_me.py",
@@ -17,19 +21,23 @@ project_2_page = st.Page(
     title="Chatbot",
     icon="🤖",  
 )
+import_page = st.Page(
+    page="views/bulk_import.py",
+    title="Importa Segnalazioni",
+    icon="📥",
+)
 
 
 # --- NAVIGATION SETUP ---
 pg = st.navigation(
     {
         "Info":[about_page],
-        "Projects": [project_1_page, project_2_page]
+        "Projects": [project_1_page, project_2_page, import_page]
         }
     )
 
-# --- RUN NAVIGATION ---
-pg.run()
-
+# Logo e stile della barra laterale, comuni a tutte le pagine: impostati prima della
+# pagina, che può interrompere lo script con st.rerun() o st.stop()
 st.logo('assets/logoNapoliAttiva.jpg',size= "large")
 
 st.markdown(
@@ -44,3 +52,15 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# --- RUN NAVIGATION ---
+# Tempo di esecuzione di ogni pagina; con PROFILING attivo, `?profilo=1` salva il profilo
+metrics.start_server()
+profiling = metrics.PROFILING and st.query_params.get("profilo") == "1"
+try:
+    with metrics.timer("script_run_seconds", pagina=pg.title):
+        with metrics.profile(pg.title) if profiling else contextlib.nullcontext():
+            pg.run()
+finally:
+    # Dopo la prima pagina servita, anche se interrotta: cache e importazioni delle
+    # altre pagine in background (`warmup.start` è in cache_resource, parte una volta)
+    warmup.start()
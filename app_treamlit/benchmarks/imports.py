@@ -0,0 +1,103 @@
+"""Tempo di importazione di ogni pagina, confrontato con un budget.
+
+Uso, dalla cartella `app_treamlit`:
+
+    python -m benchmarks.imports
+    python -m benchmarks.imports --pages home --budget home=150
+
+Ogni pagina è eseguita una volta con `AppTest` in un processo nuovo avviato con
+`python -X importtime`; si sommano i tempi dei moduli importati dalla pagina
+(comprese le importazioni fatte dalle singole sezioni), escluso Streamlit che il
+server ha già caricato. Se una pagina supera il budget il comando termina con
+codice 1, così può essere usato come controllo prima del rilascio.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+from benchmarks.run import APP_DIR, PAGES, TIMEOUT, ensure_database
+
+# Budget in millisecondi per pagina
+BUDGET_MS = {"home": 150, "dashboard": 1500, "chatbot": 3000}
+MARKER = "--- importazioni della pagina ---"
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _run_child(page):
+    """Processo figlio: carica Streamlit, poi esegue la pagina dopo il segnaposto."""
+    from streamlit.testing.v1 import AppTest
+
+    # Una pagina vuota carica i moduli interni di Streamlit usati dall'esecuzione
+    AppTest.from_string("import streamlit as st\nst.write('')").run()
+    print(MARKER, file=sys.stderr, flush=True)
+    AppTest.from_file(os.path.join(APP_DIR, PAGES[page]), default_timeout=TIMEOUT).run()
+
+
+def parse_importtime(stderr):
+    """Totale in ms e moduli di primo livello più lenti, dopo il segnaposto."""
+    _, _, tail = stderr.partition(MARKER)
+    total_us = 0
+    top_level = []
+    for line in tail.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        total_us += int(self_us)
+        # `-X importtime` indenta i moduli importati da altri: il livello 1 ha un solo spazio
+        if len(indent) == 1:
+            top_level.append((int(cumulative_us) / 1000, module))
+    top_level.sort(reverse=True)
+    return total_us / 1000, top_level
+
+
+def measure(page, db_path):
+    env = dict(os.environ, NAPOLI_ATTIVA_DB=db_path, NAPOLI_ATTIVA_LLM_BACKEND="fake",
+               NAPOLI_ATTIVA_WARMUP="false")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "benchmarks.imports", "--page", page],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=TIMEOUT,
+    )
+    if MARKER not in completed.stderr:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "errore sconosciuto")
+    return parse_importtime(completed.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="+", choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument("--budget", nargs="*", default=[], metavar="PAGINA=MS",
+                        help="budget diversi da quelli predefiniti")
+    parser.add_argument("--rows", type=int, default=1000, help="dimensione dell'archivio sintetico")
+    parser.add_argument("--top", type=int, default=5, help="moduli più lenti da mostrare")
+    parser.add_argument("--page", choices=sorted(PAGES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.page:
+        sys.path.insert(0, APP_DIR)
+        _run_child(args.page)
+        return 0
+
+    budgets = dict(BUDGET_MS)
+    for item in args.budget:
+        page, _, value = item.partition("=")
+        budgets[page] = float(value)
+
+    db_path = ensure_database(args.rows)
+    over_budget = []
+    for page in args.pages:
+        total_ms, top_level = measure(page, db_path)
+        budget = budgets.get(page)
+        status = "ok" if budget is None or total_ms <= budget else "FUORI BUDGET"
+        print(f"{page:<10} {total_ms:8.1f} ms (budget {budget} ms) {status}")
+        for ms, module in top_level[:args.top]:
+            print(f"    {ms:8.1f} ms  {module}")
+        if status != "ok":
+            over_budget.append(page)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Controllo del primo rendering delle pagine, senza browser.
+
+Uso, dalla cartella `app_treamlit`:
+
+    python -m benchmarks.render
+    python -m benchmarks.render --pages dashboard --rows 1000
+
+Ogni pagina è eseguita una volta con `AppTest`, in un processo separato, su un
+archivio sintetico e con il modello finto. Se una pagina solleva un'eccezione
+(che interromperebbe le sezioni successive) l'errore viene stampato e il comando
+termina con codice 1, così può essere usato come controllo prima del rilascio.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.run import APP_DIR, PAGES, TIMEOUT, _exceptions, ensure_database
+
+DEFAULT_ROWS = 1000
+
+
+def _run_child(page):
+    """Processo figlio: primo rendering della pagina, eccezioni in JSON sull'ultima riga."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(APP_DIR, PAGES[page]), default_timeout=TIMEOUT)
+    at.run()
+    print(json.dumps(_exceptions(at)))
+
+
+def check_page(page, db_path):
+    """Eccezioni del primo rendering della pagina (lista vuota se tutto va bene)."""
+    env = dict(os.environ, NAPOLI_ATTIVA_DB=db_path, NAPOLI_ATTIVA_LLM_BACKEND="fake",
+               NAPOLI_ATTIVA_WARMUP="false")
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.render", "--page", page],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=TIMEOUT,
+    )
+    if completed.returncode != 0:
+        return [completed.stderr.strip() or "errore sconosciuto"]
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="dimensione dell'archivio")
+    parser.add_argument("--pages", nargs="+", choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument("--page", choices=sorted(PAGES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.page:
+        sys.path.insert(0, APP_DIR)
+        _run_child(args.page)
+        return
+
+    db_path = ensure_database(args.rows)
+    failed = []
+    for page in args.pages:
+        errors = check_page(page, db_path)
+        print(f"{page:<10} {'ok' if not errors else 'ERRORE'}")
+        for error in errors:
+            print(error, file=sys.stderr)
+        if errors:
+            failed.append(page)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
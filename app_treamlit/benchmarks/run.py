@@ -0,0 +1,199 @@
+"""Benchmark delle pagine eseguite senza browser con `AppTest` di Streamlit.
+
+Uso, dalla cartella `app_treamlit`:
+
+    python -m benchmarks.run --rows 1000 100000 1000000
+
+Per ogni dimensione viene generato (una volta sola) un archivio sintetico in
+`data/benchmark_<righe>.db`; ogni pagina è eseguita in un processo separato, con il
+modello finto, misurando il primo rendering (cache vuote), un rerun, il picco di
+memoria (RSS) e la dimensione dei messaggi inviati al browser. I risultati sono
+aggiunti a `benchmarks/risultati.jsonl` e confrontati con l'ultima esecuzione valida.
+Una pagina che solleva un'eccezione misura un rendering interrotto: il risultato è
+segnato come non valido, l'eccezione viene stampata e il comando termina con codice 1.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(APP_DIR, "benchmarks", "risultati.jsonl")
+
+PAGES = {
+    "dashboard": "views/sales_dashboard.py",
+    "home": "views/about_me.py",
+    "chatbot": "views/chatbot.py",
+}
+DEFAULT_ROWS = (1000, 100000)
+TIMEOUT = 600
+
+
+def database_path(rows):
+    return os.path.join(APP_DIR, "data", f"benchmark_{rows}.db")
+
+
+def ensure_database(rows, seed=42):
+    """Genera l'archivio sintetico se manca; restituisce il percorso."""
+    path = database_path(rows)
+    if not os.path.exists(path):
+        from benchmarks.synthetic import populate
+
+        start = time.perf_counter()
+        populate(path, rows, seed=seed)
+        print(f"Archivio sintetico di {rows:,} segnalazioni creato in {time.perf_counter() - start:.1f} s")
+    return path
+
+
+def _payload_size(node):
+    """Byte dei messaggi protobuf degli elementi (quanto la pagina invia al browser)."""
+    size = 0
+    proto = getattr(node, "proto", None)
+    if proto is not None and hasattr(proto, "ByteSize"):
+        size += proto.ByteSize()
+    children = getattr(node, "children", None) or {}
+    for child in children.values():
+        size += _payload_size(child)
+    return size
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux in kB, macOS in byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _exceptions(at):
+    return [f"{e.message}\n{''.join(e.stack_trace)}" for e in at.exception]
+
+
+def measure_page(page):
+    """Esegue la pagina nel processo corrente e restituisce le misure."""
+    from streamlit.testing.v1 import AppTest
+
+    from core import metrics
+
+    at = AppTest.from_file(os.path.join(APP_DIR, PAGES[page]), default_timeout=TIMEOUT)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    exceptions = _exceptions(at)
+    start = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - start
+    exceptions = exceptions or _exceptions(at)
+    result = {
+        "primo_rendering_s": round(first, 4),
+        "rerun_s": round(rerun, 4),
+        "payload_byte": _payload_size(at.main) + _payload_size(at.sidebar),
+    }
+    if page == "chatbot" and not exceptions:
+        # Un turno della chat generale con il modello finto
+        start = time.perf_counter()
+        at.chat_input[0].set_value("Quali sono gli orari dell'ufficio tecnico?").run()
+        result["turno_chat_s"] = round(time.perf_counter() - start, 4)
+        exceptions = _exceptions(at)
+    result["valido"] = not exceptions
+    result["eccezioni"] = exceptions
+    result["sezioni_s"] = {
+        dict(key)["sezione"]: round(total / count, 4)
+        for (name, key), (_, total, count) in metrics.registry.histograms.items()
+        if name == "dashboard_section_seconds"
+    }
+    result["picco_rss_mb"] = round(_peak_rss_mb(), 1)
+    return result
+
+
+def run_page(page, db_path):
+    """Misura una pagina in un processo separato (memoria e cache isolate)."""
+    env = dict(os.environ, NAPOLI_ATTIVA_DB=db_path, NAPOLI_ATTIVA_LLM_BACKEND="fake")
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--page", page],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=TIMEOUT,
+    )
+    if completed.returncode != 0:
+        return {"valido": False,
+                "errore": completed.stderr.strip().splitlines()[-1] if completed.stderr else "errore sconosciuto"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previous_results(path):
+    """Ultimo risultato valido salvato per ogni coppia (pagina, righe)."""
+    previous = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                # Le righe precedenti al campo `valido` sono valide se non riportano errori
+                if record.get("valido", not record.get("errore") and not record.get("eccezioni")):
+                    previous[(record["pagina"], record["righe"])] = record
+    return previous
+
+
+def _compare(value, old):
+    if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+        return ""
+    return f" ({(value - old) / old:+.0%})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="dimensioni dell'archivio")
+    parser.add_argument("--pages", nargs="+", choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument("--output", default=RESULTS_PATH, help="file JSONL dei risultati")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--page", choices=sorted(PAGES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.page:
+        # Processo figlio: misura una sola pagina e stampa il risultato
+        sys.path.insert(0, APP_DIR)
+        print(json.dumps(measure_page(args.page)))
+        return
+
+    previous = previous_results(args.output)
+    run_info = {
+        "eseguito": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+    }
+    failed = False
+    with open(args.output, "a", encoding="utf-8") as output:
+        for rows in args.rows:
+            db_path = ensure_database(rows, args.seed)
+            for page in args.pages:
+                result = run_page(page, db_path)
+                record = {**run_info, "pagina": page, "righe": rows, **result}
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                old = previous.get((page, rows), {})
+                summary = ", ".join(
+                    f"{name}={record[name]}{_compare(record[name], old.get(name))}"
+                    for name in ("primo_rendering_s", "rerun_s", "picco_rss_mb", "payload_byte")
+                    if name in record
+                )
+                if record["valido"]:
+                    print(f"{page:<10} {rows:>9,} righe: {summary}")
+                    continue
+                failed = True
+                print(f"{page:<10} {rows:>9,} righe: NON VALIDO")
+                for error in record.get("eccezioni") or [record.get("errore")]:
+                    print(error, file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Generatore di segnalazioni sintetiche distribuite sul territorio di Napoli.
+
+Le segnalazioni sono concentrate attorno ai quartieri del gazetteer, con
+distribuzioni realistiche di categoria, livello, orario (più segnalazioni di
+giorno e nei giorni feriali) e stato (le segnalazioni più vecchie sono più spesso
+risolte). Con lo stesso seme il risultato è identico.
+"""
+import datetime
+import random
+
+from core.geocoder import load_places
+from core.store import DATE_FORMAT, INSERT_SQL, ReportStore
+
+CATEGORIE = {
+    "Strada Pubblica": 0.40, "Edifici e Infrastrutture": 0.25, "Verde Urbano": 0.20, "Altre criticità": 0.15,
+}
+LIVELLI = {1: 0.45, 2: 0.40, 3: 0.15}
+# Peso relativo di ogni ora del giorno
+ORE = [1, 1, 1, 1, 1, 2, 4, 7, 9, 10, 10, 9, 8, 8, 9, 9, 9, 8, 7, 6, 4, 3, 2, 1]
+# Dispersione attorno al centro del quartiere, in gradi (circa 600 m)
+DISPERSIONE = 0.0055
+
+DESCRIZIONI = {
+    "Strada Pubblica": [
+        "Buca profonda nel manto stradale", "Asfalto dissestato sulla carreggiata",
+        "Tombino sollevato in mezzo alla strada", "Marciapiede rotto e pericoloso per i pedoni",
+    ],
+    "Verde Urbano": [
+        "Ramo pericolante sopra il marciapiede", "Albero caduto che ostruisce il passaggio",
+        "Aiuola incolta con rifiuti abbandonati", "Panchina rotta nel parco",
+    ],
+    "Edifici e Infrastrutture": [
+        "Calcinacci caduti dalla facciata", "Crepa evidente sul muro di contenimento",
+        "Ringhiera arrugginita e instabile", "Infiltrazioni d'acqua nel sottopasso",
+    ],
+    "Altre criticità": [
+        "Lampione spento da diversi giorni", "Semaforo guasto all'incrocio",
+        "Segnaletica stradale divelta", "Cassonetti stracolmi sul marciapiede",
+    ],
+}
+RACCOMANDAZIONI = {
+    1: "Programmare un intervento di manutenzione ordinaria.",
+    2: "Intervenire entro pochi giorni per evitare disagi.",
+    3: "Intervento urgente: delimitare l'area e mettere in sicurezza.",
+}
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _status(rng, age_days):
+    """Stato plausibile per l'età della segnalazione."""
+    resolved = min(0.9, age_days / 60)
+    roll = rng.random()
+    if roll < resolved:
+        return "Chiusa" if rng.random() < 0.3 else "Risolta"
+    if roll < resolved + (1 - resolved) * 0.5:
+        return "In lavorazione" if rng.random() < 0.6 else "Assegnata"
+    return "Nuova"
+
+
+def generate_rows(count, days=365, seed=42, now=None):
+    """Tuple di colonne per `segnalazioni`, nello stesso ordine di `COLONNE_INSERIMENTO`."""
+    rng = random.Random(seed)
+    now = now or datetime.datetime.now().replace(microsecond=0)
+    quartieri = [place for place in load_places() if place.tipo == "quartiere"]
+    for _ in range(count):
+        place = rng.choice(quartieri)
+        categoria = _weighted(rng, CATEGORIE)
+        livello = _weighted(rng, LIVELLI)
+        # Giorni più recenti leggermente più frequenti; meno segnalazioni nel fine settimana
+        age_days = int(rng.triangular(0, days, 0))
+        day = now - datetime.timedelta(days=age_days)
+        if day.weekday() >= 5 and rng.random() < 0.3:
+            day -= datetime.timedelta(days=2)
+        data = day.replace(hour=rng.choices(range(24), weights=ORE)[0], minute=rng.randrange(60),
+                           second=rng.randrange(60))
+        if data > now:
+            data = now
+        yield (
+            data.strftime(DATE_FORMAT), f"{place.nome}, Napoli", place.quartiere,
+            rng.gauss(place.lat, DISPERSIONE), rng.gauss(place.lon, DISPERSIONE),
+            categoria, _status(rng, (now - data).days), livello,
+            rng.choice(DESCRIZIONI[categoria]), RACCOMANDAZIONI[livello],
+        )
+
+
+def populate(path, count, seed=42, batch_size=10000):
+    """Crea (o sostituisce) un archivio con `count` segnalazioni sintetiche.
+
+    L'inserimento passa direttamente dalla tabella (i trigger mantengono indice
+    spaziale e contatori); la deduplicazione non viene eseguita e ogni segnalazione
+    è un incidente a sé.
+    """
+    store = ReportStore(path)
+    conn = store.conn
+    with conn:
+        conn.execute("DELETE FROM segnalazioni")
+    batch = []
+    for row in generate_rows(count, seed=seed):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with conn:
+                conn.executemany(INSERT_SQL, batch)
+            batch = []
+    with conn:
+        if batch:
+            conn.executemany(INSERT_SQL, batch)
+        conn.execute("UPDATE segnalazioni SET incidente_id = id WHERE incidente_id IS NULL")
+        store._bump_revision(conn)
+    conn.execute("PRAGMA optimize")
+    return store
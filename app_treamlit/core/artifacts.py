@@ -0,0 +1,154 @@
+"""Cache dei dati delle dashboard condivisa da tutte le sessioni del processo.
+
+Valori dei riquadri, figure dei grafici, strati della mappa e pagine della tabella
+sono calcolati una volta e riusati da ogni spettatore con gli stessi filtri. Non c'è
+una scadenza: a ogni lettura la cache applica le nuove righe del registro
+`modifiche` dell'archivio (scritte dai trigger) e scarta solo le voci i cui filtri,
+e per la mappa il riquadro, comprendono una segnalazione inserita o modificata.
+Se più sessioni chiedono insieme una voce mancante, il calcolo viene fatto una sola
+volta e le altre attendono il risultato.
+
+I valori sono condivisi tra le sessioni: chi li legge non deve modificarli.
+"""
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, NamedTuple, Optional, Tuple
+
+from core import metrics
+from core.config import get_setting
+from core.filters import matches
+from core.store import DB_PATH, ReportFilter, get_store
+
+MAX_ENTRIES = int(get_setting("ARTIFACT_CACHE_MAX_ENTRIES", 512))
+# Modifiche recenti conservate per verificare i calcoli terminati dopo una scrittura
+RECENT_CHANGES = 1024
+
+
+class Entry(NamedTuple):
+    value: Any
+    filters: ReportFilter
+    # Riquadro (sud, ovest, nord, est) per le voci della mappa, altrimenti None
+    bbox: Optional[Tuple[float, float, float, float]]
+
+
+def touches(change, filters, bbox=None):
+    """True se la modifica può cambiare una voce calcolata con questi filtri e riquadro."""
+    if not matches(filters, change):
+        return False
+    if bbox is None:
+        return True
+    if change.lat is None or change.lon is None:
+        return False
+    south, west, north, east = bbox
+    return south <= change.lat <= north and west <= change.lon <= east
+
+
+class ArtifactCache:
+    """Cache LRU in memoria con invalidazione guidata dal registro delle modifiche."""
+
+    def __init__(self, store, max_entries=MAX_ENTRIES):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._recent = deque(maxlen=RECENT_CHANGES)
+        self._lock = threading.Lock()
+        self._last_change = store.last_change()
+        # Ultima modifica dopo la quale la cache è stata svuotata per intero
+        self._cleared_at = self._last_change
+        self.stats = {"hit": 0, "miss": 0, "attesa": 0, "invalidate": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self):
+        """Applica le modifiche registrate dopo l'ultima lettura; restituisce l'id dell'ultima."""
+        changes, complete = self.store.changes_since(self._last_change)
+        with self._lock:
+            # Registro accorciato oltre l'ultima modifica letta: non si sa cosa è cambiato
+            lost = not complete and changes[0].id > self._last_change + 1
+            # Un altro thread può aver già applicato parte di queste modifiche
+            changes = [change for change in changes if change.id > self._last_change]
+            if not changes:
+                return self._last_change
+            if lost:
+                self.stats["invalidate"] += len(self._entries)
+                self._entries.clear()
+                self._recent.clear()
+                self._cleared_at = changes[-1].id
+            else:
+                stale = [
+                    key for key, entry in self._entries.items()
+                    if any(touches(change, entry.filters, entry.bbox) for change in changes)
+                ]
+                for key in stale:
+                    del self._entries[key]
+                self.stats["invalidate"] += len(stale)
+                self._recent.extend(changes)
+            self._last_change = changes[-1].id
+            return self._last_change
+
+    def _changed_since(self, change_id, filters, bbox):
+        """True se dopo `change_id` è arrivata una modifica che riguarda la voce (con il lock)."""
+        if change_id >= self._last_change:
+            return False
+        if change_id < self._cleared_at or not self._recent or self._recent[0].id > change_id + 1:
+            # Modifiche non più disponibili: per sicurezza la voce si considera cambiata
+            return True
+        return any(change.id > change_id and touches(change, filters, bbox) for change in self._recent)
+
+    def get(self, key, compute, filters=ReportFilter(), bbox=None):
+        """Valore in cache per `key`, calcolato con `compute()` se manca o è stato invalidato.
+
+        `filters` e `bbox` descrivono le segnalazioni da cui dipende il valore.
+        """
+        start = self.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hit"] += 1
+                return entry.value
+            event = self._pending.get(key)
+            owner = event is None
+            if owner:
+                event = self._pending[key] = threading.Event()
+                self.stats["miss"] += 1
+            else:
+                self.stats["attesa"] += 1
+        if not owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            # Senza voce il calcolo è fallito o è stato scartato: si ripete qui
+            return entry.value if entry is not None else compute()
+
+        try:
+            value = compute()
+            self.sync()
+            with self._lock:
+                # Una scrittura avvenuta durante il calcolo può averlo reso vecchio
+                if not self._changed_since(start, filters, bbox):
+                    self._entries[key] = Entry(value, filters, bbox)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache(maxsize=None)
+def get_artifact_cache(path=DB_PATH):
+    """Restituisce l'istanza condivisa della cache per il processo."""
+    cache = ArtifactCache(get_store(path))
+    metrics.register_collector(
+        lambda: [("artifact_cache_total", {"esito": esito}, n) for esito, n in cache.stats.items()]
+    )
+    return cache
@@ -0,0 +1,147 @@
+"""Valutazione del rischio di un'immagine con il modello."""
+import datetime
+import json
+import logging
+from typing import NamedTuple, Optional
+
+from langchain.prompts import PromptTemplate
+from langchain.schema import AIMessage, HumanMessage
+
+from core import metrics
+from core.schema import RiskAssessment
+from core.structured import REPAIR_PROMPT, TOOL, count, read_structured
+
+logger = logging.getLogger(__name__)
+
+# Da incrementare a ogni modifica del prompt: invalida le valutazioni in cache
+PROMPT_VERSION = "2"
+
+# Definisci il prompt template
+prompt_template = PromptTemplate(
+    input_variables=[],
+    template="""
+Analizza l'immagine e assegna un livello di rischio:
+- Basso rischio (1): Il problema non rappresenta un pericolo immediato ma richiede intervento per prevenire danni futuri.
+- Medio rischio (2): Il problema può causare disagi e potenziali incidenti se non risolto in tempi brevi.
+- Alto rischio (3): Il problema rappresenta un pericolo immediato per la sicurezza pubblica e richiede un intervento urgente.
+
+Categorie di valutazione:
+1. Strada Pubblica
+2. Verde Urbano
+3. Edifici e Infrastrutture
+4. Altre criticità (illuminazione, segnaletica, sicurezza urbana)
+
+Registra la valutazione con lo strumento a disposizione, compilando i seguenti campi:
+- livello_pericolosita: numero intero da 1 a 3
+- categoria: una delle categorie elencate sopra
+- descrizione: descrizione dettagliata del problema
+- raccomandazione: suggerimento chiaro per l'amministrazione comunale
+
+Se lo strumento non è disponibile, rispondi solo con un oggetto JSON valido con questi campi.
+""".strip()
+)
+
+
+class AssessmentResult(NamedTuple):
+    # None se la risposta (anche dopo la riparazione) non rispetta lo schema
+    assessment: Optional[RiskAssessment]
+    raw: str
+    cached: bool = False
+
+
+def build_message(image):
+    """Messaggio multimodale con il prompt di valutazione e l'immagine preparata."""
+    return HumanMessage(
+        content=[
+            {"type": "text", "text": prompt_template.format()},
+            {"type": "image_url", "image_url": {"url": image.data_uri}},
+        ],
+    )
+
+
+def assessment_from_json(json_data, location=None, place=None):
+    """Crea l'oggetto Pydantic dai campi (già validati) restituiti dal modello.
+
+    `place` è il luogo del gazetteer scelto per la localizzazione, da cui vengono
+    posizione e quartiere: la localizzazione non viene geocodificata di nuovo, così
+    un luogo rifiutato dall'utente (`place` None) resta solo testo.
+    """
+    if place is not None:
+        json_data = dict(json_data, quartiere=place.quartiere, lat=place.lat, lon=place.lon)
+    return RiskAssessment(data=datetime.datetime.now(), location=location, **json_data)
+
+
+def _request(backend, messages):
+    """Valutazione strutturata con un solo tentativo di riparazione: (dati, testo, riparata)."""
+    data, errors, raw = read_structured(backend.stream_structured(messages, TOOL))
+    if data is not None:
+        return data, raw, False
+
+    # Riparazione mirata: si rimandano al modello la sua risposta e gli errori trovati
+    count("riparazioni")
+    repair = messages + [
+        AIMessage(content=raw or "(risposta vuota)"),
+        HumanMessage(content=REPAIR_PROMPT.format(errors="\n".join(f"- {e}" for e in errors))),
+    ]
+    data, errors, repaired_raw = read_structured(backend.stream_structured(repair, TOOL))
+    if data is not None:
+        count("riparazioni_riuscite")
+    return data, repaired_raw or raw, True
+
+
+def escalation_reason(data, repaired):
+    """Motivo per ripetere la valutazione con il modello più grande, oppure None."""
+    if data is None or repaired:
+        # Risposta del triage non valida o valida solo dopo la riparazione: poco affidabile
+        return "bassa_affidabilita"
+    if data["livello_pericolosita"] == 3:
+        return "alto_rischio"
+    return None
+
+
+def request_assessment(backend, messages):
+    """Chiede la valutazione strutturata al modello.
+
+    Con un `TieredBackend` la valutazione del triage viene ripetuta dall'escalation
+    se è ad alto rischio o poco affidabile; se l'escalation fallisce resta quella del
+    triage. Restituisce (dati, testo della risposta): `dati` è None se anche la
+    risposta riparata non rispetta lo schema.
+    """
+    data, raw, repaired = _request(backend, messages)
+    reason = escalation_reason(data, repaired) if getattr(backend, "escalation", None) is not None else None
+    if reason is None:
+        return data, raw
+    try:
+        escalated, escalated_raw, _ = _request(backend.escalate(), messages)
+    except Exception:
+        # Throttling, modello non abilitato...: meglio la valutazione del triage che nessuna
+        logger.warning("Escalation non riuscita, resta la valutazione del triage", exc_info=True)
+        metrics.increment("llm_escalation_total", motivo=reason, esito="errore")
+        return data, raw
+    if escalated is None:
+        metrics.increment("llm_escalation_total", motivo=reason, esito="non_valida")
+        return data, raw
+    metrics.increment("llm_escalation_total", motivo=reason, esito="ok")
+    return escalated, escalated_raw
+
+
+def assess_image(image, location=None, backend=None, cache=None, place=None):
+    """Valuta un'immagine preparata con `core.images.prepare_image`.
+
+    Se è disponibile una cache, le immagini già valutate (identiche o quasi)
+    non richiedono una nuova chiamata al modello.
+    """
+    if cache is not None:
+        json_data = cache.get(image, PROMPT_VERSION)
+        if json_data is not None:
+            return AssessmentResult(assessment_from_json(json_data, location, place),
+                                    json.dumps(json_data, ensure_ascii=False), cached=True)
+
+    json_data, raw = request_assessment(backend, [build_message(image)])
+    if json_data is None:
+        return AssessmentResult(None, raw)
+
+    assessment = assessment_from_json(json_data, location, place)
+    if cache is not None:
+        cache.put(image, PROMPT_VERSION, json_data)
+    return AssessmentResult(assessment, raw)
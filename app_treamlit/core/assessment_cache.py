@@ -0,0 +1,169 @@
+"""Cache delle valutazioni di rischio indicizzata per contenuto dell'immagine.
+
+Le voci sono salvate nello stesso database SQLite delle segnalazioni, quindi sono
+condivise da tutte le sessioni (e da più processi). La chiave è lo SHA-256
+dell'immagine preparata più la versione del prompt; in assenza di una corrispondenza
+esatta si cerca un'immagine quasi identica tramite l'hash percettivo, indicizzato a
+bande di 8 bit: due hash a distanza <= 7 condividono almeno una banda.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import lru_cache
+
+from core import metrics
+from core.config import get_setting
+from core.images import hamming_distance, perceptual_hash
+from core.store import DB_PATH, SQLiteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_valutazioni (
+    chiave TEXT PRIMARY KEY,
+    versione_prompt TEXT NOT NULL,
+    phash TEXT,
+    risultato TEXT NOT NULL,
+    creato REAL NOT NULL,
+    ultimo_accesso REAL NOT NULL,
+    hit INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_cache_valutazioni_accesso ON cache_valutazioni(ultimo_accesso);
+
+CREATE TABLE IF NOT EXISTS cache_valutazioni_bande (
+    versione_prompt TEXT NOT NULL,
+    banda INTEGER NOT NULL,
+    valore TEXT NOT NULL,
+    chiave TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_bande_valore ON cache_valutazioni_bande(versione_prompt, banda, valore);
+CREATE INDEX IF NOT EXISTS idx_cache_bande_chiave ON cache_valutazioni_bande(chiave);
+
+CREATE TRIGGER IF NOT EXISTS trg_cache_valutazioni_delete AFTER DELETE ON cache_valutazioni
+BEGIN
+    DELETE FROM cache_valutazioni_bande WHERE chiave = OLD.chiave;
+END;
+"""
+
+TTL = float(get_setting("ASSESSMENT_CACHE_TTL", 30 * 24 * 3600))
+MAX_ENTRIES = int(get_setting("ASSESSMENT_CACHE_MAX_ENTRIES", 5000))
+# Distanza di Hamming massima per considerare due foto quasi identiche (al più 7)
+MAX_DISTANCE = int(get_setting("ASSESSMENT_CACHE_MAX_DISTANCE", 4))
+BAND_HEX = 2  # 8 bande da 8 bit (2 cifre esadecimali) per un hash a 64 bit
+
+
+def _bands(phash):
+    return [(i, phash[i * BAND_HEX:(i + 1) * BAND_HEX]) for i in range(len(phash) // BAND_HEX)]
+
+
+class AssessmentCache(SQLiteStore):
+    """Cache TTL/LRU dei risultati di `RiskAssessment` (solo i campi prodotti dal modello)."""
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=DB_PATH, ttl=TTL, max_entries=MAX_ENTRIES, max_distance=MAX_DISTANCE):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, 7)
+        self._stats_lock = threading.Lock()
+        self.stats = {"hit": 0, "hit_simili": 0, "miss": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _key(image, prompt_version):
+        return f"{hashlib.sha256(image.data).hexdigest()}:{prompt_version}"
+
+    @staticmethod
+    def _phash(image):
+        try:
+            return perceptual_hash(image)
+        except OSError:
+            # Immagine non decodificabile: solo corrispondenza esatta
+            return None
+
+    def _touch(self, key):
+        with self.conn as conn:
+            conn.execute(
+                "UPDATE cache_valutazioni SET hit = hit + 1, ultimo_accesso = ? WHERE chiave = ?",
+                (time.time(), key),
+            )
+
+    def get(self, image, prompt_version):
+        """Restituisce il risultato in cache (dict) oppure None."""
+        min_created = time.time() - self.ttl
+        key = self._key(image, prompt_version)
+        row = self.conn.execute(
+            "SELECT risultato FROM cache_valutazioni WHERE chiave = ? AND creato >= ?",
+            (key, min_created),
+        ).fetchone()
+        if row:
+            self._touch(key)
+            self._count("hit")
+            return json.loads(row["risultato"])
+
+        phash = self._phash(image)
+        if phash:
+            bands = _bands(phash)
+            where = " OR ".join("(b.banda = ? AND b.valore = ?)" for _ in bands)
+            params = [prompt_version, min_created] + [v for band in bands for v in band]
+            candidates = self.conn.execute(
+                "SELECT DISTINCT c.chiave, c.phash, c.risultato FROM cache_valutazioni_bande b "
+                "JOIN cache_valutazioni c ON c.chiave = b.chiave "
+                f"WHERE b.versione_prompt = ? AND c.creato >= ? AND ({where})",
+                params,
+            ).fetchall()
+            best = min(candidates, key=lambda c: hamming_distance(phash, c["phash"]), default=None)
+            if best is not None and hamming_distance(phash, best["phash"]) <= self.max_distance:
+                self._touch(best["chiave"])
+                self._count("hit_simili")
+                return json.loads(best["risultato"])
+
+        self._count("miss")
+        return None
+
+    def put(self, image, prompt_version, result):
+        """Salva un risultato e applica scadenza e limite di dimensione."""
+        key = self._key(image, prompt_version)
+        phash = self._phash(image)
+        now = time.time()
+        with self.conn as conn:
+            conn.execute("DELETE FROM cache_valutazioni WHERE chiave = ?", (key,))
+            conn.execute(
+                "INSERT INTO cache_valutazioni (chiave, versione_prompt, phash, risultato, creato, ultimo_accesso) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prompt_version, phash, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            if phash:
+                conn.executemany(
+                    "INSERT INTO cache_valutazioni_bande (versione_prompt, banda, valore, chiave) VALUES (?, ?, ?, ?)",
+                    [(prompt_version, band, value, key) for band, value in _bands(phash)],
+                )
+            # Scadenza (TTL) e poi espulsione delle voci usate meno di recente (LRU)
+            conn.execute("DELETE FROM cache_valutazioni WHERE creato < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM cache_valutazioni WHERE chiave IN ("
+                "SELECT chiave FROM cache_valutazioni ORDER BY ultimo_accesso DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def entry_stats(self, limit=20):
+        """Voci più usate, con numero di hit e ultimo accesso."""
+        rows = self.conn.execute(
+            "SELECT chiave, versione_prompt, hit, creato, ultimo_accesso FROM cache_valutazioni "
+            "ORDER BY hit DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def get_assessment_cache(path=DB_PATH):
+    """Restituisce l'istanza condivisa della cache per il processo."""
+    cache = AssessmentCache(path)
+    metrics.register_collector(
+        lambda: [("assessment_cache_total", {"esito": esito}, n) for esito, n in cache.stats.items()]
+    )
+    return cache
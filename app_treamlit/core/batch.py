@@ -0,0 +1,162 @@
+"""Valutazione di molte immagini in parallelo, con concorrenza limitata.
+
+Le chiamate al modello passano per un pool di thread di dimensione fissa; gli
+errori di throttling di Bedrock vengono ritentati con backoff esponenziale.
+"""
+import csv
+import io
+import os
+import random
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple, Optional
+
+from core.assessment import assess_image
+from core.config import get_setting
+from core.images import prepare_image
+from core.pdf import render_pdf_report
+
+MAX_WORKERS = int(get_setting("BATCH_MAX_WORKERS", 4))
+MAX_RETRIES = int(get_setting("BATCH_MAX_RETRIES", 4))
+BACKOFF_BASE = float(get_setting("BATCH_BACKOFF_BASE", 1.0))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+THROTTLING_CODES = (
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "ModelNotReadyException",
+)
+
+
+class BatchItem(NamedTuple):
+    name: str
+    # "ok", "non interpretabile" oppure "errore"
+    stato: str
+    assessment: Optional[object] = None
+    errore: Optional[str] = None
+    cached: bool = False
+    tentativi: int = 1
+    durata: float = 0.0
+    report_id: Optional[int] = None
+
+
+def is_throttling(error):
+    """Riconosce gli errori di limitazione del traffico (botocore o messaggio equivalente)."""
+    response = getattr(error, "response", None)
+    code = response.get("Error", {}).get("Code", "") if isinstance(response, dict) else ""
+    if code in THROTTLING_CODES:
+        return True
+    text = str(error)
+    return any(name in text for name in THROTTLING_CODES) or "Too many requests" in text
+
+
+def images_from_zip(data):
+    """Estrae le immagini da un archivio ZIP, restituendo coppie (nome, bytes)."""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.basename(info.filename), archive.read(info)
+
+
+def images_from_directory(path):
+    """Immagini presenti in una cartella del server, come coppie (nome, bytes)."""
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(path, name), "rb") as file:
+                yield name, file.read()
+
+
+def _assess_one(name, data, location, place, backend, cache, store, max_retries, backoff_base):
+    try:
+        return _assess_with_retries(name, data, location, place, backend, cache, store, max_retries,
+                                    backoff_base)
+    finally:
+        # I thread del pool terminano con l'executor: le connessioni SQLite che hanno
+        # aperto vanno chiuse qui (riaprirle costa poco rispetto alla chiamata al modello)
+        for db in (cache, store):
+            if db is not None:
+                db.close_connection()
+
+
+def _assess_with_retries(name, data, location, place, backend, cache, store, max_retries, backoff_base):
+    start = time.perf_counter()
+    attempt = 1
+    while True:
+        try:
+            result = assess_image(prepare_image(data), location=location, backend=backend, cache=cache,
+                                  place=place)
+            break
+        except Exception as error:
+            if not is_throttling(error) or attempt > max_retries:
+                return BatchItem(name, "errore", errore=str(error), tentativi=attempt,
+                                 durata=time.perf_counter() - start)
+            # Backoff esponenziale con jitter, per non ritentare tutti insieme
+            time.sleep(backoff_base * 2 ** (attempt - 1) + random.uniform(0, backoff_base))
+            attempt += 1
+
+    duration = time.perf_counter() - start
+    if result.assessment is None:
+        return BatchItem(name, "non interpretabile", errore=result.raw, tentativi=attempt, durata=duration)
+    report_id = store.add(result.assessment) if store is not None else None
+    return BatchItem(name, "ok", result.assessment, cached=result.cached, tentativi=attempt,
+                     durata=duration, report_id=report_id)
+
+
+def assess_batch(images, backend, cache=None, store=None, location=None, max_workers=MAX_WORKERS,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, on_progress=None, place=None):
+    """Valuta le immagini `(nome, bytes)` con al più `max_workers` chiamate contemporanee.
+
+    `place` è il luogo del gazetteer della localizzazione comune (None per solo testo).
+
+    `on_progress(completate, totale, item)` è chiamata dal thread chiamante a ogni
+    immagine completata; i risultati sono restituiti nell'ordine di ingresso.
+    """
+    images = list(images)
+    results = [None] * len(images)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(_assess_one, name, data, location, place, backend, cache, store,
+                            max_retries, backoff_base): i
+            for i, (name, data) in enumerate(images)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            item = future.result()
+            results[futures[future]] = item
+            if on_progress is not None:
+                on_progress(done, len(images), item)
+    return results
+
+
+def results_rows(items):
+    """Righe della tabella riepilogativa."""
+    for item in items:
+        assessment = item.assessment
+        yield {
+            "File": item.name,
+            "Esito": item.stato,
+            "Segnalazione": item.report_id,
+            "Livello": assessment.livello_pericolosita if assessment else None,
+            "Categoria": assessment.categoria if assessment else None,
+            "Descrizione": assessment.descrizione if assessment else item.errore,
+            "Da cache": item.cached,
+            "Tentativi": item.tentativi,
+            "Durata (s)": round(item.durata, 2),
+        }
+
+
+def export_zip(items):
+    """Archivio ZIP con il riepilogo CSV e un report PDF per ogni valutazione riuscita."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        summary = io.StringIO()
+        rows = list(results_rows(items))
+        if rows:
+            writer = csv.DictWriter(summary, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        archive.writestr("riepilogo.csv", summary.getvalue())
+        for i, item in enumerate(items, start=1):
+            if item.assessment is not None:
+                name = f"{i:03d}_{os.path.splitext(item.name)[0]}.pdf"
+                archive.writestr(name, render_pdf_report(item.assessment))
+    return buffer.getvalue()
@@ -0,0 +1,16 @@
+"""Valori ammessi, condivisi tra valutatore, archivio e dashboard.
+
+Modulo senza dipendenze: le pagine che mostrano solo filtri e statistiche li
+importano senza caricare pydantic (il modello è in `core.schema`).
+"""
+CATEGORIE = ("Strada Pubblica", "Verde Urbano", "Edifici e Infrastrutture", "Altre criticità")
+STATI = ("Nuova", "Assegnata", "In lavorazione", "Risolta", "Chiusa")
+LIVELLI = {1: "Basso", 2: "Medio", 3: "Alto"}
+# I 30 quartieri del Comune di Napoli
+QUARTIERI = (
+    "Arenella", "Avvocata", "Bagnoli", "Barra", "Chiaia", "Chiaiano", "Fuorigrotta", "Mercato",
+    "Miano", "Montecalvario", "Pendino", "Pianura", "Piscinola", "Poggioreale", "Ponticelli",
+    "Porto", "Posillipo", "San Carlo all'Arena", "San Ferdinando", "San Giovanni a Teduccio",
+    "San Giuseppe", "San Lorenzo", "San Pietro a Patierno", "Scampia", "Secondigliano",
+    "Soccavo", "Stella", "Vicaria", "Vomero", "Zona Industriale",
+)
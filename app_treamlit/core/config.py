@@ -0,0 +1,29 @@
+"""Impostazioni dell'applicazione.
+
+Ogni impostazione si legge prima dalla variabile d'ambiente `NAPOLI_ATTIVA_<NOME>`
+e poi dai secrets di Streamlit (`<NOME>`), con un valore di default.
+"""
+import os
+
+import streamlit as st
+
+TRUE_VALUES = ("1", "true", "yes", "si", "on")
+
+
+def get_setting(name, default=None):
+    """Legge un'impostazione dalle variabili d'ambiente o dai secrets di Streamlit."""
+    env_name = f"NAPOLI_ATTIVA_{name}"
+    if env_name in os.environ:
+        return os.environ[env_name]
+    try:
+        return st.secrets.get(name, default)
+    except FileNotFoundError:
+        return default
+
+
+def get_flag(name, default=False):
+    """Come `get_setting`, ma interpreta il valore come booleano."""
+    value = get_setting(name, default)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
@@ -0,0 +1,154 @@
+"""Gestione del contesto inviato al modello nella chat generale.
+
+La cronologia in `st.session_state.messages` resta completa per la visualizzazione,
+ma al modello viene inviata una versione entro un budget di token:
+
+- le immagini dei turni precedenti sono sostituite da un breve segnaposto;
+- i turni più vecchi confluiscono in un riassunto progressivo;
+- il `SystemMessage` iniziale è sempre presente.
+
+Il riassunto del modello non rallenta la risposta: nel turno in cui servirebbe si
+usa un riassunto estrattivo provvisorio, sostituito da `refine()` dopo che la
+risposta è stata mostrata.
+"""
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from core.config import get_setting
+
+# Stima grossolana: circa 4 caratteri per token per il testo italiano
+CHARS_PER_TOKEN = 4
+# Costo indicativo di un'immagine per i modelli Claude 3 (circa 1,15 megapixel)
+IMAGE_TOKENS = 1600
+
+IMAGE_PLACEHOLDER = "[immagine allegata in un messaggio precedente]"
+
+SUMMARY_PROMPT = (
+    "Riassumi in italiano, in poche frasi, la seguente conversazione tra un cittadino "
+    "e l'assistente comunale. Conserva richieste, luoghi e problemi segnalati.\n\n"
+    "{previous}{transcript}"
+)
+
+
+def estimate_tokens(message):
+    """Stima i token di un messaggio, immagini comprese."""
+    content = message.content
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    tokens = 1
+    for item in content:
+        if item.get("type") == "image_url":
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += len(item.get("text", "")) // CHARS_PER_TOKEN
+    return tokens
+
+
+def strip_images(message):
+    """Restituisce il messaggio con le immagini sostituite da un segnaposto testuale."""
+    if isinstance(message.content, str):
+        return message
+    parts = []
+    for item in message.content:
+        if item.get("type") == "image_url":
+            parts.append(IMAGE_PLACEHOLDER)
+        else:
+            parts.append(item.get("text", ""))
+    return message.__class__(content="\n".join(parts))
+
+
+def message_text(message):
+    """Testo del messaggio senza immagini, per trascrizioni e riassunti."""
+    return strip_images(message).content
+
+
+def extractive_summary(previous, messages, max_chars=200):
+    """Riassunto senza modello: le prime righe di ciascun messaggio."""
+    lines = [previous] if previous else []
+    for message in messages:
+        role = "Cittadino" if isinstance(message, HumanMessage) else "Assistente"
+        lines.append(f"{role}: {message_text(message)[:max_chars]}")
+    return "\n".join(lines)
+
+
+class LLMSummarizer:
+    """Riassume i turni più vecchi con una sola chiamata al modello."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __call__(self, previous, messages):
+        transcript = "\n".join(
+            f"{'Cittadino' if isinstance(m, HumanMessage) else 'Assistente'}: {message_text(m)}"
+            for m in messages
+        )
+        header = f"Riassunto precedente: {previous}\n\n" if previous else ""
+        try:
+            response = self.backend.invoke([HumanMessage(content=SUMMARY_PROMPT.format(
+                previous=header, transcript=transcript))])
+            return response.content
+        except Exception:
+            # Il riassunto non deve mai bloccare la chat
+            return extractive_summary(previous, messages)
+
+
+class ConversationContext:
+    """Costruisce il contesto da inviare al modello entro `max_tokens`.
+
+    Lo stato (riassunto e numero di messaggi già riassunti) vive nell'oggetto, che
+    va conservato in `st.session_state` insieme alla cronologia.
+    """
+
+    def __init__(self, summarizer, max_tokens=None, keep_messages=None):
+        self.summarizer = summarizer
+        self.max_tokens = int(max_tokens or get_setting("CONTEXT_MAX_TOKENS", 6000))
+        # Numero minimo di messaggi recenti inviati sempre per intero
+        self.keep_messages = int(keep_messages or get_setting("CONTEXT_KEEP_MESSAGES", 6))
+        self.summary = ""
+        self.summarized = 0
+        # Riassunto confermato e messaggi ancora da passare al summarizer
+        self._queued = None
+
+    def _system(self, system):
+        if not self.summary:
+            return system
+        return SystemMessage(content=f"{system.content}\n\nRiassunto della conversazione precedente:\n{self.summary}")
+
+    def build(self, messages):
+        """Restituisce i messaggi da inviare al modello per l'ultimo turno."""
+        system, history = messages[0], messages[1:]
+        # Le immagini restano solo nel turno in cui sono state inviate
+        pending = [strip_images(m) for m in history[self.summarized:-1]] + history[-1:]
+
+        def total():
+            return estimate_tokens(self._system(system)) + sum(estimate_tokens(m) for m in pending)
+
+        if total() > self.max_tokens and len(pending) > self.keep_messages:
+            # Riassume i turni più vecchi, tagliando su un messaggio dell'utente
+            cut = len(pending) - self.keep_messages
+            while cut < len(pending) - 1 and not isinstance(pending[cut], HumanMessage):
+                cut += 1
+            previous, queued = self._queued or (self.summary, [])
+            self._queued = (previous, queued + pending[:cut])
+            self.summary = extractive_summary(self.summary, pending[:cut])
+            self.summarized += cut
+            pending = pending[cut:]
+
+        # Se anche i turni recenti superano il budget, si scartano i più vecchi
+        while total() > self.max_tokens and len(pending) > 1:
+            pending = pending[1:]
+            while len(pending) > 1 and isinstance(pending[0], AIMessage):
+                pending = pending[1:]
+
+        return [self._system(system)] + pending
+
+    def refine(self):
+        """Sostituisce il riassunto provvisorio con quello del summarizer.
+
+        Da chiamare dopo aver mostrato la risposta del turno; senza turni da riassumere
+        non fa nulla.
+        """
+        if self._queued is None:
+            return
+        previous, queued = self._queued
+        self._queued = None
+        self.summary = self.summarizer(previous, queued)
@@ -0,0 +1,123 @@
+"""Riconoscimento delle segnalazioni duplicate.
+
+Una nuova segnalazione si unisce all'incidente di una segnalazione aperta della
+stessa categoria se le due sono vicine (entro RADIUS metri) e descrivono lo stesso
+problema. La somiglianza del testo è stimata con MinHash sulle parole della
+descrizione; le firme sono indicizzate a bande (LSH), quindi i candidati si
+trovano con una ricerca sull'indice invece di confrontare tutte le segnalazioni.
+
+Le coordinate ricavate dal gazetteer sono uguali per tutte le segnalazioni dello
+stesso luogo, anche se descrivono problemi diversi: per queste posizioni il raggio è
+più ampio (il problema può essere ovunque nella piazza o lungo la via) e serve una
+descrizione più simile. Tra due posizioni valgono raggio e soglia della meno precisa
+(vedi `PRECISIONI`). Le descrizioni senza parole significative non hanno una firma
+e non vengono mai unite.
+"""
+import array
+import math
+import re
+import unicodedata
+import zlib
+
+from core import geocoder
+from core.config import get_setting
+
+RADIUS = float(get_setting("DEDUP_RADIUS", 75))
+# Somiglianza stimata (Jaccard) minima tra le descrizioni
+THRESHOLD = float(get_setting("DEDUP_THRESHOLD", 0.4))
+
+# Raggio e soglia per precisione della posizione: un punto qualsiasi, un luogo puntuale
+# del gazetteer (piazza, luogo) oppure il centro di un'area (via, zona, quartiere)
+PRECISIONI = {
+    "punto": (RADIUS, THRESHOLD),
+    "luogo": (float(get_setting("DEDUP_PLACE_RADIUS", 150)), float(get_setting("DEDUP_PLACE_THRESHOLD", 0.5))),
+    "area": (float(get_setting("DEDUP_AREA_RADIUS", 500)), float(get_setting("DEDUP_AREA_THRESHOLD", 0.6))),
+}
+MAX_RADIUS = max(radius for radius, _ in PRECISIONI.values())
+
+NUM_PERM = 32
+# 16 bande da 2 valori: due descrizioni con Jaccard 0.4 condividono almeno una banda
+# con probabilità ~93%, con Jaccard 0.1 solo nel ~15% dei casi
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Coefficienti fissi (non casuali): le firme sono salvate e confrontate tra processi
+_PERMUTATIONS = [
+    (1 + (i * 0x9E3779B97F4A7C15) % (_PRIME - 1), (i * 0xC2B2AE3D27D4EB4F) % _PRIME)
+    for i in range(1, NUM_PERM + 1)
+]
+
+PAROLE_VUOTE = {
+    "della", "delle", "dello", "degli", "nella", "nelle", "nello", "sulla", "sulle", "dalla",
+    "alla", "alle", "agli", "con", "per", "una", "uno", "che", "non", "sono", "come", "anche",
+    "presenza", "presente", "problema", "immagine", "mostra", "potrebbe", "rappresenta",
+}
+
+
+def tokens(text):
+    """Parole significative della descrizione, ridotte alle prime 5 lettere (buca/buche)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return {word[:5] for word in re.findall(r"[a-z]{3,}", text) if word not in PAROLE_VUOTE}
+
+
+def minhash(text):
+    """Firma MinHash della descrizione (NUM_PERM interi a 32 bit), None se non ha parole significative."""
+    values = [zlib.crc32(token.encode()) for token in tokens(text)]
+    if not values:
+        return None
+    return array.array("I", (
+        min(((a * value + b) % _PRIME) & _MAX_HASH for value in values) for a, b in _PERMUTATIONS
+    ))
+
+
+def signature_bytes(signature):
+    return signature.tobytes()
+
+
+def signature_from_bytes(data):
+    return array.array("I", data)
+
+
+def bands(signature):
+    """Coppie (banda, valore) della firma per l'indice LSH."""
+    return [
+        (i, zlib.crc32(signature[i * ROWS:(i + 1) * ROWS].tobytes()))
+        for i in range(BANDS)
+    ]
+
+
+def similarity(a, b):
+    """Stima della somiglianza di Jaccard tra due firme."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def precision(lat, lon):
+    """Precisione della posizione: "punto", "luogo" o "area" (chiavi di `PRECISIONI`)."""
+    tipo = geocoder.place_type(lat, lon)
+    if tipo is None:
+        return "punto"
+    return "area" if tipo in geocoder.TIPI_AREA else "luogo"
+
+
+def limits(precision_a, precision_b):
+    """Raggio e soglia per confrontare due posizioni: quelli della meno precisa."""
+    (radius_a, threshold_a), (radius_b, threshold_b) = PRECISIONI[precision_a], PRECISIONI[precision_b]
+    return max(radius_a, radius_b), max(threshold_a, threshold_b)
+
+
+def bbox_around(lat, lon, radius=RADIUS):
+    """Riquadro (sud, ovest, nord, est) che contiene il cerchio di raggio `radius` metri."""
+    dlat = radius / 111320.0
+    dlon = radius / (111320.0 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Distanza in metri (formula dell'emisenoverso)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    h = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
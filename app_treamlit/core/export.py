@@ -0,0 +1,198 @@
+"""Esportazione delle segnalazioni in CSV, Parquet e GeoJSON.
+
+Le segnalazioni, filtrate come nella dashboard, sono lette dall'archivio a blocchi
+di `CHUNK_SIZE` righe e ogni formato le produce come una sequenza di pezzi di
+bytes (`stream`): la memoria usata non dipende dal numero di righe e chi legge
+può iniziare a scrivere o inviare il file prima che l'esportazione sia finita.
+Il Parquet (colonnare, compresso con zstd) ha un gruppo di righe per blocco e
+richiede pyarrow, già installato con Streamlit.
+
+Per la pubblicazione degli open data si può esportare da riga di comando, dalla
+cartella `app_treamlit`:
+
+    python -m core.export geojson segnalazioni.geojson --stato Risolta --dal 2024-01-01
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+import tempfile
+
+from core import metrics
+from core.store import COLONNE, ReportFilter
+
+CHUNK_SIZE = 5000
+# Oltre questa soglia il file temporaneo dell'esportazione passa dalla memoria al disco
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+COLUMNS = (*COLONNE, "incidente_id")
+# Estensione e tipo MIME di ogni formato
+FORMATI = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "geojson": (".geojson", "application/geo+json"),
+}
+
+
+def iter_csv(chunks):
+    """CSV (UTF-8, separatore virgola) con intestazione."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _feature(row):
+    properties = {column: row[column] for column in COLUMNS if column not in ("lat", "lon")}
+    geometry = None
+    if row["lat"] is not None and row["lon"] is not None:
+        # GeoJSON vuole le coordinate nell'ordine longitudine, latitudine
+        geometry = {"type": "Point", "coordinates": [row["lon"], row["lat"]]}
+    return {"type": "Feature", "id": row["id"], "geometry": geometry, "properties": properties}
+
+
+def iter_geojson(chunks):
+    """FeatureCollection GeoJSON; le segnalazioni senza posizione hanno `geometry` nulla."""
+    yield b'{"type": "FeatureCollection", "features": [\n'
+    separator = ""
+    for rows in chunks:
+        features = ",\n".join(json.dumps(_feature(row), ensure_ascii=False) for row in rows)
+        yield (separator + features).encode("utf-8")
+        separator = ",\n"
+    yield b"\n]}\n"
+
+
+class _PendingBytes(io.RawIOBase):
+    """Destinazione di scrittura che conserva i bytes fino al prossimo `take`."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()), ("data", pa.timestamp("s")), ("location", pa.string()),
+        ("quartiere", pa.string()), ("lat", pa.float64()), ("lon", pa.float64()),
+        ("categoria", pa.string()), ("stato", pa.string()), ("livello_pericolosita", pa.int8()),
+        ("descrizione", pa.string()), ("raccomandazione", pa.string()), ("incidente_id", pa.int64()),
+    ])
+
+
+def iter_parquet(chunks):
+    """Parquet compresso con zstd, un gruppo di righe per blocco."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    sink = _PendingBytes()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in chunks:
+            values = list(zip(*rows))
+            arrays = []
+            for field, column in zip(schema, values):
+                if field.name == "data":
+                    arrays.append(pc.strptime(pa.array(column, pa.string()), format="%Y-%m-%d %H:%M:%S", unit="s"))
+                else:
+                    arrays.append(pa.array(column, field.type))
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+WRITERS = {"csv": iter_csv, "parquet": iter_parquet, "geojson": iter_geojson}
+
+
+def stream(store, formato, filters=None, chunk_size=CHUNK_SIZE):
+    """Pezzi di bytes dell'esportazione nel formato indicato."""
+    chunks = store.report_chunks(filters, chunk_size, COLUMNS)
+    with metrics.timer("export_seconds", formato=formato):
+        for data in WRITERS[formato](_counted(chunks, formato)):
+            if data:
+                yield data
+
+
+def _counted(chunks, formato):
+    for rows in chunks:
+        metrics.increment("export_rows_total", len(rows), formato=formato)
+        yield rows
+
+
+def write(store, formato, fileobj, filters=None, chunk_size=CHUNK_SIZE):
+    """Scrive l'esportazione su `fileobj`; restituisce il numero di byte scritti."""
+    size = 0
+    for data in stream(store, formato, filters, chunk_size):
+        fileobj.write(data)
+        size += len(data)
+    return size
+
+
+def export_file(store, formato, filters=None):
+    """Esportazione in un file temporaneo, riavvolto e pronto per la lettura."""
+    fileobj = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write(store, formato, fileobj, filters)
+    fileobj.seek(0)
+    return fileobj
+
+
+def file_name(formato, today=None):
+    return f"segnalazioni_{(today or datetime.date.today()).isoformat()}{FORMATI[formato][0]}"
+
+
+def main(argv=None):
+    from core.filters import normalize
+    from core.store import get_store
+
+    parser = argparse.ArgumentParser(description="Esporta le segnalazioni in CSV, Parquet o GeoJSON.")
+    parser.add_argument("formato", choices=sorted(FORMATI))
+    parser.add_argument("output", help="file di destinazione, - per lo standard output")
+    parser.add_argument("--categoria", action="append", default=[])
+    parser.add_argument("--stato", action="append", default=[])
+    parser.add_argument("--quartiere", action="append", default=[])
+    parser.add_argument("--dal", type=datetime.date.fromisoformat)
+    parser.add_argument("--al", type=datetime.date.fromisoformat)
+    args = parser.parse_args(argv)
+
+    filters = normalize(ReportFilter(tuple(args.categoria), tuple(args.stato), tuple(args.quartiere),
+                                     args.dal, args.al))
+    if args.output == "-":
+        write(get_store(), args.formato, sys.stdout.buffer, filters)
+    else:
+        with open(args.output, "wb") as output:
+            size = write(get_store(), args.formato, output, filters)
+        print(f"{args.output}: {size:,} byte", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Risposte predefinite alle domande frequenti, senza chiamare il modello.
+
+Le domande (con alcune parole chiave) di `data/faq_napoli.csv` sono indicizzate
+con TF-IDF: una domanda del cittadino abbastanza simile a una voce (somiglianza
+del coseno almeno `FAQ_MIN_SCORE`) riceve la risposta della voce. Le parole sono
+normalizzate (minuscole, senza accenti, senza parole vuote) e ridotte a una radice
+grossolana, così "segnalazioni" e "segnalare" condividono la stessa voce.
+"""
+import csv
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import NamedTuple
+
+from core.config import get_setting
+
+FAQ_PATH = get_setting(
+    "FAQ",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "faq_napoli.csv"),
+)
+MIN_SCORE = float(get_setting("FAQ_MIN_SCORE", 0.45))
+# Oltre questa lunghezza la domanda non è una FAQ: meglio la risposta del modello
+MAX_WORDS = 25
+
+PAROLE_VUOTE = {
+    "a", "ad", "al", "alla", "alle", "allo", "ai", "agli", "c", "che", "chi", "ci", "come", "con", "cosa",
+    "da", "dal", "dalla", "dei", "del", "della", "delle", "di", "dove", "e", "ed", "gli", "ha", "ho", "i",
+    "il", "in", "io", "l", "la", "le", "lo", "ma", "mi", "mia", "mio", "ne", "nel", "nella", "non", "o",
+    "per", "piu", "posso", "puo", "quale", "quali", "quando", "se", "si", "sono", "su", "sul", "sulla",
+    "ti", "tu", "un", "una", "uno", "va", "vi", "vorrei",
+}
+
+
+class FaqEntry(NamedTuple):
+    domanda: str
+    risposta: str
+
+
+class FaqMatch(NamedTuple):
+    entry: FaqEntry
+    score: float
+
+
+def _stem(word):
+    # Radice grossolana per l'italiano: via la vocale finale e i suffissi più comuni
+    for suffix in ("zioni", "zione", "mente", "are", "ere", "ire"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word[:-1] if len(word) > 4 and word[-1] in "aeio" else word
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [_stem(word) for word in re.findall(r"[a-z0-9]+", text) if word not in PAROLE_VUOTE]
+
+
+class FaqIndex:
+    """Indice TF-IDF delle domande frequenti."""
+
+    def __init__(self, entries, min_score=MIN_SCORE):
+        self.entries = []
+        self.min_score = min_score
+        documents = []
+        for entry, keywords in entries:
+            self.entries.append(entry)
+            documents.append(Counter(tokenize(f"{entry.domanda} {keywords}")))
+        frequencies = Counter(term for document in documents for term in document)
+        self.idf = {term: math.log((1 + len(documents)) / (1 + n)) + 1 for term, n in frequencies.items()}
+        # Le parole assenti da tutte le voci pesano come le più rare: abbassano la somiglianza
+        self.unknown_idf = math.log(1 + len(documents)) + 1
+        self.vectors = [self._vector(document) for document in documents]
+
+    def _vector(self, counts):
+        vector = {term: (1 + math.log(n)) * self.idf.get(term, self.unknown_idf) for term, n in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {term: value / norm for term, value in vector.items()}
+
+    def search(self, text):
+        """Voce più simile alla domanda con la sua somiglianza, oppure None."""
+        terms = tokenize(text)
+        if not terms or len(terms) > MAX_WORDS:
+            return None
+        query = self._vector(Counter(terms))
+        scores = (
+            (sum(weight * vector.get(term, 0.0) for term, weight in query.items()), i)
+            for i, vector in enumerate(self.vectors)
+        )
+        score, best = max(scores, default=(0.0, None))
+        return FaqMatch(self.entries[best], score) if best is not None else None
+
+    def answer(self, text):
+        """Risposta predefinita se la domanda corrisponde a una FAQ, altrimenti None."""
+        match = self.search(text)
+        return match.entry.risposta if match is not None and match.score >= self.min_score else None
+
+
+def load_entries(path=FAQ_PATH):
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            yield FaqEntry(row["domanda"], row["risposta"]), row["parole_chiave"]
+
+
+@lru_cache(maxsize=None)
+def get_faq_index(path=FAQ_PATH):
+    """Indice condiviso dal processo, caricato al primo utilizzo."""
+    return FaqIndex(load_entries(path))
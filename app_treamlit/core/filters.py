@@ -0,0 +1,299 @@
+"""Filtri della sidebar: normalizzazione, parametri dell'URL e indici bitmap.
+
+Per le statistiche filtrate ogni valore di categoria, stato e quartiere ha una
+bitmap (un intero Python, un bit per segnalazione in ordine di data): una
+combinazione qualsiasi di filtri si valuta con OR tra i valori dello stesso
+campo e AND tra i campi, mentre l'intervallo di date è un intervallo contiguo
+di bit trovato con una ricerca binaria.
+
+L'indice condiviso (`get_filter_index`) non viene ricostruito a ogni scrittura: come
+la cache delle dashboard legge il registro `modifiche` e aggiorna solo le bitmap
+delle segnalazioni inserite o modificate. Serve una ricostruzione solo se le
+posizioni cambiano (cancellazioni, segnalazioni con una data precedente all'ultima
+indicizzata) o se le modifiche sono troppe.
+"""
+import array
+import bisect
+import copy
+import datetime
+import threading
+from functools import lru_cache
+
+import streamlit as st
+
+from core import metrics
+from core.choices import CATEGORIE, QUARTIERI, STATI
+from core.store import DB_PATH, ReportFilter, build_summary, get_store, week_bounds
+
+# Nomi dei parametri nell'URL
+QUERY_PARAMS = {"categorie": "categoria", "stati": "stato", "quartieri": "quartiere", "dal": "dal", "al": "al"}
+_DIMENSIONS = (("categorie", "categoria"), ("stati", "stato"), ("quartieri", "quartiere"))
+# Oltre questa quota di segnalazioni modificate conviene ricostruire l'indice
+REBUILD_RATIO = 0.05
+
+
+def _popcount(value):
+    return value.bit_count() if hasattr(value, "bit_count") else bin(value).count("1")
+
+
+def normalize(filters):
+    """Forma canonica di un ReportFilter: valori noti, ordinati e senza duplicati.
+
+    Filtri equivalenti (stessi valori in ordine diverso, date invertite) danno la
+    stessa chiave di cache.
+    """
+    dal, al = filters.dal, filters.al
+    if dal and al and dal > al:
+        dal, al = al, dal
+    return ReportFilter(
+        categorie=tuple(sorted(set(filters.categorie) & set(CATEGORIE))),
+        stati=tuple(sorted(set(filters.stati) & set(STATI))),
+        quartieri=tuple(sorted(set(filters.quartieri) & set(QUARTIERI))),
+        dal=dal,
+        al=al,
+    )
+
+
+def is_empty(filters):
+    return filters == ReportFilter()
+
+
+def matches(filters, report):
+    """True se la segnalazione (con campi categoria, stato, quartiere e giorno ISO) rientra nei filtri."""
+    for field, column in _DIMENSIONS:
+        values = getattr(filters, field)
+        if values and getattr(report, column) not in values:
+            return False
+    if filters.dal and report.giorno < filters.dal.isoformat():
+        return False
+    if filters.al and report.giorno > filters.al.isoformat():
+        return False
+    return True
+
+
+def to_query_params(filters):
+    """Parametri dell'URL corrispondenti ai filtri (solo quelli attivi)."""
+    params = {}
+    for field, name in QUERY_PARAMS.items():
+        value = getattr(filters, field)
+        if isinstance(value, tuple) and value:
+            params[name] = list(value)
+        elif isinstance(value, datetime.date):
+            params[name] = value.isoformat()
+    return params
+
+
+def from_query_params(params):
+    """Filtri normalizzati da una mappa nome -> lista di valori (ad esempio `st.query_params`)."""
+    def values(name):
+        getter = getattr(params, "get_all", None)
+        return getter(name) if getter else list(params.get(name, []))
+
+    def date(name):
+        try:
+            return datetime.date.fromisoformat(values(name)[-1])
+        except (IndexError, ValueError):
+            return None
+
+    return normalize(ReportFilter(
+        categorie=tuple(values("categoria")),
+        stati=tuple(values("stato")),
+        quartieri=tuple(values("quartiere")),
+        dal=date("dal"),
+        al=date("al"),
+    ))
+
+
+class FilterIndex:
+    """Bitmap per valore dei campi filtrabili; un indice non cambia dopo la costruzione."""
+
+    def __init__(self, rows):
+        self.days = []
+        self.ids = array.array("q")
+        positions = {dimension: {} for _, dimension in _DIMENSIONS}
+        for position, row in enumerate(rows):
+            self.days.append(row["giorno"])
+            self.ids.append(row["id"])
+            for _, dimension in _DIMENSIONS:
+                if row[dimension] is not None:
+                    positions[dimension].setdefault(row[dimension], []).append(position)
+        self.size = len(self.days)
+        self.all = (1 << self.size) - 1
+        self.max_id = max(self.ids, default=0)
+        self.bitmaps = {
+            dimension: {value: self._bitmap(items) for value, items in values.items()}
+            for dimension, values in positions.items()
+        }
+
+    def _position(self, report_id, day):
+        """Posizione della segnalazione, cercata tra quelle del suo giorno (None se non c'è)."""
+        lo, hi = bisect.bisect_left(self.days, day), bisect.bisect_right(self.days, day)
+        try:
+            return lo + self.ids[lo:hi].index(report_id)
+        except ValueError:
+            return None
+
+    def updated(self, ids, rows):
+        """Nuovo indice con le segnalazioni `ids` aggiornate ai valori di `rows`, oppure None.
+
+        `rows` sono le righe attuali di quelle segnalazioni (`ReportStore.index_rows(ids)`).
+        Le nuove vengono aggiunte in fondo; se una è stata cancellata, ha cambiato giorno
+        o ha un giorno precedente all'ultimo indicizzato, l'indice va ricostruito (None).
+        """
+        current = {row["id"]: row for row in rows}
+        changed, added = [], []
+        for report_id in ids:
+            row = current.get(report_id)
+            if report_id > self.max_id:
+                if row is not None:
+                    added.append(row)
+                continue
+            position = self._position(report_id, row["giorno"]) if row is not None else None
+            if position is None:
+                return None
+            changed.append((position, row))
+        added.sort(key=lambda row: (row["giorno"], row["id"]))
+        if added and self.days and added[0]["giorno"] < self.days[-1]:
+            return None
+
+        index = copy.copy(self)
+        index.days = self.days + [row["giorno"] for row in added]
+        index.ids = self.ids + array.array("q", (row["id"] for row in added))
+        index.size = len(index.days)
+        index.all = (1 << index.size) - 1
+        index.max_id = max([self.max_id] + [row["id"] for row in added])
+        # Le posizioni modificate perdono il vecchio valore; nuove e modificate ricevono l'attuale
+        cleared = index._bitmap(position for position, _ in changed)
+        index.bitmaps = {}
+        for _, dimension in _DIMENSIONS:
+            positions = {}
+            for position, row in changed + [(self.size + i, row) for i, row in enumerate(added)]:
+                if row[dimension] is not None:
+                    positions.setdefault(row[dimension], []).append(position)
+            bitmaps = {value: bitmap & ~cleared for value, bitmap in self.bitmaps[dimension].items()}
+            for value, items in positions.items():
+                bitmaps[value] = bitmaps.get(value, 0) | index._bitmap(items)
+            index.bitmaps[dimension] = {value: bitmap for value, bitmap in bitmaps.items() if bitmap}
+        return index
+
+    def _bitmap(self, positions):
+        # Costruita come bytearray: un OR bit per bit su interi grandi costerebbe O(n) a ogni riga
+        bits = bytearray((self.size + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bytes(bits), "little")
+
+    def _day_range(self, start=None, end=None):
+        """Bit delle segnalazioni con giorno in [start, end) (date ISO)."""
+        lo = bisect.bisect_left(self.days, start) if start else 0
+        hi = bisect.bisect_left(self.days, end) if end else self.size
+        if hi <= lo:
+            return 0
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+    def mask(self, filters):
+        """Bitmap delle segnalazioni che rispettano i filtri."""
+        mask = self.all
+        for field, dimension in _DIMENSIONS:
+            values = getattr(filters, field)
+            if values:
+                selected = 0
+                for value in values:
+                    selected |= self.bitmaps[dimension].get(value, 0)
+                mask &= selected
+        if filters.dal or filters.al:
+            end = (filters.al + datetime.timedelta(days=1)).isoformat() if filters.al else None
+            mask &= self._day_range(filters.dal.isoformat() if filters.dal else None, end)
+        return mask
+
+    def counts(self, mask, dimension):
+        """Numero di segnalazioni filtrate per ogni valore del campo, in ordine decrescente."""
+        counts = [(value, _popcount(mask & bitmap)) for value, bitmap in self.bitmaps[dimension].items()]
+        return sorted((item for item in counts if item[1]), key=lambda item: (-item[1], item[0]))
+
+    def summary(self, mask, now=None):
+        week, prev_week = week_bounds(now)
+        this_week = mask & self._day_range(week)
+        previous = mask & self._day_range(prev_week, week)
+        deltas = {
+            stato: _popcount(this_week & bitmap) - _popcount(previous & bitmap)
+            for stato, bitmap in self.bitmaps["stato"].items()
+        }
+        return build_summary(self.counts(mask, "stato"), deltas)
+
+
+class LiveFilterIndex:
+    """Indice dei filtri condiviso, allineato al registro `modifiche` dell'archivio a ogni lettura."""
+
+    def __init__(self, store, rebuild_ratio=REBUILD_RATIO):
+        self.store = store
+        self.rebuild_ratio = rebuild_ratio
+        self._index = None
+        self._last_change = 0
+        self._lock = threading.Lock()
+        self.stats = {"aggiornamento": 0, "ricostruzione": 0}
+
+    def current(self):
+        """Indice che comprende tutte le modifiche registrate fino a ora."""
+        with self._lock:
+            changes, complete = self.store.changes_since(self._last_change)
+            if self._index is not None and not changes:
+                return self._index
+            index = None
+            ids = {change.segnalazione_id for change in changes}
+            if (self._index is not None and complete and None not in ids
+                    and len(ids) <= max(100, self.rebuild_ratio * self._index.size)):
+                index = self._index.updated(ids, self.store.index_rows(ids))
+            if index is not None:
+                self.stats["aggiornamento"] += 1
+                self._last_change = changes[-1].id
+            else:
+                # Le modifiche successive a questa lettura verranno riapplicate: aggiornarle è idempotente
+                self.stats["ricostruzione"] += 1
+                self._last_change = self.store.last_change()
+                index = FilterIndex(self.store.index_rows())
+            self._index = index
+            return index
+
+
+@lru_cache(maxsize=None)
+def get_filter_index(path=DB_PATH):
+    """Restituisce l'indice dei filtri condiviso dal processo."""
+    index = LiveFilterIndex(get_store(path))
+    metrics.register_collector(
+        lambda: [("filter_index_total", {"esito": esito}, n) for esito, n in index.stats.items()]
+    )
+    return index
+
+
+def sidebar_filters():
+    """Filtri della sidebar, letti dall'URL e aggiornati con "Applica Filtri".
+
+    I filtri applicati vengono scritti nei parametri dell'URL: un link condiviso
+    riproduce la stessa vista e riusa le stesse voci di cache.
+    """
+    current = from_query_params(st.query_params)
+    st.markdown("### Filtri")
+    with st.form("filtri"):
+        categorie = st.multiselect("Categorie", CATEGORIE, default=list(current.categorie))
+        quartiere = st.selectbox("Quartiere", ("Tutti",) + QUARTIERI,
+                                 index=1 + QUARTIERI.index(current.quartieri[0]) if current.quartieri else 0)
+        stato = st.selectbox("Stato", ("Tutti",) + STATI,
+                             index=1 + STATI.index(current.stati[0]) if current.stati else 0)
+        dal = st.date_input("Da data", value=current.dal)
+        al = st.date_input("A data", value=current.al)
+        applied = st.form_submit_button("Applica Filtri")
+
+    if applied:
+        current = normalize(ReportFilter(
+            categorie=tuple(categorie),
+            stati=() if stato == "Tutti" else (stato,),
+            quartieri=() if quartiere == "Tutti" else (quartiere,),
+            dal=dal,
+            al=al,
+        ))
+        st.query_params.from_dict(to_query_params(current))
+    if not is_empty(current) and st.button("Rimuovi Filtri"):
+        st.query_params.clear()
+        st.rerun()
+    return current
@@ -0,0 +1,122 @@
+"""Mappa delle segnalazioni per riquadri: solo i punti visibili, raggruppati agli zoom bassi.
+
+La vista corrente (riquadro e zoom restituiti da `st_folium`) viene allineata alla
+griglia delle tile della mappa: piccoli spostamenti ricadono nella stessa tile e
+riusano lo strato già calcolato in cache.
+"""
+import html
+import math
+
+NAPOLI_CENTER = (40.8518, 14.2681)
+DEFAULT_ZOOM = 13
+# Riquadro iniziale sul territorio comunale (sud, ovest, nord, est)
+NAPOLI_BBOX = (40.79, 14.13, 40.92, 14.35)
+
+# Sopra questo zoom (o sotto MAX_MARKERS punti) si mostrano le singole segnalazioni
+DETAIL_ZOOM = 16
+MAX_MARKERS = 300
+# Celle di raggruppamento per lato di tile (una tile è 256 px: celle da circa 32 px)
+CELLS_PER_TILE = 8
+
+CATEGORY_COLORS = {
+    "Strada Pubblica": "red", "Verde Urbano": "darkgreen",
+    "Edifici e Infrastrutture": "orange", "Altre criticità": "blue",
+}
+RISK_COLORS = {1: "#2A9D8F", 2: "#F4A261", 3: "#E63946"}
+
+
+def tile_degrees(zoom):
+    """Lato di una tile in gradi di longitudine allo zoom indicato."""
+    return 360.0 / (2 ** zoom)
+
+
+def snap_bbox(bbox, zoom):
+    """Allarga il riquadro ai bordi delle tile che lo contengono."""
+    size = tile_degrees(zoom)
+    south, west, north, east = bbox
+    return (
+        math.floor(south / size) * size,
+        math.floor(west / size) * size,
+        math.ceil(north / size) * size,
+        math.ceil(east / size) * size,
+    )
+
+
+def view_key(bbox, zoom):
+    """Chiave di cache di una vista: zoom intero e riquadro allineato alle tile."""
+    zoom = int(round(zoom))
+    return zoom, tuple(round(v, 6) for v in snap_bbox(bbox, zoom))
+
+
+def bbox_from_bounds(bounds):
+    """Converte i `bounds` restituiti da `st_folium` in (sud, ovest, nord, est)."""
+    return (
+        bounds["_southWest"]["lat"], bounds["_southWest"]["lng"],
+        bounds["_northEast"]["lat"], bounds["_northEast"]["lng"],
+    )
+
+
+def popup_html(point):
+    return f"""
+    <div style='font-family:sans-serif;'>
+        <h4>{html.escape(point['categoria'])}</h4>
+        <p><b>Descrizione:</b> {html.escape(point['descrizione'])}</p>
+        <p><b>Stato:</b> {html.escape(point['stato'])}</p>
+        {f"<p><b>Segnalato</b> {point['segnalazioni']} volte</p>" if point.get('segnalazioni', 1) > 1 else ""}
+    </div>
+    """
+
+
+def viewport_layer(store, bbox, zoom, filters=None, max_markers=MAX_MARKERS):
+    """Dati dello strato per la vista: punti singoli oppure celle raggruppate.
+
+    Il risultato contiene solo tipi semplici (serializzabili) con l'HTML dei popup
+    già generato, così può essere messo in cache per tile.
+    """
+    total = store.count_in_bbox(bbox, filters)
+    if zoom >= DETAIL_ZOOM or total <= max_markers:
+        points = store.points_in_bbox(bbox, max_markers, filters)
+        for point in points:
+            point["popup"] = popup_html(point)
+        return {"modo": "punti", "totale": total, "punti": points}
+
+    cell = tile_degrees(zoom) / CELLS_PER_TILE
+    clusters = store.grid_clusters(bbox, cell, filters)
+    for cluster in clusters:
+        detail = "<br>".join(f"{html.escape(name)}: {n}" for name, n in sorted(cluster["categorie"].items()))
+        cluster["popup"] = (
+            f"<div style='font-family:sans-serif;'><h4>{cluster['n']} segnalazioni</h4>"
+            f"<p>{detail}</p></div>"
+        )
+    return {"modo": "cluster", "totale": total, "punti": clusters}
+
+
+def build_map(layer, center, zoom):
+    """Mappa folium con lo strato calcolato da `viewport_layer`."""
+    import folium
+
+    m = folium.Map(location=list(center), zoom_start=zoom)
+    if layer["modo"] == "punti":
+        for point in layer["punti"]:
+            folium.Marker(
+                [point['lat'], point['lon']],
+                popup=folium.Popup(point["popup"], max_width=300),
+                icon=folium.Icon(color=CATEGORY_COLORS.get(point['categoria'], 'blue'), icon="info-sign")
+            ).add_to(m)
+    else:
+        biggest = max((c["n"] for c in layer["punti"]), default=1)
+        for cluster in layer["punti"]:
+            # Raggio proporzionale al logaritmo del numero di segnalazioni
+            radius = 6 + 24 * math.log1p(cluster["n"]) / math.log1p(biggest)
+            color = RISK_COLORS.get(cluster["livello_max"], "#264653")
+            folium.CircleMarker(
+                [cluster["lat"], cluster["lon"]],
+                radius=radius,
+                color=color,
+                fill=True,
+                fill_color=color,
+                fill_opacity=0.6,
+                tooltip=f"{cluster['n']} segnalazioni",
+                popup=folium.Popup(cluster["popup"], max_width=300),
+            ).add_to(m)
+    return m
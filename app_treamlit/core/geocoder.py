@@ -0,0 +1,193 @@
+"""Geocodifica offline delle localizzazioni a Napoli.
+
+Le localizzazioni inserite come testo libero vengono risolte su un gazetteer
+locale (`data/gazetteer_napoli.csv`: quartieri, zone, piazze, vie e luoghi) senza
+chiamare servizi esterni. I nomi sono normalizzati (minuscole, senza accenti,
+abbreviazioni espanse, numeri civici rimossi) e indicizzati in un trie di
+prefissi per i suggerimenti; i risultati sono memorizzati. La geocodifica accetta
+solo nomi esatti, contenuti nell'indirizzo o completati dal trie: i nomi scritti in
+modo impreciso sono proposti tra i suggerimenti, dove l'utente li conferma.
+"""
+import csv
+import difflib
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+from core.config import get_setting
+
+GAZETTEER_PATH = get_setting(
+    "GAZETTEER",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "gazetteer_napoli.csv"),
+)
+MAX_SUGGESTIONS = 8
+# Somiglianza minima per suggerire un nome scritto in modo impreciso
+FUZZY_CUTOFF = 0.6
+
+ABBREVIAZIONI = {
+    "p": "piazza", "p.za": "piazza", "p.zza": "piazza", "pza": "piazza", "pzza": "piazza",
+    "v": "via", "c.so": "corso", "cso": "corso", "v.le": "viale", "vle": "viale",
+    "l.go": "largo", "lgo": "largo", "s": "san", "s.": "san", "sta": "santa", "s.ta": "santa",
+}
+TIPI_STRADA = {"via", "viale", "piazza", "piazzale", "corso", "largo", "vico", "vicolo", "salita", "calata"}
+# Luoghi estesi: le loro coordinate sono il centro dell'area, non un punto preciso
+TIPI_AREA = {"quartiere", "zona", "via"}
+# Parole senza valore in fondo all'indirizzo (città, provincia)
+PAROLE_IGNORATE = {"napoli", "na", "italia"}
+
+
+class Place(NamedTuple):
+    nome: str
+    # "quartiere", "zona", "piazza", "via" oppure "luogo"
+    tipo: str
+    quartiere: str
+    lat: float
+    lon: float
+
+
+def normalize_name(text):
+    """Forma di confronto di un nome: minuscolo, senza accenti, numeri civici e CAP."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = []
+    for word in re.split(r"[\s,;/'’\-]+", text):
+        word = word.strip("()")
+        word = ABBREVIAZIONI.get(word) or ABBREVIAZIONI.get(word.rstrip("."), word.strip("."))
+        # I numeri (civici, CAP) non servono a trovare la via
+        if word and not re.fullmatch(r"\d+[a-z]?", word):
+            words.append(word)
+    # La città in fondo ("..., Napoli", "Napoli NA") non fa parte del nome, "Via Napoli" sì
+    while len(words) > 1 and words[-1] in PAROLE_IGNORATE and words[-2] not in TIPI_STRADA:
+        words.pop()
+    return " ".join(words)
+
+
+def _is_street(place):
+    return normalize_name(place.nome).split(" ")[0] in TIPI_STRADA
+
+
+def _mentions(words, name):
+    """Vero se il nome compare tra le parole dell'indirizzo e non come nome di una strada.
+
+    In "via stella" o "largo barra" il quartiere non c'entra: è una via che il
+    gazetteer non conosce, e un quartiere sbagliato è peggio di nessun risultato.
+    """
+    size = len(name)
+    for i in range(len(words) - size + 1):
+        if words[i:i + size] == name and (i == 0 or words[i - 1] not in TIPI_STRADA):
+            return True
+    return False
+
+
+class PrefixTrie:
+    """Trie dei prefissi: ogni nodo conserva già i primi `limit` risultati."""
+
+    def __init__(self, limit=MAX_SUGGESTIONS):
+        self.limit = limit
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+            values = node.setdefault(None, [])
+            if len(values) < self.limit and value not in values:
+                values.append(value)
+
+    def complete(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return list(node.get(None, []))
+
+
+class Gazetteer:
+    """Nomi di Napoli con posizione e quartiere, con ricerca esatta e per prefisso.
+
+    La ricerca approssimata è usata solo per i suggerimenti.
+    """
+
+    def __init__(self, places):
+        # Prima i nomi più brevi (più generici) a parità di prefisso
+        self.places = sorted(places, key=lambda place: (len(place.nome), place.nome))
+        self.by_name = {normalize_name(place.nome): place for place in self.places}
+        # Tipo del luogo per coordinate (arrotondate): a parità di punto vale l'area
+        self.points = {}
+        for place in self.places:
+            point = (round(place.lat, 4), round(place.lon, 4))
+            if self.points.get(point) not in TIPI_AREA:
+                self.points[point] = place.tipo
+        # Per la ricerca di un nome dentro un indirizzo più lungo: prima i più specifici
+        self._longest_first = sorted(self.by_name, key=len, reverse=True)
+        self.trie = PrefixTrie()
+        for place in self.places:
+            words = normalize_name(place.nome).split(" ")
+            # Ogni parola del nome è un possibile inizio: "toledo" trova "Via Toledo"
+            for i in range(len(words)):
+                self.trie.insert(" ".join(words[i:]), place)
+
+    def suggest(self, text):
+        """Luoghi che iniziano con il testo (o con una sua parola), per l'autocompletamento."""
+        key = normalize_name(text)
+        if not key:
+            return []
+        suggestions = self.trie.complete(key)
+        if not suggestions:
+            close = difflib.get_close_matches(key, self.by_name, n=MAX_SUGGESTIONS, cutoff=FUZZY_CUTOFF)
+            suggestions = [self.by_name[name] for name in close]
+        return suggestions
+
+    def place_type(self, lat, lon):
+        """Tipo del luogo del gazetteer che ha esattamente queste coordinate, oppure None."""
+        return self.points.get((round(lat, 4), round(lon, 4)))
+
+    def geocode(self, text):
+        """Luogo corrispondente a una localizzazione in testo libero, oppure None."""
+        key = normalize_name(text or "")
+        if not key:
+            return None
+        if key in self.by_name:
+            return self.by_name[key]
+        # Indirizzo che contiene un nome noto ("via toledo angolo ..." oppure "... vomero")
+        words = key.split(" ")
+        for name in self._longest_first:
+            if _mentions(words, name.split(" ")):
+                return self.by_name[name]
+        completions = self.trie.complete(key)
+        if not completions and len(words) > 1 and words[0] in TIPI_STRADA:
+            # "via scarlatti" per "Via Alessandro Scarlatti": si cerca il resto del nome,
+            # ma solo tra le strade ("via stella" non è il quartiere Stella)
+            completions = [place for place in self.trie.complete(" ".join(words[1:])) if _is_street(place)]
+        return completions[0] if completions else None
+
+
+def load_places(path=GAZETTEER_PATH):
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            yield Place(row["nome"], row["tipo"], row["quartiere"], float(row["lat"]), float(row["lon"]))
+
+
+@lru_cache(maxsize=None)
+def get_gazetteer(path=GAZETTEER_PATH):
+    """Gazetteer condiviso dal processo, caricato al primo utilizzo."""
+    return Gazetteer(load_places(path))
+
+
+@lru_cache(maxsize=4096)
+def geocode(text):
+    """Come `Gazetteer.geocode` sul gazetteer condiviso, con i risultati memorizzati."""
+    return get_gazetteer().geocode(text)
+
+
+def place_type(lat, lon):
+    """Come `Gazetteer.place_type` sul gazetteer condiviso."""
+    return get_gazetteer().place_type(lat, lon)
+
+
+@lru_cache(maxsize=4096)
+def suggest(text):
+    return tuple(get_gazetteer().suggest(text))
@@ -0,0 +1,130 @@
+"""Preparazione delle immagini prima dell'invio al modello.
+
+Le foto dei telefoni (12 megapixel e oltre) vengono ridimensionate, ricompresse e
+ripulite dai metadati EXIF; il risultato è memorizzato per hash del contenuto, così
+i rerun di Streamlit non ricodificano la stessa immagine.
+"""
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from core.config import get_setting
+
+# Claude ridimensiona comunque oltre i 1568 px sul lato lungo
+MAX_EDGE = int(get_setting("IMAGE_MAX_EDGE", 1568))
+QUALITY = int(get_setting("IMAGE_QUALITY", 85))
+OUTPUT_FORMAT = str(get_setting("IMAGE_FORMAT", "JPEG")).upper()
+CACHE_SIZE = 64
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def _check_format(output_format):
+    if output_format not in MIME_TYPES:
+        raise ValueError(f"Formato immagine non supportato: {output_format} (ammessi: {', '.join(MIME_TYPES)})")
+    return output_format
+
+
+_check_format(OUTPUT_FORMAT)
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    sha256: str
+    width: int
+    height: int
+
+    @property
+    def base64(self):
+        return base64.b64encode(self.data).decode("utf-8")
+
+    @property
+    def data_uri(self):
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+def detect_mime_type(data):
+    """Riconosce il formato dai primi byte del file, senza fidarsi dell'estensione."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _encode(data, digest, max_edge, quality, output_format):
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Applica l'orientamento EXIF prima di scartare i metadati
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            # JPEG non supporta la trasparenza: sfondo bianco
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+
+        buffer = io.BytesIO()
+        # Senza il parametro `exif` Pillow non riscrive i metadati
+        image.save(buffer, format=output_format, quality=quality, optimize=True)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        # Formato non gestito da Pillow, file troncato o con dimensioni sospette
+        # (decompression bomb): si invia il file originale senza decodificarlo
+        return PreparedImage(data, detect_mime_type(data), digest, 0, 0)
+    return PreparedImage(buffer.getvalue(), MIME_TYPES[output_format], digest, image.width, image.height)
+
+
+def prepare_image(data, max_edge=MAX_EDGE, quality=QUALITY, output_format=OUTPUT_FORMAT):
+    """Ridimensiona, ricomprime e ripulisce un'immagine caricata (bytes)."""
+    output_format = _check_format(output_format.upper())
+    digest = hashlib.sha256(data).hexdigest()
+    key = (digest, max_edge, quality, output_format)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    prepared = _encode(data, digest, max_edge, quality, output_format)
+
+    with _cache_lock:
+        _cache[key] = prepared
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prepared
+
+
+def perceptual_hash(image, size=8):
+    """dHash a 64 bit (esadecimale) di un'immagine preparata.
+
+    Foto quasi identiche (stessa scena, piccole differenze di inquadratura o
+    compressione) producono hash con pochi bit diversi.
+    """
+    gray = Image.open(io.BytesIO(image.data)).convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    """Numero di bit diversi tra due hash esadecimali."""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
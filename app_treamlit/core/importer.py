@@ -0,0 +1,379 @@
+"""Importazione massiva dello storico delle segnalazioni da CSV ed Excel.
+
+Il file è letto a blocchi di `CHUNK_SIZE` righe. Ogni blocco è validato per
+colonne con pandas (date, categorie, livelli e stati normalizzati sui valori
+ammessi di `core.choices`, coordinate entro il territorio comunale) invece che
+riga per riga con pydantic; le localizzazioni distinte del blocco sono geocodificate
+una volta sola e le righe valide sono salvate in un'unica transazione, passando dal
+riconoscimento dei duplicati. Le righe scartate, con il motivo, vanno in un file
+CSV a parte.
+
+Da riga di comando, dalla cartella `app_treamlit`:
+
+    python -m core.importer storico.xlsx --scarti storico_scarti.csv
+"""
+import argparse
+import csv
+import datetime
+import io
+import os
+import re
+import sys
+import time
+import unicodedata
+from typing import NamedTuple, Optional
+
+from core import metrics
+from core.choices import CATEGORIE, LIVELLI, QUARTIERI, STATI
+from core.geo import NAPOLI_BBOX
+from core.geocoder import geocode
+from core.store import COLONNE_INSERIMENTO, DATE_FORMAT, get_store
+
+CHUNK_SIZE = 5000
+# Margine attorno al territorio comunale per le coordinate (gradi, circa 2 km)
+BBOX_MARGIN = 0.02
+# Formati delle date provati nell'ordine (gli altri sono interpretati uno per uno, giorno prima del mese)
+FORMATI_DATA = (
+    "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
+    "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y",
+)
+OBBLIGATORIE = ("data", "categoria", "livello_pericolosita", "descrizione")
+
+# Intestazioni accettate per ogni colonna (già normalizzate con `_key`)
+ALIAS_COLONNE = {
+    "data": ("data", "data_segnalazione", "data_ora", "date", "giorno"),
+    "location": ("location", "localizzazione", "luogo", "indirizzo", "posizione", "via"),
+    "quartiere": ("quartiere", "municipalita_quartiere", "zona"),
+    "lat": ("lat", "latitudine", "latitude"),
+    "lon": ("lon", "lng", "long", "longitudine", "longitude"),
+    "categoria": ("categoria", "tipo", "tipologia", "category"),
+    "stato": ("stato", "status", "esito"),
+    "livello_pericolosita": ("livello_pericolosita", "livello", "pericolosita", "gravita", "priorita"),
+    "descrizione": ("descrizione", "description", "problema", "dettaglio", "note"),
+    "raccomandazione": ("raccomandazione", "intervento", "azione", "raccomandazioni"),
+}
+
+# Valori storici ricondotti alle categorie ammesse (chiavi normalizzate con `_key`)
+ALIAS_CATEGORIE = {
+    "strada": "Strada Pubblica", "strade": "Strada Pubblica", "stradale": "Strada Pubblica",
+    "viabilita": "Strada Pubblica", "manto_stradale": "Strada Pubblica", "marciapiede": "Strada Pubblica",
+    "buca": "Strada Pubblica", "buche": "Strada Pubblica",
+    "verde": "Verde Urbano", "verde_pubblico": "Verde Urbano", "alberi": "Verde Urbano",
+    "albero": "Verde Urbano", "parchi": "Verde Urbano", "giardini": "Verde Urbano",
+    "edifici": "Edifici e Infrastrutture", "edificio": "Edifici e Infrastrutture",
+    "infrastrutture": "Edifici e Infrastrutture", "edilizia": "Edifici e Infrastrutture",
+    "altro": "Altre criticità", "altre": "Altre criticità", "varie": "Altre criticità",
+    "illuminazione": "Altre criticità", "segnaletica": "Altre criticità", "rifiuti": "Altre criticità",
+}
+ALIAS_STATI = {
+    "aperta": "Nuova", "nuovo": "Nuova", "da_assegnare": "Nuova",
+    "assegnato": "Assegnata", "in_corso": "In lavorazione", "lavorazione": "In lavorazione",
+    "risolto": "Risolta", "completata": "Risolta", "chiuso": "Chiusa", "archiviata": "Chiusa",
+}
+
+
+def _key(text):
+    """Forma di confronto di intestazioni e valori: minuscolo, senza accenti né punteggiatura."""
+    text = unicodedata.normalize("NFKD", str(text).strip().lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", "_", text).strip("_")
+
+
+def _lookup(allowed, aliases=None):
+    """Dizionario valore normalizzato -> valore ammesso."""
+    table = {_key(value): value for value in allowed}
+    table.update(aliases or {})
+    return table
+
+
+CATEGORIE_NORMALIZZATE = _lookup(CATEGORIE, ALIAS_CATEGORIE)
+STATI_NORMALIZZATI = _lookup(STATI, ALIAS_STATI)
+QUARTIERI_NORMALIZZATI = _lookup(QUARTIERI)
+LIVELLI_NORMALIZZATI = {
+    **{str(n): n for n in LIVELLI}, **{f"{n}_0": n for n in LIVELLI},
+    **{_key(nome): n for n, nome in LIVELLI.items()}, "bassa": 1, "media": 2, "alta": 3, "urgente": 3,
+}
+
+
+class ImportResult(NamedTuple):
+    lette: int
+    importate: int
+    scartate: int
+    secondi: float
+    # File con le righe scartate (None se non ce ne sono o se non è stato richiesto)
+    file_scarti: Optional[str] = None
+
+    @property
+    def righe_al_secondo(self):
+        return self.lette / self.secondi if self.secondi else 0.0
+
+
+def rename_columns(frame):
+    """Rinomina le colonne riconosciute; le altre restano come sono (e vengono ignorate)."""
+    aliases = {alias: column for column, names in ALIAS_COLONNE.items() for alias in names}
+    renamed = {}
+    for original in frame.columns:
+        column = aliases.get(_key(original))
+        if column and column not in renamed.values():
+            renamed[original] = column
+    return frame.rename(columns=renamed)
+
+
+def _normalize_values(series, table):
+    """Mappa ogni valore distinto una sola volta; i valori non riconosciuti diventano NA."""
+    values = series.dropna().unique()
+    mapping = {value: table.get(_key(value)) for value in values}
+    return series.map(mapping)
+
+
+def parse_dates(series):
+    """Date di una colonna: formati noti con il parser vettoriale, il resto uno per uno."""
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    parsed = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    pending = series.notna()
+    # Le celle di Excel sono già date
+    is_date = series.map(lambda v: isinstance(v, (datetime.date, datetime.datetime)))
+    parsed[is_date] = pd.to_datetime(series[is_date], errors="coerce")
+    pending &= ~is_date
+    text = series.where(pending).astype(object).map(lambda v: str(v).strip(), na_action="ignore")
+    for date_format in FORMATI_DATA:
+        if not pending.any():
+            break
+        attempt = pd.to_datetime(text[pending], format=date_format, errors="coerce")
+        parsed[attempt.index] = parsed[attempt.index].fillna(attempt)
+        pending &= parsed.isna()
+    if pending.any():
+        parsed[pending] = pd.to_datetime(text[pending], errors="coerce", dayfirst=True, format="mixed")
+    return parsed
+
+
+def validate(frame, default_stato="Nuova", now=None):
+    """Valida e normalizza un blocco; restituisce (valide, scartate con colonna `motivo`).
+
+    Le righe valide hanno le colonne di `COLONNE_INSERIMENTO`, già nel formato dell'archivio;
+    quelle scartate mantengono intestazioni e valori del file.
+    """
+    import pandas as pd
+
+    now = now or datetime.datetime.now()
+    # Le righe scartate si restituiscono con le intestazioni del file, da correggere e reimportare
+    original = frame
+    frame = rename_columns(frame)
+    motivo = pd.Series("", index=frame.index, dtype=object)
+
+    def reject(mask, reason):
+        motivo[mask & (motivo == "")] = reason
+
+    for column in OBBLIGATORIE:
+        if column not in frame:
+            frame[column] = None
+
+    # Testo: spazi rimossi, celle vuote come valori mancanti
+    text = {}
+    for column in ("location", "quartiere", "categoria", "stato", "descrizione", "raccomandazione"):
+        if column in frame:
+            values = frame[column].astype(object).where(frame[column].notna())
+            values = values.map(lambda v: str(v).strip() or None, na_action="ignore")
+            text[column] = values
+        else:
+            text[column] = pd.Series(None, index=frame.index, dtype=object)
+
+    data = parse_dates(frame["data"])
+    reject(data.isna(), "data non valida")
+    reject(data > pd.Timestamp(now), "data futura")
+
+    categoria = _normalize_values(text["categoria"], CATEGORIE_NORMALIZZATE)
+    reject(text["categoria"].isna(), "categoria mancante")
+    reject(categoria.isna(), "categoria non riconosciuta")
+
+    livello_testo = frame["livello_pericolosita"].astype(object).map(
+        lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else v, na_action="ignore"
+    )
+    livello = _normalize_values(livello_testo, LIVELLI_NORMALIZZATI)
+    reject(livello.isna(), "livello di pericolosità non valido (1-3 o Basso/Medio/Alto)")
+
+    reject(text["descrizione"].isna(), "descrizione mancante")
+
+    stato = _normalize_values(text["stato"], STATI_NORMALIZZATI)
+    reject(text["stato"].notna() & stato.isna(), "stato non riconosciuto")
+    stato = stato.where(text["stato"].notna(), default_stato)
+
+    # Coordinate: se indicate devono essere numeriche e nel territorio comunale
+    south, west, north, east = NAPOLI_BBOX
+    lat = pd.to_numeric(frame["lat"], errors="coerce") if "lat" in frame else pd.Series(float("nan"), index=frame.index)
+    lon = pd.to_numeric(frame["lon"], errors="coerce") if "lon" in frame else pd.Series(float("nan"), index=frame.index)
+    has_position = lat.notna() & lon.notna()
+    outside = ~lat.between(south - BBOX_MARGIN, north + BBOX_MARGIN) | ~lon.between(west - BBOX_MARGIN, east + BBOX_MARGIN)
+    reject(has_position & outside, "coordinate fuori dal territorio comunale")
+
+    quartiere = _normalize_values(text["quartiere"], QUARTIERI_NORMALIZZATI)
+
+    valid = motivo == ""
+    rejected = original[~valid].copy()
+    rejected["motivo"] = motivo[~valid]
+
+    result = pd.DataFrame({
+        "data": data[valid].dt.strftime(DATE_FORMAT),
+        "location": text["location"][valid],
+        "quartiere": quartiere[valid],
+        "lat": lat[valid].where(has_position[valid]),
+        "lon": lon[valid].where(has_position[valid]),
+        "categoria": categoria[valid],
+        "stato": stato[valid],
+        "livello_pericolosita": livello[valid],
+        "descrizione": text["descrizione"][valid],
+        "raccomandazione": text["raccomandazione"][valid].fillna(""),
+    })
+    return geocode_frame(result), rejected
+
+
+def geocode_frame(frame):
+    """Completa quartiere e coordinate dalle localizzazioni, una chiamata per valore distinto."""
+    missing = frame["location"].notna() & (frame["quartiere"].isna() | frame["lat"].isna())
+    places = {location: geocode(location) for location in frame.loc[missing, "location"].unique()}
+    if not places:
+        return frame
+    place = frame["location"].where(missing).map(places)
+    for column in ("quartiere", "lat", "lon"):
+        fill = place.map(lambda p: getattr(p, column), na_action="ignore")
+        frame[column] = frame[column].where(frame[column].notna(), fill)
+    # Le coordinate vanno completate insieme: mai una latitudine senza longitudine
+    incomplete = frame["lat"].isna() | frame["lon"].isna()
+    frame.loc[incomplete, ["lat", "lon"]] = None
+    return frame
+
+
+def _records(frame):
+    """Tuple per `ReportStore.add_many`, con None al posto dei valori mancanti."""
+    frame = frame[list(COLONNE_INSERIMENTO)].astype(object)
+    frame = frame.where(frame.notna(), None)
+    return [
+        tuple(int(v) if column == "livello_pericolosita" else v for column, v in zip(COLONNE_INSERIMENTO, row))
+        for row in frame.itertuples(index=False, name=None)
+    ]
+
+
+def _detect_encoding(sample):
+    try:
+        sample.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError as error:
+        # Un campione troncato può tagliare un carattere a metà solo alla fine
+        return "utf-8-sig" if error.start >= len(sample) - 3 else "cp1252"
+
+
+def read_chunks(source, name=None, chunk_size=CHUNK_SIZE):
+    """Blocchi (DataFrame di testo) di un file CSV o Excel, dal percorso o da un file aperto."""
+    import pandas as pd
+
+    name = name or getattr(source, "name", None) or str(source)
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        yield from _excel_chunks(source, chunk_size)
+        return
+    fileobj = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+    try:
+        sample = fileobj.read(64 * 1024)
+        fileobj.seek(0)
+        encoding = _detect_encoding(sample)
+        first_line = sample.decode(encoding, errors="replace").splitlines()[0] if sample else ""
+        # I CSV salvati da Excel in italiano usano il punto e virgola
+        delimiter = max((";", ",", "\t"), key=first_line.count)
+        yield from pd.read_csv(fileobj, sep=delimiter, encoding=encoding, dtype=str,
+                               keep_default_na=False, na_values=[""], chunksize=chunk_size)
+    finally:
+        if fileobj is not source:
+            fileobj.close()
+
+
+def _excel_chunks(source, chunk_size):
+    """Blocchi del primo foglio Excel, letto in modalità streaming (openpyxl)."""
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(value) if value is not None else f"colonna_{i}" for i, value in enumerate(next(rows, ()))]
+        chunk = []
+        for row in rows:
+            if any(value is not None and value != "" for value in row):
+                chunk.append(row[:len(header)])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def import_reports(source, store=None, name=None, rejects=None, chunk_size=CHUNK_SIZE,
+                   default_stato="Nuova", dedup=True, progress=None):
+    """Importa un file nell'archivio.
+
+    `rejects` è il percorso (o il file binario aperto) dove scrivere le righe scartate
+    in CSV; `progress(lette, importate, scartate)` viene chiamata dopo ogni blocco.
+    """
+    store = store or get_store()
+    start = time.perf_counter()
+    read = imported = rejected = 0
+    rejects_file = None
+    writer = None
+    try:
+        for chunk in read_chunks(source, name, chunk_size):
+            with metrics.timer("import_chunk_seconds"):
+                valid, bad = validate(chunk, default_stato)
+                imported += store.add_many(_records(valid), dedup=dedup) if len(valid) else 0
+            read += len(chunk)
+            rejected += len(bad)
+            if len(bad) and rejects is not None:
+                if writer is None:
+                    rejects_file = open(rejects, "w", newline="", encoding="utf-8") if isinstance(
+                        rejects, (str, os.PathLike)) else io.TextIOWrapper(rejects, encoding="utf-8", newline="")
+                    writer = csv.writer(rejects_file)
+                    writer.writerow(bad.columns)
+                writer.writerows(bad.astype(object).where(bad.notna(), "").itertuples(index=False, name=None))
+            metrics.increment("import_rows_total", len(chunk) - len(bad), esito="importate")
+            metrics.increment("import_rows_total", len(bad), esito="scartate")
+            if progress:
+                progress(read, imported, rejected)
+    finally:
+        if rejects_file is not None:
+            rejects_file.flush()
+            if isinstance(rejects, (str, os.PathLike)):
+                rejects_file.close()
+            else:
+                # Il file binario resta aperto per chi lo ha passato
+                rejects_file.detach()
+    return ImportResult(read, imported, rejected, time.perf_counter() - start,
+                        str(rejects) if rejected and isinstance(rejects, (str, os.PathLike)) else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa lo storico delle segnalazioni da CSV o Excel.")
+    parser.add_argument("file", help="file .csv o .xlsx")
+    parser.add_argument("--scarti", help="CSV delle righe scartate (predefinito: <file>_scarti.csv)")
+    parser.add_argument("--blocco", type=int, default=CHUNK_SIZE, help="righe per blocco")
+    parser.add_argument("--stato", default="Nuova", choices=STATI, help="stato delle righe senza stato")
+    parser.add_argument("--senza-dedup", action="store_true", help="non unire le segnalazioni duplicate")
+    args = parser.parse_args(argv)
+
+    rejects = args.scarti or f"{os.path.splitext(args.file)[0]}_scarti.csv"
+
+    def progress(read, imported, rejected):
+        print(f"\r{read:,} righe lette, {imported:,} importate, {rejected:,} scartate", end="", file=sys.stderr)
+
+    result = import_reports(args.file, rejects=rejects, chunk_size=args.blocco, default_stato=args.stato,
+                            dedup=not args.senza_dedup, progress=progress)
+    print(file=sys.stderr)
+    print(f"{result.importate:,} segnalazioni importate, {result.scartate:,} scartate "
+          f"in {result.secondi:.1f} s ({result.righe_al_secondo:,.0f} righe/s)")
+    if result.file_scarti:
+        print(f"Righe scartate: {result.file_scarti}")
+
+
+if __name__ == "__main__":
+    main()
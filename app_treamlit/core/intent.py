@@ -0,0 +1,71 @@
+"""Classificazione dell'intento dei messaggi della chat, prima di chiamare il modello.
+
+Gli intenti con una risposta predefinita (ad esempio le richieste di segnalazione,
+che vanno gestite nella scheda "Valutazione Rischio") non richiedono alcuna chiamata
+al modello. Il classificatore si può sostituire con l'impostazione
+`INTENT_CLASSIFIER`, nel formato `modulo:Classe`.
+"""
+import importlib
+from typing import NamedTuple, Optional
+
+import streamlit as st
+
+from core.config import get_setting
+
+
+class Intent(NamedTuple):
+    name: str
+    # Risposta predefinita: se presente, il turno non passa dal modello
+    response: Optional[str] = None
+
+    @property
+    def is_redirect(self):
+        return self.response is not None
+
+
+CHAT = Intent("chat")
+SEGNALAZIONE = Intent(
+    "segnalazione",
+    "Per effettuare una segnalazione, vai alla scheda 'Valutazione Rischio' ⚠️.",
+)
+
+
+class IntentClassifier:
+    """Interfaccia dei classificatori: `classify(testo) -> Intent`."""
+
+    def classify(self, text):
+        raise NotImplementedError
+
+
+class KeywordIntentClassifier(IntentClassifier):
+    """Classificatore a parole chiave: il primo intento con una parola presente nel testo vince."""
+
+    DEFAULT_RULES = (
+        (SEGNALAZIONE, ("segnalazione", "rischio", "pericolo")),
+    )
+
+    def __init__(self, rules=DEFAULT_RULES, default=CHAT):
+        self.rules = tuple((intent, tuple(k.lower() for k in keywords)) for intent, keywords in rules)
+        self.default = default
+
+    def classify(self, text):
+        text = text.lower()
+        for intent, keywords in self.rules:
+            if any(keyword in text for keyword in keywords):
+                return intent
+        return self.default
+
+
+def create_classifier(spec=None):
+    """Crea il classificatore indicato (`keyword` oppure `modulo:Classe`)."""
+    spec = spec or get_setting("INTENT_CLASSIFIER", "keyword")
+    if spec == "keyword":
+        return KeywordIntentClassifier()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+@st.cache_resource(show_spinner=False)
+def get_classifier():
+    """Classificatore condiviso dal processo."""
+    return create_classifier()
@@ -0,0 +1,303 @@
+"""Coda persistente delle valutazioni di rischio, eseguita da worker in background.
+
+Le pagine accodano un lavoro e tornano subito all'utente; i worker (thread del
+processo Streamlit) eseguono la chiamata al modello e salvano il risultato. I lavori
+sono salvati in SQLite, quindi sopravvivono ai rerun e ai riavvii del processo.
+
+Ogni lavoro in esecuzione registra il processo che lo esegue, che ne aggiorna il
+battito a intervalli regolari: solo i lavori senza battito da `JOB_STALE_SECONDS`
+(processo terminato) vengono rimessi in coda, così un secondo processo non ripete
+i lavori di un altro ancora attivo. Un lavoro fallito torna in coda con un'attesa
+esponenziale (`disponibile_da`), come i tentativi di `core.batch`.
+"""
+import datetime
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from functools import lru_cache
+
+from core.assessment import assess_image
+from core.config import get_setting
+from core.geocoder import Place
+from core.images import PreparedImage
+from core.schema import RiskAssessment
+from core.store import DB_PATH, SQLiteStore, format_date
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lavori (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stato TEXT NOT NULL DEFAULT 'in coda',
+    creato TEXT NOT NULL,
+    iniziato TEXT,
+    completato TEXT,
+    tentativi INTEGER NOT NULL DEFAULT 0,
+    immagine BLOB NOT NULL,
+    mime_type TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    location TEXT,
+    -- Luogo del gazetteer scelto dall'utente (JSON di `Place`), NULL se nessuno
+    luogo TEXT,
+    -- Processo che esegue il lavoro ("host:pid") e ultimo segno di vita
+    proprietario TEXT,
+    battito TEXT,
+    -- Un lavoro da ritentare non viene preso in carico prima di questa data
+    disponibile_da TEXT,
+    risultato TEXT,
+    risposta TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    report_id INTEGER,
+    errore TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_lavori_stato ON lavori(stato, id);
+"""
+
+# Stati di un lavoro
+IN_CODA = "in coda"
+IN_ESECUZIONE = "in esecuzione"
+COMPLETATO = "completato"
+NON_INTERPRETABILE = "non interpretabile"
+ERRORE = "errore"
+STATI_FINALI = (COMPLETATO, NON_INTERPRETABILE, ERRORE)
+
+# Numero di worker: limita le chiamate contemporanee al modello dell'intero processo
+WORKERS = int(get_setting("JOB_WORKERS", 2))
+MAX_ATTEMPTS = int(get_setting("JOB_MAX_ATTEMPTS", 3))
+POLL_INTERVAL = float(get_setting("JOB_POLL_INTERVAL", 1.0))
+# Attesa di base prima di ritentare un lavoro fallito (raddoppia a ogni tentativo)
+RETRY_BACKOFF = float(get_setting("JOB_RETRY_BACKOFF", 5.0))
+# Senza battito per questo intervallo un lavoro in esecuzione è considerato abbandonato
+STALE_AFTER = float(get_setting("JOB_STALE_SECONDS", 120))
+HEARTBEAT_INTERVAL = STALE_AFTER / 4
+# I dati delle immagini dei lavori conclusi vengono eliminati dopo questo intervallo
+RETENTION_DAYS = int(get_setting("JOB_RETENTION_DAYS", 7))
+
+
+def _now(seconds=0):
+    return format_date(datetime.datetime.now() + datetime.timedelta(seconds=seconds))
+
+
+class JobQueue(SQLiteStore):
+    """Coda dei lavori di valutazione e relativi worker."""
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=DB_PATH, workers=WORKERS):
+        super().__init__(path)
+        self._add_columns({"luogo": "TEXT", "proprietario": "TEXT", "battito": "TEXT", "disponibile_da": "TEXT"})
+        self.workers = workers
+        self.owner = None
+        # Lavori in lavorazione nei worker del processo: solo questi ricevono il battito
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads = []
+
+    def _add_columns(self, columns):
+        """Aggiunge le colonne mancanti alle code create con versioni precedenti."""
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(lavori)")}
+        with self.conn as conn:
+            for name, definition in columns.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE lavori ADD COLUMN {name} {definition}")
+
+    # --- Lato pagina ---
+
+    def submit(self, image, location=None, place=None):
+        """Accoda la valutazione di un'immagine preparata e restituisce l'id del lavoro.
+
+        `place` è il luogo del gazetteer confermato per la localizzazione, se presente.
+        """
+        luogo = json.dumps(place._asdict(), ensure_ascii=False) if place is not None else None
+        with self.conn as conn:
+            cur = conn.execute(
+                "INSERT INTO lavori (creato, immagine, mime_type, sha256, location, luogo) VALUES (?, ?, ?, ?, ?, ?)",
+                (_now(), image.data, image.mime_type, image.sha256, location, luogo),
+            )
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def get(self, job_id):
+        """Stato e risultato di un lavoro (senza i dati dell'immagine)."""
+        row = self.conn.execute(
+            "SELECT id, stato, creato, iniziato, completato, tentativi, location, risultato, risposta, "
+            "cached, report_id, errore FROM lavori WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def position(self, job_id):
+        """Numero di lavori in coda prima di questo."""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM lavori WHERE stato = ? AND id < ?", (IN_CODA, job_id)
+        ).fetchone()[0]
+
+    def counts(self):
+        rows = self.conn.execute("SELECT stato, COUNT(*) AS n FROM lavori GROUP BY stato").fetchall()
+        return {row["stato"]: row["n"] for row in rows}
+
+    # --- Lato worker ---
+
+    def start(self, backend, cache=None, store=None):
+        """Avvia i worker (una sola volta per processo) dopo aver recuperato i lavori abbandonati."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self.owner = f"{socket.gethostname()}:{os.getpid()}"
+            self.recover()
+            self.purge()
+            threads = [
+                threading.Thread(target=self._run, args=(backend, cache, store), name=f"valutazioni-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            threads.append(threading.Thread(target=self._heartbeat, name="valutazioni-battito", daemon=True))
+            for thread in threads:
+                thread.start()
+                self._threads.append(thread)
+
+    def recover(self):
+        """Rimette in coda i lavori in esecuzione senza battito da STALE_AFTER secondi.
+
+        Quelli che hanno già esaurito i tentativi (ad esempio perché fanno terminare il
+        processo) si chiudono con un errore.
+        """
+        stale = "stato = ? AND COALESCE(battito, iniziato) < ?"
+        params = (IN_ESECUZIONE, _now(-STALE_AFTER))
+        with self.conn as conn:
+            conn.execute(
+                f"UPDATE lavori SET stato = ?, completato = ?, errore = ? WHERE {stale} AND tentativi >= ?",
+                (ERRORE, _now(), "Valutazione interrotta", *params, MAX_ATTEMPTS),
+            )
+            conn.execute(f"UPDATE lavori SET stato = ?, proprietario = NULL WHERE {stale}", (IN_CODA, *params))
+
+    def _heartbeat(self):
+        """Aggiorna il battito dei lavori in lavorazione e recupera quelli abbandonati.
+
+        Un lavoro che un worker ha lasciato (anche per un errore nel segnarne l'esito)
+        non riceve più il battito, quindi diventa recuperabile come quelli degli altri processi.
+        """
+        while True:
+            try:
+                with self._active_lock:
+                    active = list(self._active)
+                if active:
+                    with self.conn as conn:
+                        conn.execute(
+                            f"UPDATE lavori SET battito = ? WHERE stato = ? AND proprietario = ? "
+                            f"AND id IN ({', '.join('?' for _ in active)})",
+                            (_now(), IN_ESECUZIONE, self.owner, *active),
+                        )
+                self.recover()
+            except Exception:
+                logger.exception("Errore nel battito delle valutazioni")
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def _claim(self):
+        """Prende in carico il prossimo lavoro in coda, in modo atomico tra worker e processi."""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, immagine, mime_type, sha256, location, luogo, tentativi FROM lavori "
+                "WHERE stato = ? AND (disponibile_da IS NULL OR disponibile_da <= ?) ORDER BY id LIMIT 1",
+                (IN_CODA, _now()),
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE lavori SET stato = ?, iniziato = ?, battito = ?, proprietario = ?, "
+                    "tentativi = tentativi + 1 WHERE id = ?",
+                    (IN_ESECUZIONE, _now(), _now(), self.owner, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, stato, **fields):
+        fields.update(stato=stato, completato=_now())
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.conn as conn:
+            conn.execute(f"UPDATE lavori SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, backend, cache, store):
+        # Isolamento manuale delle transazioni per BEGIN IMMEDIATE in `_claim`
+        self.conn.isolation_level = None
+        while True:
+            try:
+                row = self._claim()
+                if row is not None:
+                    with self._active_lock:
+                        self._active.add(row["id"])
+                    try:
+                        self._process(row, backend, cache, store)
+                    finally:
+                        with self._active_lock:
+                            self._active.discard(row["id"])
+                    continue
+            except Exception:
+                # Un errore del database non deve fermare il worker
+                logger.exception("Errore nel worker delle valutazioni")
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _process(self, row, backend, cache, store):
+        """Esegue un lavoro preso in carico; qualunque errore lo rimette in coda o lo chiude."""
+        try:
+            image = PreparedImage(row["immagine"], row["mime_type"], row["sha256"], 0, 0)
+            place = Place(**json.loads(row["luogo"])) if row["luogo"] else None
+            result = assess_image(image, location=row["location"], backend=backend, cache=cache, place=place)
+            if result.assessment is None:
+                self._finish(row["id"], NON_INTERPRETABILE, risposta=result.raw)
+                return
+            # Anche il salvataggio può fallire (ad esempio archivio bloccato da un'importazione)
+            report_id = store.add(result.assessment) if store is not None else None
+            self._finish(
+                row["id"], COMPLETATO,
+                risultato=result.assessment.model_dump_json(), risposta=result.raw,
+                cached=int(result.cached), report_id=report_id, errore=None,
+            )
+        except Exception as error:
+            logger.warning("Valutazione %s non riuscita: %s", row["id"], error)
+            self._fail(row, error)
+
+    def _fail(self, row, error):
+        """Rimette in coda il lavoro con un'attesa, oppure lo chiude se i tentativi sono finiti."""
+        if row["tentativi"] + 1 < MAX_ATTEMPTS:
+            # Nuovo tentativo dopo un'attesa esponenziale con jitter, come in core.batch
+            delay = RETRY_BACKOFF * 2 ** row["tentativi"] + random.uniform(0, RETRY_BACKOFF)
+            with self.conn as conn:
+                conn.execute(
+                    "UPDATE lavori SET stato = ?, errore = ?, disponibile_da = ?, proprietario = NULL WHERE id = ?",
+                    (IN_CODA, str(error), _now(delay), row["id"]),
+                )
+            return
+        self._finish(row["id"], ERRORE, errore=str(error), proprietario=None)
+
+    def purge(self):
+        """Libera lo spazio delle immagini dei lavori conclusi da più di RETENTION_DAYS giorni."""
+        limit = format_date(datetime.datetime.now() - datetime.timedelta(days=RETENTION_DAYS))
+        placeholders = ", ".join("?" for _ in STATI_FINALI)
+        with self.conn as conn:
+            conn.execute(
+                f"UPDATE lavori SET immagine = X'' WHERE completato < ? AND stato IN ({placeholders}) "
+                "AND length(immagine) > 0",
+                (limit, *STATI_FINALI),
+            )
+
+
+def load_result(job):
+    """Ricostruisce la RiskAssessment di un lavoro completato."""
+    return RiskAssessment.model_validate(json.loads(job["risultato"]))
+
+
+@lru_cache(maxsize=None)
+def get_job_queue(path=DB_PATH):
+    """Restituisce la coda condivisa del processo."""
+    return JobQueue(path)
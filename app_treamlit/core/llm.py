@@ -0,0 +1,363 @@
+"""Backend del modello linguistico condiviso dall'intero processo.
+
+Le pagine non creano più client propri: chiamano `get_backend()`, che restituisce
+un'unica istanza per processo. Con `NAPOLI_ATTIVA_LLM_BACKEND=fake` (o `LLM_BACKEND = "fake"`
+nei secrets) il modello Bedrock viene sostituito da uno locale, utile per test e
+benchmark senza rete.
+
+Le richieste sono smistate su livelli di costo crescente (`TieredBackend`):
+
+- `faq`: risposte predefinite alle domande frequenti (`core.faq`), senza modello;
+- `chat`: le risposte libere della chat, con i parametri di sempre;
+- `triage`: modello piccolo con risposte brevi, per le valutazioni strutturate;
+- `escalation`: modello più grande, solo per le valutazioni ad alto rischio o poco
+  affidabili (vedi `core.assessment.request_assessment`). Si attiva indicando il
+  modello in `LLM_ESCALATION_MODEL`, che deve essere abilitato nella regione di
+  Bedrock: senza, le valutazioni restano al triage.
+"""
+import json
+import threading
+import time
+
+import streamlit as st
+from langchain.schema import AIMessage
+from langchain.schema.messages import AIMessageChunk
+
+from core import metrics
+from core.config import get_setting
+from core.context import CHARS_PER_TOKEN, estimate_tokens
+from core.faq import get_faq_index
+
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+MODEL_KWARGS = {"temperature": 0.7, "max_tokens": 2000}
+
+FAQ, CHAT, TRIAGE, ESCALATION = "faq", "chat", "triage", "escalation"
+# Modello e parametri dei livelli con modello (None: livello non configurato).
+# Risposte brevi e poco variabili solo per il triage delle valutazioni
+TIERS = {
+    CHAT: (
+        get_setting("LLM_CHAT_MODEL", MODEL_ID),
+        dict(MODEL_KWARGS, max_tokens=int(get_setting("LLM_CHAT_MAX_TOKENS", MODEL_KWARGS["max_tokens"]))),
+    ),
+    TRIAGE: (
+        get_setting("LLM_TRIAGE_MODEL", MODEL_ID),
+        {"temperature": 0.3, "max_tokens": int(get_setting("LLM_TRIAGE_MAX_TOKENS", 700))},
+    ),
+    ESCALATION: (get_setting("LLM_ESCALATION_MODEL"), MODEL_KWARGS),
+}
+
+# Limiti del pool di connessioni verso Bedrock, condiviso da tutte le sessioni
+MAX_POOL_CONNECTIONS = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120
+
+
+class LLMBackend:
+    """Interfaccia minima usata dalle pagine: `invoke` e `stream` su liste di messaggi."""
+
+    name = "base"
+
+    def invoke(self, messages):
+        raise NotImplementedError
+
+    def stream(self, messages):
+        # Implementazione di ripiego per i backend senza streaming nativo
+        yield AIMessageChunk(content=self.invoke(messages).content)
+
+    def stream_structured(self, messages, tool):
+        """Testo JSON degli argomenti di `tool`, a pezzi.
+
+        Senza function calling si usa la risposta testuale: chi legge ignora
+        l'eventuale testo che precede l'oggetto JSON.
+        """
+        return stream_text(self, messages)
+
+
+class BedrockBackend(LLMBackend):
+    """Claude su Amazon Bedrock tramite `ChatBedrock`, con un solo client boto3."""
+
+    name = "bedrock"
+
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, region_name="eu-west-1",
+                 model_id=MODEL_ID, model_kwargs=None, client=None):
+        from langchain_aws import ChatBedrock
+
+        # Un client già creato (e il suo pool di connessioni) può essere condiviso tra i modelli
+        self.client = client or create_client(aws_access_key_id, aws_secret_access_key, region_name)
+        self.model = ChatBedrock(
+            model_id=model_id,
+            client=self.client,
+            model_kwargs=dict(model_kwargs or MODEL_KWARGS),
+        )
+        self._tool_model = None
+        self._tool_name = None
+
+    def invoke(self, messages):
+        return self.model.invoke(messages)
+
+    def stream(self, messages):
+        return self.model.stream(messages)
+
+    def stream_structured(self, messages, tool):
+        # Il modello è obbligato a chiamare il tool: gli argomenti arrivano come JSON parziale
+        if self._tool_model is None or self._tool_name != tool["name"]:
+            self._tool_model = self.model.bind_tools([tool], tool_choice=tool["name"])
+            self._tool_name = tool["name"]
+        for chunk in self._tool_model.stream(messages):
+            for tool_chunk in chunk.tool_call_chunks:
+                if tool_chunk.get("args"):
+                    yield tool_chunk["args"]
+
+
+def create_client(aws_access_key_id, aws_secret_access_key, region_name="eu-west-1"):
+    """Client boto3 di Bedrock con il pool di connessioni condiviso."""
+    import boto3
+    import urllib3
+    from botocore.config import Config
+
+    # Disabilita avvisi SSL
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    return boto3.client(
+        service_name='bedrock-runtime',
+        region_name=region_name,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        verify=False,  # Disabilita la verifica SSL
+        config=Config(
+            proxies={'https': None},
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            tcp_keepalive=True,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT,
+            retries={"max_attempts": 3, "mode": "adaptive"},
+        ),
+    )
+
+
+class FakeBackend(LLMBackend):
+    """Modello locale deterministico, senza rete.
+
+    Ai messaggi con immagine risponde con una valutazione JSON valida, agli altri
+    con un testo fisso; `latency` simula il tempo di risposta del modello.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, assessment=None):
+        self.latency = latency
+        self.assessment = assessment or {
+            "livello_pericolosita": 2,
+            "categoria": "Strada Pubblica",
+            "descrizione": "Buca nel manto stradale di medie dimensioni.",
+            "raccomandazione": "Programmare il ripristino dell'asfalto entro pochi giorni.",
+        }
+        self.calls = 0
+
+    def _reply(self, messages):
+        last = messages[-1].content
+        if isinstance(last, list) and any(item.get("type") == "image_url" for item in last):
+            return json.dumps(self.assessment, ensure_ascii=False)
+        return "Grazie per la domanda. Sono l'assistente comunale di prova e ti risponderò a breve."
+
+    def invoke(self, messages):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return AIMessage(content=self._reply(messages))
+
+    def stream(self, messages):
+        self.calls += 1
+        words = self._reply(messages).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield AIMessageChunk(content=word if i == 0 else " " + word)
+
+    def stream_structured(self, messages, tool):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = json.dumps(self.assessment, ensure_ascii=False)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
+
+def _chunk_text(chunk):
+    content = chunk.content if hasattr(chunk, "content") else chunk
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+class InstrumentedBackend(LLMBackend):
+    """Avvolge un backend registrando latenza, tempo al primo token e token di ogni chiamata.
+
+    I token sono quelli riportati dal modello (`usage_metadata`) quando disponibili,
+    altrimenti una stima dalla lunghezza dei testi (etichetta `fonte="stima"`). Ogni
+    misura ha l'etichetta `livello` del backend nello smistamento.
+    """
+
+    def __init__(self, backend, tier=TRIAGE):
+        self.backend = backend
+        self.name = backend.name
+        self.tier = tier
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _record_tokens(self, messages, output_text, usage, modo):
+        if usage:
+            input_tokens, output_tokens, fonte = usage.get("input_tokens", 0), usage.get("output_tokens", 0), "modello"
+        else:
+            input_tokens = sum(estimate_tokens(message) for message in messages)
+            output_tokens, fonte = len(output_text) // CHARS_PER_TOKEN, "stima"
+        labels = {"backend": self.name, "livello": self.tier, "modo": modo, "fonte": fonte}
+        metrics.increment("llm_input_tokens_total", input_tokens, **labels)
+        metrics.increment("llm_output_tokens_total", output_tokens, **labels)
+
+    def _timed_stream(self, chunks, messages, modo):
+        labels = {"backend": self.name, "livello": self.tier, "modo": modo}
+        start = time.perf_counter()
+        first = True
+        parts = []
+        usage = {}
+        try:
+            for chunk in chunks:
+                if first:
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - start, **labels)
+                    first = False
+                # Nello streaming l'uso dei token arriva a pezzi, da sommare
+                for key, value in (getattr(chunk, "usage_metadata", None) or {}).items():
+                    if isinstance(value, int):
+                        usage[key] = usage.get(key, 0) + value
+                parts.append(_chunk_text(chunk))
+                yield chunk
+        except Exception:
+            metrics.increment("llm_errors_total", **labels)
+            raise
+        finally:
+            # Eseguito anche quando chi legge chiude lo stream in anticipo
+            if hasattr(chunks, "close"):
+                chunks.close()
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, **labels)
+            self._record_tokens(messages, "".join(parts), usage, modo)
+
+    def invoke(self, messages):
+        labels = {"backend": self.name, "livello": self.tier, "modo": "invoke"}
+        try:
+            with metrics.timer("llm_request_seconds", **labels):
+                response = self.backend.invoke(messages)
+        except Exception:
+            metrics.increment("llm_errors_total", **labels)
+            raise
+        self._record_tokens(messages, _chunk_text(response), getattr(response, "usage_metadata", None), "invoke")
+        return response
+
+    def stream(self, messages):
+        return self._timed_stream(self.backend.stream(messages), messages, "stream")
+
+    def stream_structured(self, messages, tool):
+        return self._timed_stream(self.backend.stream_structured(messages, tool), messages, "strutturato")
+
+
+class TieredBackend(LLMBackend):
+    """Smista le richieste tra FAQ, chat, triage ed escalation, contando le richieste di ogni livello.
+
+    `invoke` e `stream` (risposte libere) usano la chat, `stream_structured` il triage;
+    le FAQ si interrogano con `faq_answer` prima di chiamare il modello e l'escalation
+    è `self.escalation` (None se non configurata).
+    """
+
+    def __init__(self, triage, escalation=None, faq=None, chat=None):
+        self.triage = triage
+        self.escalation = escalation
+        self.faq = faq
+        self.chat = chat or triage
+        self.name = triage.name
+        self._lock = threading.Lock()
+        self.stats = {FAQ: 0, CHAT: 0, TRIAGE: 0, ESCALATION: 0, "faq_mancate": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def faq_answer(self, text):
+        """Risposta predefinita alla domanda, oppure None se va chiesta al modello."""
+        if self.faq is None:
+            return None
+        with metrics.timer("llm_request_seconds", backend="faq", livello=FAQ, modo="faq"):
+            answer = self.faq.answer(text)
+        self.count(FAQ if answer is not None else "faq_mancate")
+        return answer
+
+    def escalate(self):
+        """Backend dell'escalation (il triage se non configurato), contando la richiesta."""
+        if self.escalation is None:
+            return self.triage
+        self.count(ESCALATION)
+        return self.escalation
+
+    def invoke(self, messages):
+        self.count(CHAT)
+        return self.chat.invoke(messages)
+
+    def stream(self, messages):
+        self.count(CHAT)
+        return self.chat.stream(messages)
+
+    def stream_structured(self, messages, tool):
+        self.count(TRIAGE)
+        return self.triage.stream_structured(messages, tool)
+
+
+def stream_text(backend, messages):
+    """Generatore del solo testo prodotto dal modello, chunk per chunk."""
+    for chunk in backend.stream(messages):
+        # Alcuni modelli restituiscono blocchi di contenuto invece di stringhe
+        yield _chunk_text(chunk)
+
+
+def create_backend(kind=None, tier=TRIAGE, client=None):
+    """Crea il backend indicato (`bedrock` o `fake`) per un livello dello smistamento.
+
+    Restituisce None se per il livello non è configurato un modello Bedrock.
+    """
+    kind = (kind or get_setting("LLM_BACKEND", "bedrock")).lower()
+    if kind == "fake":
+        return FakeBackend(latency=float(get_setting("FAKE_LATENCY", 0.0)))
+    if kind == "bedrock":
+        model_id, model_kwargs = TIERS[tier]
+        if model_id is None:
+            return None
+        return BedrockBackend(
+            aws_access_key_id=get_setting("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=get_setting("AWS_SECRET_ACCESS_KEY"),
+            model_id=model_id,
+            model_kwargs=model_kwargs,
+            client=client,
+        )
+    raise ValueError(f"Backend LLM sconosciuto: {kind}")
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """Backend condiviso da tutte le sessioni del processo, creato una sola volta."""
+    triage = create_backend(tier=TRIAGE)
+    # I modelli condividono il client (e il pool di connessioni) del triage
+    client = getattr(triage, "client", None)
+    chat = create_backend(tier=CHAT, client=client)
+    escalation = create_backend(tier=ESCALATION, client=client)
+    backend = TieredBackend(
+        InstrumentedBackend(triage, TRIAGE),
+        InstrumentedBackend(escalation, ESCALATION) if escalation is not None else None,
+        get_faq_index(),
+        InstrumentedBackend(chat, CHAT),
+    )
+    # Richieste servite da ogni livello; la quota di FAQ riuscite è faq / (faq + faq_mancate)
+    metrics.register_collector(
+        lambda: [("llm_route_total", {"livello": name}, backend.stats[name])
+                 for name in (FAQ, CHAT, TRIAGE, ESCALATION)]
+        + [("llm_faq_misses_total", {}, backend.stats["faq_mancate"])]
+    )
+    return backend
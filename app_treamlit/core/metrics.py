@@ -0,0 +1,209 @@
+"""Metriche di processo: tempi, contatori ed esportazione locale.
+
+Le misure (durata delle pagine e delle sezioni della dashboard, latenza e token
+delle chiamate al modello, rendering dei PDF, esiti delle cache) restano in memoria
+e possono essere esportate in due modi, entrambi opzionali:
+
+- `METRICS_PORT`: endpoint HTTP locale (127.0.0.1) in formato testo Prometheus su `/metrics`;
+- `METRICS_FILE`: file JSONL con un evento per misura, ruotato oltre `METRICS_FILE_MAX_BYTES`.
+
+Con `PROFILING` attivo, aggiungendo `?profilo=1` all'URL l'esecuzione della pagina
+viene profilata (cProfile, oppure pyinstrument se `PROFILER = "pyinstrument"`) e il
+risultato salvato in `PROFILE_DIR`.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.config import get_flag, get_setting
+
+PREFIX = "napoli_attiva_"
+METRICS_PORT = get_setting("METRICS_PORT")
+METRICS_FILE = get_setting("METRICS_FILE")
+METRICS_FILE_MAX_BYTES = int(get_setting("METRICS_FILE_MAX_BYTES", 10 * 1024 * 1024))
+PROFILING = get_flag("PROFILING", False)
+PROFILER = str(get_setting("PROFILER", "cprofile")).lower()
+PROFILE_DIR = get_setting(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "profili"),
+)
+
+# Limiti superiori (secondi) degli istogrammi delle durate
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(key, extra=()):
+    items = [*key, *extra]
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}" if items else ""
+
+
+class Registry:
+    """Contatori e istogrammi condivisi dai thread del processo."""
+
+    def __init__(self, path=METRICS_FILE, max_bytes=METRICS_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def increment(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._write(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(BUCKETS), 0.0, 0))
+            index = bisect.bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                buckets = buckets[:]
+                buckets[index] += 1
+            self.histograms[key] = (buckets, total + value, count + 1)
+        self._write(name, value, labels)
+
+    def register_collector(self, collector):
+        """`collector()` restituisce tuple (nome, etichette, valore) lette al momento dell'esportazione."""
+        self.collectors.append(collector)
+
+    def _write(self, name, value, labels):
+        if not self.path:
+            return
+        event = json.dumps({"ts": round(time.time(), 3), "nome": name, "valore": value, **labels},
+                           ensure_ascii=False, default=str)
+        with self._file_lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(event + "\n")
+            except OSError:
+                # Le metriche non devono mai interrompere l'applicazione
+                pass
+
+    def render(self):
+        """Tutte le metriche nel formato testo di Prometheus."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for collector in self.collectors:
+            counters.extend(((name, _labels_key(labels)), value) for name, labels, value in collector())
+
+        typed = set()
+        for (name, key), value in counters:
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(key)} {value}")
+        for (name, key), (buckets, total, count) in histograms:
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{metric}_sum{_format_labels(key)} {total}")
+            lines.append(f"{metric}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+increment = registry.increment
+observe = registry.observe
+register_collector = registry.register_collector
+
+
+@contextmanager
+def timer(name, **labels):
+    """Misura la durata del blocco, anche se termina con un'eccezione (ad esempio un rerun)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def profile(name, directory=PROFILE_DIR):
+    """Profila il blocco e salva il risultato in `directory`; restituisce il percorso del file."""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{re.sub(r'[^A-Za-z0-9_-]+', '_', name)}-{time.strftime('%Y%m%d-%H%M%S')}")
+    if PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield base + ".html"
+        finally:
+            profiler.stop()
+            with open(base + ".html", "w", encoding="utf-8") as file:
+                file.write(profiler.output_html())
+    else:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield base + ".prof"
+        finally:
+            profiler.disable()
+            profiler.dump_stats(base + ".prof")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port=METRICS_PORT):
+    """Avvia (una sola volta per processo) l'endpoint `/metrics` su 127.0.0.1, se configurato."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+            except OSError:
+                # Porta già occupata, ad esempio da un altro processo dell'applicazione
+                return None
+            threading.Thread(target=_server.serve_forever, name="metriche", daemon=True).start()
+    return _server
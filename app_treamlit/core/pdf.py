@@ -0,0 +1,173 @@
+"""Report PDF delle valutazioni di rischio.
+
+Nessun file viene scritto nella cartella di lavoro: i report singoli sono restituiti
+come bytes, gli export massivi scrivono su un file temporaneo su disco, cancellato
+alla chiusura. Il PDF unico è diviso in parti da `PDF_MAX_PAGES` pagine, perché
+fpdf tiene in memoria l'intero documento fino al salvataggio.
+"""
+import itertools
+import tempfile
+import zipfile
+from functools import lru_cache
+
+from core import metrics
+from core.choices import LIVELLI
+from core.config import get_setting
+
+# I font standard dei PDF coprono solo latin-1: i caratteri tipografici più comuni
+# nelle risposte del modello vengono convertiti invece di far fallire il report
+TYPOGRAPHIC_CHARS = {
+    "‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-",
+    "…": "...", "€": "EUR", "•": "-",
+}
+
+# Pagine (una per segnalazione) di ciascun PDF dell'export unico
+PDF_MAX_PAGES = int(get_setting("PDF_MAX_PAGES", 500))
+
+
+class ReportRenderer:
+    """Genera i report con font, stili e tabelle di conversione preparati una sola volta."""
+
+    def __init__(self, font="Arial", margin=15, line_height=10):
+        self.font = font
+        self.margin = margin
+        self.line_height = line_height
+        self._translation = str.maketrans(TYPOGRAPHIC_CHARS)
+
+    def text(self, value):
+        """Testo compatibile con i font standard (latin-1)."""
+        return str(value).translate(self._translation).encode("latin-1", "replace").decode("latin-1")
+
+    def new_document(self):
+        # fpdf viene caricato solo alla prima generazione di un report
+        from fpdf import FPDF
+
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=True, margin=self.margin)
+        return pdf
+
+    def add_report(self, pdf, assessment, report_id=None, stato=None):
+        """Aggiunge al documento una pagina con il report della valutazione."""
+        h = self.line_height
+        pdf.add_page()
+
+        # Intestazione
+        pdf.set_font(self.font, style="B", size=16)
+        title = "Report di Valutazione del Rischio"
+        if report_id is not None:
+            title += f" n. {report_id}"
+        pdf.cell(200, h, title, ln=True, align='C')
+        pdf.ln(10)
+
+        # Contenuto
+        pdf.set_font(self.font, style="B", size=12)
+        pdf.cell(0, h, f"Data: {assessment.data.strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
+
+        if assessment.location:
+            pdf.cell(0, h, self.text(f"Localizzazione: {assessment.location}"), ln=True)
+        if assessment.quartiere:
+            pdf.cell(0, h, self.text(f"Quartiere: {assessment.quartiere}"), ln=True)
+
+        pdf.cell(0, h, self.text(f"Categoria: {assessment.categoria}"), ln=True)
+
+        # Livello di pericolosità
+        pdf.cell(0, h, self.text(f"Livello di Pericolosità: {LIVELLI[assessment.livello_pericolosita]}"), ln=True)
+
+        if stato:
+            pdf.cell(0, h, self.text(f"Stato: {stato}"), ln=True)
+
+        for label, value in (("Descrizione:", assessment.descrizione),
+                             ("Raccomandazione:", assessment.raccomandazione)):
+            pdf.ln(5)
+            pdf.set_font(self.font, style="B", size=12)
+            pdf.cell(0, h, label, ln=True)
+            pdf.set_font(self.font, size=12)
+            pdf.multi_cell(0, h, self.text(value))
+
+    @staticmethod
+    def to_bytes(pdf):
+        """Contenuto del documento come bytes (compatibile con fpdf e fpdf2)."""
+        output = pdf.output(dest="S")
+        return output.encode("latin-1") if isinstance(output, str) else bytes(output)
+
+    def render(self, assessment, report_id=None, stato=None):
+        """Report di una singola valutazione, in memoria."""
+        with metrics.timer("pdf_render_seconds", tipo="singolo"):
+            pdf = self.new_document()
+            self.add_report(pdf, assessment, report_id, stato)
+            return self.to_bytes(pdf)
+
+    def render_many(self, entries):
+        """Un unico PDF con una pagina per ogni `(report_id, stato, assessment)`.
+
+        Le segnalazioni vengono lette una alla volta dall'iteratore; il documento
+        contiene solo il testo delle pagine.
+        """
+        with metrics.timer("pdf_render_seconds", tipo="unico"):
+            pdf = self.new_document()
+            for report_id, stato, assessment in entries:
+                self.add_report(pdf, assessment, report_id, stato)
+            if pdf.page == 0:
+                pdf.add_page()
+                pdf.set_font(self.font, size=12)
+                pdf.cell(0, self.line_height, "Nessuna segnalazione da esportare.", ln=True)
+            return self.to_bytes(pdf)
+
+    def write_zip(self, entries, fileobj):
+        """Scrive in `fileobj` uno ZIP con un PDF per segnalazione, senza tenerli tutti in memoria."""
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+            for report_id, stato, assessment in entries:
+                archive.writestr(f"report_rischio_{report_id}.pdf", self.render(assessment, report_id, stato))
+        return fileobj
+
+    def write_parts(self, entries, fileobj, max_pages=PDF_MAX_PAGES):
+        """Scrive in `fileobj` il PDF unico, oppure uno ZIP di PDF da `max_pages` pagine.
+
+        In memoria c'è al più una parte alla volta. Restituisce True se il file è uno ZIP.
+        """
+        entries = iter(entries)
+        first = self.render_many(itertools.islice(entries, max_pages))
+        following = next(entries, None)
+        if following is None:
+            fileobj.write(first)
+            return False
+        entries = itertools.chain([following], entries)
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("report_segnalazioni_001.pdf", first)
+            del first
+            for part in itertools.count(2):
+                chunk = list(itertools.islice(entries, max_pages))
+                if not chunk:
+                    break
+                archive.writestr(f"report_segnalazioni_{part:03d}.pdf", self.render_many(chunk))
+        return True
+
+    def export_pdf(self, entries, max_pages=PDF_MAX_PAGES):
+        """PDF unico (o ZIP delle sue parti) in un file temporaneo su disco.
+
+        Restituisce `(file riavvolto, True se è uno ZIP)`.
+        """
+        fileobj = tempfile.NamedTemporaryFile(prefix="report_", suffix=".pdf")
+        is_zip = self.write_parts(entries, fileobj, max_pages)
+        fileobj.flush()
+        fileobj.seek(0)
+        return fileobj, is_zip
+
+    def export_zip(self, entries):
+        """ZIP dei report in un file temporaneo su disco, riavvolto e pronto per la lettura."""
+        fileobj = tempfile.NamedTemporaryFile(prefix="report_", suffix=".zip")
+        self.write_zip(entries, fileobj)
+        fileobj.flush()
+        fileobj.seek(0)
+        return fileobj
+
+
+@lru_cache(maxsize=None)
+def get_renderer():
+    """Renderer condiviso dal processo."""
+    return ReportRenderer()
+
+
+def render_pdf_report(assessment, report_id=None):
+    """Crea un report PDF basato sulla valutazione e lo restituisce in memoria."""
+    return get_renderer().render(assessment, report_id)
@@ -0,0 +1,120 @@
+"""Dati delle dashboard, condivisi tra le sessioni con `core.artifacts`.
+
+Ogni risultato (riepilogo, figure dei grafici, strato della mappa, pagina della
+tabella) è calcolato una volta per combinazione di filtri (già normalizzati con
+`filters.normalize`) e resta valido finché una modifica all'archivio non riguarda
+quei filtri. Senza filtri si leggono i contatori dell'archivio, altrimenti le
+bitmap di `filters.FilterIndex`. I valori che dipendono dalla data corrente
+(variazioni settimanali, andamento) hanno il giorno nella chiave; l'andamento è
+letto dai contatori giornalieri dell'archivio (`core.trends`). pandas e plotly
+vengono importati solo dalle funzioni che restituiscono tabelle o figure: la pagina
+iniziale legge solo il riepilogo.
+"""
+import datetime
+
+from core import geo
+from core.artifacts import get_artifact_cache
+from core.filters import get_filter_index, is_empty
+from core.store import ReportFilter, get_store
+
+CATEGORY_COLORS = {
+    "Strada Pubblica": "#E63946", "Verde Urbano": "#2A9D8F",
+    "Edifici e Infrastrutture": "#F4A261", "Altre criticità": "#8A4FFF",
+}
+
+
+def _filtered_index(filters):
+    index = get_filter_index().current()
+    return index, index.mask(filters)
+
+
+def load_summary(filters=ReportFilter()):
+    def compute():
+        if is_empty(filters):
+            return get_store().summary()
+        index, mask = _filtered_index(filters)
+        return index.summary(mask)
+
+    return get_artifact_cache().get(("riepilogo", filters, datetime.date.today()), compute, filters)
+
+
+def load_category_counts(filters=ReportFilter()):
+    def compute():
+        if is_empty(filters):
+            counts = get_store().count_by_category()
+        else:
+            index, mask = _filtered_index(filters)
+            counts = index.counts(mask, "categoria")
+        import pandas as pd
+
+        return pd.DataFrame(counts, columns=["Categoria", "Numero"])
+
+    return get_artifact_cache().get(("categorie", filters), compute, filters)
+
+
+def load_category_chart(filters=ReportFilter()):
+    """Figura plotly della distribuzione per categoria."""
+    def compute():
+        import plotly.express as px
+
+        return px.pie(load_category_counts(filters), names='Categoria', values='Numero',
+                      title='Distribuzione per Categoria', color='Categoria',
+                      color_discrete_map=CATEGORY_COLORS)
+
+    return get_artifact_cache().get(("grafico_categorie", filters), compute, filters)
+
+
+def load_trend_chart(filters=ReportFilter(), resolution="settimana", days=366, group=None, rolling=True):
+    """Figura plotly dell'andamento negli ultimi `days` giorni (None per tutto lo storico).
+
+    L'intervallo delle date dei filtri, se presente, restringe quello scelto.
+    """
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=days - 1) if days else None
+    trend_filters = filters._replace(dal=max((d for d in (filters.dal, start) if d), default=None))
+    end = min(filters.al, today) if filters.al else today
+
+    def compute():
+        from core import trends
+
+        rows = get_store().trend_counts(resolution, trend_filters, group)
+        table = trends.trend_frame(rows, resolution, trend_filters.dal, end, grouped=group is not None)
+        return trends.trend_figure(
+            table, resolution, f"Segnalazioni per {trends.RISOLUZIONI[resolution].etichetta.lower()}",
+            colors=CATEGORY_COLORS if group == "categoria" else None, rolling=rolling,
+        )
+
+    return get_artifact_cache().get(
+        ("grafico_andamento", trend_filters, resolution, group, rolling, today), compute, trend_filters
+    )
+
+
+def load_map_layer(zoom, bbox, filters=ReportFilter()):
+    """Strato della mappa per una tile (zoom e riquadro già allineati con `geo.view_key`)."""
+    return get_artifact_cache().get(
+        ("mappa", filters, zoom, bbox),
+        lambda: geo.viewport_layer(get_store(), bbox, zoom, filters),
+        filters, bbox,
+    )
+
+
+def _reports_frame(rows):
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "Data": ["/".join(reversed(row["data"][:10].split("-"))) for row in rows],
+            "Categoria": [row["categoria"] for row in rows],
+            "Descrizione": [row["descrizione"] for row in rows],
+            "Stato": [row["stato"] for row in rows],
+        }
+    )
+
+
+def load_reports_page(filters, order="data", descending=True, after=None, limit=20):
+    """Pagina della tabella delle segnalazioni e chiave della pagina successiva."""
+    def compute():
+        rows, next_key = get_store().page(filters, order, descending, after, limit)
+        return _reports_frame(rows), next_key
+
+    return get_artifact_cache().get(("tabella", filters, order, descending, after, limit), compute, filters)
@@ -0,0 +1,23 @@
+import datetime
+from typing import Optional, Literal
+
+from pydantic import BaseModel, Field
+
+# Valori ammessi: definiti in core.choices (senza pydantic), esposti anche qui
+from core.choices import CATEGORIE, LIVELLI, QUARTIERI, STATI
+
+
+# Pydantic model per la segnalazione
+class RiskAssessment(BaseModel):
+    data: datetime.datetime = Field(default_factory=datetime.datetime.now)
+    location: Optional[str] = Field(default=None, description="Localizzazione della segnalazione")
+    # Posizione risolta dalla localizzazione con `core.geocoder` (None se non riconosciuta)
+    quartiere: Optional[str] = Field(default=None, description="Quartiere di Napoli")
+    lat: Optional[float] = Field(default=None, description="Latitudine")
+    lon: Optional[float] = Field(default=None, description="Longitudine")
+    raccomandazione: str = Field(description="Raccomandazione per l'amministrazione comunale")
+    livello_pericolosita: Literal[1, 2, 3] = Field(description="Livello di pericolosità (1=Basso, 2=Medio, 3=Alto)")
+    descrizione: str = Field(description="Descrizione dettagliata della segnalazione")
+    categoria: Literal["Strada Pubblica", "Verde Urbano", "Edifici e Infrastrutture", "Altre criticità"] = Field(
+        description="Categoria della segnalazione"
+    )
@@ -0,0 +1,863 @@
+"""Archivio persistente delle segnalazioni su SQLite (modalità WAL)."""
+import datetime
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from core import dedup
+
+DB_PATH = os.environ.get(
+    "NAPOLI_ATTIVA_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "segnalazioni.db"),
+)
+
+# Le date sono salvate come testo ISO ("YYYY-MM-DD HH:MM:SS"), così l'ordinamento
+# lessicografico coincide con quello cronologico e gli indici restano utilizzabili.
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segnalazioni (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    location TEXT,
+    quartiere TEXT,
+    lat REAL,
+    lon REAL,
+    categoria TEXT NOT NULL,
+    stato TEXT NOT NULL DEFAULT 'Nuova',
+    livello_pericolosita INTEGER NOT NULL,
+    descrizione TEXT NOT NULL,
+    raccomandazione TEXT NOT NULL,
+    aggiornato TEXT,
+    incidente_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_data ON segnalazioni(data);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_categoria ON segnalazioni(categoria, data);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_stato ON segnalazioni(stato, data);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_livello ON segnalazioni(livello_pericolosita, data);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_quartiere ON segnalazioni(quartiere, data);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_posizione ON segnalazioni(lat, lon);
+
+CREATE TABLE IF NOT EXISTS meta (
+    chiave TEXT PRIMARY KEY,
+    valore INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (chiave, valore) VALUES ('revisione', 0);
+"""
+
+# Indice spaziale R*Tree (modulo incluso in quasi tutte le build di SQLite),
+# mantenuto allineato alla tabella principale tramite trigger
+RTREE_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS segnalazioni_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+
+CREATE TRIGGER IF NOT EXISTS trg_rtree_insert AFTER INSERT ON segnalazioni
+WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+BEGIN
+    INSERT INTO segnalazioni_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rtree_update AFTER UPDATE OF lat, lon ON segnalazioni
+BEGIN
+    DELETE FROM segnalazioni_rtree WHERE id = OLD.id;
+    INSERT INTO segnalazioni_rtree SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+    WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rtree_delete AFTER DELETE ON segnalazioni
+BEGIN
+    DELETE FROM segnalazioni_rtree WHERE id = OLD.id;
+END;
+"""
+
+# Contatori aggiornati dai trigger a ogni inserimento, cambio di stato o
+# cancellazione: le dashboard leggono questi invece di aggregare tutta la tabella
+AGGREGATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregati (
+    dimensione TEXT NOT NULL,
+    valore TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (dimensione, valore)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS aggregati_giornalieri (
+    giorno TEXT NOT NULL,
+    stato TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (giorno, stato)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_aggregati_insert AFTER INSERT ON segnalazioni
+BEGIN
+    INSERT INTO aggregati VALUES ('categoria', NEW.categoria, 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati VALUES ('stato', NEW.stato, 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati VALUES ('quartiere', COALESCE(NEW.quartiere, ''), 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati_giornalieri VALUES (substr(NEW.data, 1, 10), NEW.stato, 1)
+        ON CONFLICT (giorno, stato) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_aggregati_delete AFTER DELETE ON segnalazioni
+BEGIN
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'categoria' AND valore = OLD.categoria;
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'stato' AND valore = OLD.stato;
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'quartiere' AND valore = COALESCE(OLD.quartiere, '');
+    UPDATE aggregati_giornalieri SET n = n - 1 WHERE giorno = substr(OLD.data, 1, 10) AND stato = OLD.stato;
+    DELETE FROM aggregati WHERE n <= 0;
+    DELETE FROM aggregati_giornalieri WHERE n <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_aggregati_update AFTER UPDATE OF data, categoria, stato, quartiere ON segnalazioni
+BEGIN
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'categoria' AND valore = OLD.categoria;
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'stato' AND valore = OLD.stato;
+    UPDATE aggregati SET n = n - 1 WHERE dimensione = 'quartiere' AND valore = COALESCE(OLD.quartiere, '');
+    UPDATE aggregati_giornalieri SET n = n - 1 WHERE giorno = substr(OLD.data, 1, 10) AND stato = OLD.stato;
+    INSERT INTO aggregati VALUES ('categoria', NEW.categoria, 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati VALUES ('stato', NEW.stato, 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati VALUES ('quartiere', COALESCE(NEW.quartiere, ''), 1)
+        ON CONFLICT (dimensione, valore) DO UPDATE SET n = n + 1;
+    INSERT INTO aggregati_giornalieri VALUES (substr(NEW.data, 1, 10), NEW.stato, 1)
+        ON CONFLICT (giorno, stato) DO UPDATE SET n = n + 1;
+    DELETE FROM aggregati WHERE n <= 0;
+    DELETE FROM aggregati_giornalieri WHERE n <= 0;
+END;
+"""
+
+# Contatori giornalieri per categoria, stato e quartiere ('' se non indicato), da cui
+# si calcolano gli andamenti a ogni risoluzione e con qualsiasi filtro senza leggere
+# le segnalazioni: le righe crescono con i giorni, non con le segnalazioni
+TRENDS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregati_andamento (
+    giorno TEXT NOT NULL,
+    categoria TEXT NOT NULL,
+    stato TEXT NOT NULL,
+    quartiere TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (giorno, categoria, stato, quartiere)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_andamento_insert AFTER INSERT ON segnalazioni
+BEGIN
+    INSERT INTO aggregati_andamento
+    VALUES (substr(NEW.data, 1, 10), NEW.categoria, NEW.stato, COALESCE(NEW.quartiere, ''), 1)
+        ON CONFLICT (giorno, categoria, stato, quartiere) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_andamento_delete AFTER DELETE ON segnalazioni
+BEGIN
+    UPDATE aggregati_andamento SET n = n - 1
+    WHERE giorno = substr(OLD.data, 1, 10) AND categoria = OLD.categoria AND stato = OLD.stato
+        AND quartiere = COALESCE(OLD.quartiere, '');
+    DELETE FROM aggregati_andamento
+    WHERE giorno = substr(OLD.data, 1, 10) AND categoria = OLD.categoria AND stato = OLD.stato
+        AND quartiere = COALESCE(OLD.quartiere, '') AND n <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_andamento_update AFTER UPDATE OF data, categoria, stato, quartiere ON segnalazioni
+BEGIN
+    UPDATE aggregati_andamento SET n = n - 1
+    WHERE giorno = substr(OLD.data, 1, 10) AND categoria = OLD.categoria AND stato = OLD.stato
+        AND quartiere = COALESCE(OLD.quartiere, '');
+    DELETE FROM aggregati_andamento
+    WHERE giorno = substr(OLD.data, 1, 10) AND categoria = OLD.categoria AND stato = OLD.stato
+        AND quartiere = COALESCE(OLD.quartiere, '') AND n <= 0;
+    INSERT INTO aggregati_andamento
+    VALUES (substr(NEW.data, 1, 10), NEW.categoria, NEW.stato, COALESCE(NEW.quartiere, ''), 1)
+        ON CONFLICT (giorno, categoria, stato, quartiere) DO UPDATE SET n = n + 1;
+END;
+"""
+# Inizio del periodo di un giorno per ogni risoluzione degli andamenti (settimane dal lunedì)
+PERIODI_SQL = {
+    "giorno": "giorno",
+    "settimana": "date(giorno, 'weekday 0', '-6 days')",
+    "mese": "substr(giorno, 1, 7) || '-01'",
+}
+GRUPPI_ANDAMENTO = ("categoria", "stato", "quartiere")
+
+# Firme MinHash delle descrizioni e indice LSH per il riconoscimento dei duplicati.
+# L'incidente di una segnalazione è identificato dall'id della sua prima segnalazione;
+# l'indice parziale contiene solo le prime segnalazioni degli incidenti aperti.
+# La condizione deve coincidere con INCIDENTI_APERTI perché SQLite usi l'indice.
+INCIDENTI_APERTI = "{t}incidente_id = {t}id AND {t}stato NOT IN ('Risolta', 'Chiusa')"
+DEDUP_SCHEMA = f"""
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_incidente ON segnalazioni(incidente_id);
+CREATE INDEX IF NOT EXISTS idx_incidenti_aperti ON segnalazioni(categoria, lat, lon)
+WHERE {INCIDENTI_APERTI.format(t="")};
+
+CREATE TABLE IF NOT EXISTS segnalazioni_firme (
+    id INTEGER PRIMARY KEY,
+    firma BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS segnalazioni_bande (
+    banda INTEGER NOT NULL,
+    valore INTEGER NOT NULL,
+    id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_bande ON segnalazioni_bande(banda, valore);
+CREATE INDEX IF NOT EXISTS idx_segnalazioni_bande_id ON segnalazioni_bande(id);
+
+CREATE TRIGGER IF NOT EXISTS trg_firme_delete AFTER DELETE ON segnalazioni
+BEGIN
+    DELETE FROM segnalazioni_firme WHERE id = OLD.id;
+    DELETE FROM segnalazioni_bande WHERE id = OLD.id;
+END;
+"""
+
+# Registro delle modifiche alle segnalazioni (inserimenti, cambi di stato, cancellazioni
+# e unioni in un incidente), letto dalla cache delle dashboard per invalidare solo le
+# voci interessate. Per un cambiamento si registrano sia i valori vecchi sia i nuovi;
+# l'id della segnalazione permette di aggiornare l'indice dei filtri senza ricostruirlo.
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS modifiche (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    categoria TEXT,
+    stato TEXT,
+    quartiere TEXT,
+    giorno TEXT,
+    lat REAL,
+    lon REAL,
+    segnalazione_id INTEGER
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_modifiche_insert AFTER INSERT ON segnalazioni
+BEGIN
+    INSERT INTO modifiche (categoria, stato, quartiere, giorno, lat, lon, segnalazione_id)
+    VALUES (NEW.categoria, NEW.stato, NEW.quartiere, substr(NEW.data, 1, 10), NEW.lat, NEW.lon, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_modifiche_update
+AFTER UPDATE OF data, categoria, stato, quartiere, lat, lon ON segnalazioni
+BEGIN
+    INSERT INTO modifiche (categoria, stato, quartiere, giorno, lat, lon, segnalazione_id)
+    VALUES (OLD.categoria, OLD.stato, OLD.quartiere, substr(OLD.data, 1, 10), OLD.lat, OLD.lon, OLD.id);
+    INSERT INTO modifiche (categoria, stato, quartiere, giorno, lat, lon, segnalazione_id)
+    VALUES (NEW.categoria, NEW.stato, NEW.quartiere, substr(NEW.data, 1, 10), NEW.lat, NEW.lon, NEW.id);
+END;
+
+-- Una segnalazione unita a un incidente cambia il conteggio mostrato sulla sua prima segnalazione
+CREATE TRIGGER IF NOT EXISTS trg_modifiche_incidente AFTER UPDATE OF incidente_id ON segnalazioni
+WHEN NEW.incidente_id IS NOT NEW.id
+BEGIN
+    INSERT INTO modifiche (categoria, stato, quartiere, giorno, lat, lon, segnalazione_id)
+    SELECT categoria, stato, quartiere, substr(data, 1, 10), lat, lon, id FROM segnalazioni
+    WHERE id = NEW.incidente_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_modifiche_delete AFTER DELETE ON segnalazioni
+BEGIN
+    INSERT INTO modifiche (categoria, stato, quartiere, giorno, lat, lon, segnalazione_id)
+    VALUES (OLD.categoria, OLD.stato, OLD.quartiere, substr(OLD.data, 1, 10), OLD.lat, OLD.lon, OLD.id);
+END;
+"""
+CHANGES_TRIGGERS = ("trg_modifiche_insert", "trg_modifiche_update", "trg_modifiche_incidente", "trg_modifiche_delete")
+# Modifiche conservate nel registro: chi è rimasto più indietro svuota la propria cache
+CHANGES_KEEP = 10000
+
+# Raggruppamento degli stati nei riquadri delle dashboard
+GRUPPI_STATO = {
+    "risolte": ("Risolta", "Chiusa"),
+    "in_lavorazione": ("Assegnata", "In lavorazione"),
+    "nuove": ("Nuova",),
+}
+
+COLONNE = (
+    "id", "data", "location", "quartiere", "lat", "lon", "categoria", "stato",
+    "livello_pericolosita", "descrizione", "raccomandazione",
+)
+
+# Colonne scritte all'inserimento di una segnalazione, nell'ordine di `add_many`
+COLONNE_INSERIMENTO = (
+    "data", "location", "quartiere", "lat", "lon", "categoria", "stato",
+    "livello_pericolosita", "descrizione", "raccomandazione",
+)
+INSERT_SQL = (
+    f"INSERT INTO segnalazioni ({', '.join(COLONNE_INSERIMENTO)}) "
+    f"VALUES ({', '.join('?' for _ in COLONNE_INSERIMENTO)})"
+)
+
+# Ordinamenti della tabella delle segnalazioni: colonne della chiave di paginazione,
+# l'ultima è sempre l'id così la chiave è univoca
+ORDINAMENTI = {
+    "data": ("data", "id"),
+    "livello": ("livello_pericolosita", "data", "id"),
+}
+
+
+class Change(NamedTuple):
+    """Valori di una segnalazione inserita, modificata o cancellata (dal registro `modifiche`)."""
+    id: int
+    categoria: str
+    stato: str
+    quartiere: Optional[str]
+    # Giorno della segnalazione, "YYYY-MM-DD"
+    giorno: str
+    lat: Optional[float]
+    lon: Optional[float]
+    # Id della segnalazione (None per le modifiche registrate prima della colonna)
+    segnalazione_id: Optional[int] = None
+
+
+class ReportFilter(NamedTuple):
+    """Filtri sulle segnalazioni; i campi vuoti non filtrano."""
+    categorie: Tuple[str, ...] = ()
+    stati: Tuple[str, ...] = ()
+    quartieri: Tuple[str, ...] = ()
+    # Date (datetime.date) incluse nell'intervallo
+    dal: Optional[datetime.date] = None
+    al: Optional[datetime.date] = None
+
+
+def build_summary(counts, deltas):
+    """Riquadri delle dashboard da totali e variazioni settimanali per stato."""
+    result = {"totali": {"valore": 0, "delta": 0}}
+    result.update({gruppo: {"valore": 0, "delta": 0} for gruppo in GRUPPI_STATO})
+    for stato, n in counts:
+        delta = deltas.get(stato, 0)
+        result["totali"]["valore"] += n
+        result["totali"]["delta"] += delta
+        for gruppo, stati in GRUPPI_STATO.items():
+            if stato in stati:
+                result[gruppo]["valore"] += n
+                result[gruppo]["delta"] += delta
+    return result
+
+
+def week_bounds(now=None):
+    """Primo giorno della settimana corrente (7 giorni, oggi compreso) e di quella precedente."""
+    today = (now or datetime.datetime.now()).date()
+    return (today - datetime.timedelta(days=6)).isoformat(), (today - datetime.timedelta(days=13)).isoformat()
+
+
+def format_date(value):
+    """Converte una data nel formato testuale usato dall'archivio."""
+    if isinstance(value, str):
+        return value
+    return value.strftime(DATE_FORMAT)
+
+
+class SQLiteStore:
+    """Base per gli archivi SQLite dell'applicazione.
+
+    Streamlit esegue ogni sessione in un thread diverso: ogni thread riceve una
+    propria connessione, mentre la modalità WAL permette letture concorrenti
+    durante le scritture.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn.executescript(self.SCHEMA)
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close_connection(self):
+        """Chiude la connessione del thread corrente (ne verrà aperta un'altra se serve).
+
+        Da chiamare nei thread di breve durata, come quelli di un pool: le loro
+        connessioni altrimenti restano aperte finché non interviene il garbage collector.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+
+class ReportStore(SQLiteStore):
+    """Accesso alle segnalazioni salvate."""
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=DB_PATH):
+        super().__init__(path)
+        self.has_rtree = self._init_rtree()
+        self._init_trends()
+        self._init_aggregates()
+        self._init_dedup()
+        self._init_changes()
+
+    def _init_rtree(self):
+        """Crea l'indice spaziale; senza il modulo R*Tree si usa l'indice su (lat, lon)."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'segnalazioni_rtree'"
+        ).fetchone()
+        try:
+            with self.conn as conn:
+                conn.executescript(RTREE_SCHEMA)
+                if not exists:
+                    # Indicizza le segnalazioni salvate prima della creazione dell'indice
+                    conn.execute(
+                        "INSERT INTO segnalazioni_rtree SELECT id, lat, lat, lon, lon FROM segnalazioni "
+                        "WHERE lat IS NOT NULL AND lon IS NOT NULL"
+                    )
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def _init_aggregates(self):
+        """Crea i contatori e, alla prima esecuzione, li calcola dalle segnalazioni esistenti."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'aggregati'"
+        ).fetchone()
+        with self.conn as conn:
+            conn.executescript(AGGREGATES_SCHEMA)
+        if not exists:
+            self.rebuild_aggregates()
+
+    def _init_trends(self):
+        """Crea i contatori degli andamenti e, alla prima esecuzione, li calcola dallo storico."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'aggregati_andamento'"
+        ).fetchone()
+        with self.conn as conn:
+            conn.executescript(TRENDS_SCHEMA)
+            if not exists:
+                self._fill_trends(conn)
+
+    @staticmethod
+    def _fill_trends(conn):
+        conn.execute(
+            "INSERT INTO aggregati_andamento SELECT substr(data, 1, 10), categoria, stato, "
+            "COALESCE(quartiere, ''), COUNT(*) FROM segnalazioni "
+            "GROUP BY substr(data, 1, 10), categoria, stato, COALESCE(quartiere, '')"
+        )
+
+    def rebuild_aggregates(self):
+        """Ricalcola da zero i contatori (ad esempio dopo modifiche fatte senza trigger)."""
+        with self.conn as conn:
+            conn.execute("DELETE FROM aggregati")
+            conn.execute("DELETE FROM aggregati_giornalieri")
+            conn.execute("DELETE FROM aggregati_andamento")
+            self._fill_trends(conn)
+            for dimensione, espressione in (
+                ("categoria", "categoria"), ("stato", "stato"), ("quartiere", "COALESCE(quartiere, '')"),
+            ):
+                conn.execute(
+                    f"INSERT INTO aggregati SELECT ?, {espressione}, COUNT(*) FROM segnalazioni "
+                    f"GROUP BY {espressione}",
+                    (dimensione,),
+                )
+            conn.execute(
+                "INSERT INTO aggregati_giornalieri SELECT substr(data, 1, 10), stato, COUNT(*) "
+                "FROM segnalazioni GROUP BY substr(data, 1, 10), stato"
+            )
+
+    def _bbox_filter(self, bbox, filters=None):
+        """Condizione SQL (e parametri) per le segnalazioni nel riquadro (sud, ovest, nord, est)."""
+        south, west, north, east = bbox
+        where, params = self._filter_sql(filters)
+        if self.has_rtree:
+            return (
+                "id IN (SELECT id FROM segnalazioni_rtree "
+                f"WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?) AND {where}",
+                (south, north, west, east, *params),
+            )
+        return f"lat BETWEEN ? AND ? AND lon BETWEEN ? AND ? AND {where}", (south, north, west, east, *params)
+
+    def _init_dedup(self):
+        """Aggiunge la colonna degli incidenti ai database creati prima della deduplicazione."""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(segnalazioni)")}
+        with self.conn as conn:
+            if "incidente_id" not in columns:
+                conn.execute("ALTER TABLE segnalazioni ADD COLUMN incidente_id INTEGER")
+            conn.executescript(DEDUP_SCHEMA)
+            # Le segnalazioni precedenti formano ciascuna un proprio incidente
+            conn.execute("UPDATE segnalazioni SET incidente_id = id WHERE incidente_id IS NULL")
+
+    def _init_changes(self):
+        """Crea il registro delle modifiche; a quelli precedenti aggiunge l'id della segnalazione."""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(modifiche)")}
+        with self.conn as conn:
+            if columns and "segnalazione_id" not in columns:
+                conn.execute("ALTER TABLE modifiche ADD COLUMN segnalazione_id INTEGER")
+                # I trigger esistenti non scrivono la nuova colonna: vengono ricreati
+                for trigger in CHANGES_TRIGGERS:
+                    conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.executescript(CHANGES_SCHEMA)
+
+    def _find_incident(self, conn, categoria, signature, lat, lon):
+        """Incidente aperto della stessa categoria, vicino e con descrizione simile, oppure None.
+
+        I candidati sono le prime segnalazioni degli incidenti aperti nel riquadro del
+        raggio massimo (indice parziale `idx_incidenti_aperti`, che non cresce con lo
+        storico né con i duplicati) che condividono almeno una banda LSH con la firma:
+        solo per questi si stima la somiglianza delle descrizioni, con raggio e soglia
+        che dipendono dalla precisione delle due posizioni (vedi `dedup.limits`). Senza
+        firma o senza posizione la segnalazione resta un incidente a sé.
+        """
+        if signature is None or lat is None or lon is None:
+            return None
+        own_precision = dedup.precision(lat, lon)
+        south, west, north, east = dedup.bbox_around(lat, lon, dedup.MAX_RADIUS)
+        band_values = dedup.bands(signature)
+        rows = conn.execute(
+            "SELECT s.id, s.incidente_id, s.lat, s.lon, f.firma FROM segnalazioni s "
+            "JOIN segnalazioni_firme f ON f.id = s.id "
+            f"WHERE {INCIDENTI_APERTI.format(t='s.')} AND s.categoria = ? AND s.lat BETWEEN ? AND ? AND s.lon BETWEEN ? AND ? "
+            "AND EXISTS (SELECT 1 FROM segnalazioni_bande b WHERE b.id = s.id AND ("
+            + " OR ".join("(b.banda = ? AND b.valore = ?)" for _ in band_values) + "))",
+            (categoria, south, north, west, east, *[v for pair in band_values for v in pair]),
+        ).fetchall()
+        best, best_score = None, 0.0
+        for row in rows:
+            radius, threshold = dedup.limits(own_precision, dedup.precision(row["lat"], row["lon"]))
+            if dedup.distance(lat, lon, row["lat"], row["lon"]) > radius:
+                continue
+            score = dedup.similarity(signature, dedup.signature_from_bytes(row["firma"]))
+            if score >= max(threshold, best_score):
+                best, best_score = row["incidente_id"], score
+        return best
+
+    def _index_report(self, conn, report_id, categoria, descrizione, lat, lon):
+        """Calcola la firma della segnalazione e la assegna a un incidente."""
+        signature = dedup.minhash(descrizione)
+        incidente_id = self._find_incident(conn, categoria, signature, lat, lon) or report_id
+        conn.execute("UPDATE segnalazioni SET incidente_id = ? WHERE id = ?", (incidente_id, report_id))
+        if signature is None:
+            return incidente_id
+        conn.execute("INSERT INTO segnalazioni_firme (id, firma) VALUES (?, ?)",
+                     (report_id, dedup.signature_bytes(signature)))
+        conn.executemany("INSERT INTO segnalazioni_bande (banda, valore, id) VALUES (?, ?, ?)",
+                         [(banda, valore, report_id) for banda, valore in dedup.bands(signature)])
+        return incidente_id
+
+    @staticmethod
+    def _filter_sql(filters, date_column="data"):
+        """Condizione SQL (e parametri) corrispondente a un ReportFilter."""
+        clauses, params = [], []
+        if filters is None:
+            return "1", params
+        for column, values in (("categoria", filters.categorie), ("stato", filters.stati),
+                               ("quartiere", filters.quartieri)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+        if filters.dal:
+            clauses.append(f"{date_column} >= ?")
+            params.append(filters.dal.isoformat())
+        if filters.al:
+            clauses.append(f"{date_column} < ?")
+            params.append((filters.al + datetime.timedelta(days=1)).isoformat())
+        return " AND ".join(clauses) or "1", params
+
+    def _bump_revision(self, conn):
+        conn.execute("UPDATE meta SET valore = valore + 1 WHERE chiave = 'revisione'")
+        conn.execute("DELETE FROM modifiche WHERE id <= (SELECT MAX(id) FROM modifiche) - ?", (CHANGES_KEEP,))
+
+    def revision(self):
+        """Numero che cambia a ogni scrittura: usato come chiave delle cache."""
+        return self.conn.execute("SELECT valore FROM meta WHERE chiave = 'revisione'").fetchone()[0]
+
+    def last_change(self):
+        """Id dell'ultima modifica registrata (0 se nessuna)."""
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM modifiche").fetchone()[0]
+
+    def changes_since(self, change_id):
+        """Modifiche successive a `change_id`.
+
+        Restituisce le modifiche (Change) e un flag che è False se alcune sono già
+        state rimosse dal registro: in quel caso chi legge deve considerare cambiato tutto.
+        """
+        rows = self.conn.execute(
+            "SELECT id, categoria, stato, quartiere, giorno, lat, lon, segnalazione_id FROM modifiche "
+            "WHERE id > ? ORDER BY id",
+            (change_id,),
+        ).fetchall()
+        if not rows:
+            return [], True
+        # Gli id sono consecutivi: un salto significa che il registro è stato accorciato
+        return [Change(*row) for row in rows], rows[0]["id"] == change_id + 1
+
+    # --- Scrittura ---
+
+    def add(self, assessment, stato="Nuova", quartiere=None, lat=None, lon=None):
+        """Salva una RiskAssessment e restituisce l'id della segnalazione.
+
+        Quartiere e coordinate, se non indicati, sono quelli della valutazione.
+        """
+        quartiere = quartiere if quartiere is not None else assessment.quartiere
+        lat = lat if lat is not None else assessment.lat
+        lon = lon if lon is not None else assessment.lon
+        with self.conn as conn:
+            cur = conn.execute(
+                INSERT_SQL,
+                (
+                    format_date(assessment.data), assessment.location, quartiere, lat, lon,
+                    assessment.categoria, stato, assessment.livello_pericolosita,
+                    assessment.descrizione, assessment.raccomandazione,
+                ),
+            )
+            self._index_report(conn, cur.lastrowid, assessment.categoria, assessment.descrizione, lat, lon)
+            self._bump_revision(conn)
+        return cur.lastrowid
+
+    def add_many(self, rows, dedup=True):
+        """Salva in un'unica transazione righe già validate (valori di `COLONNE_INSERIMENTO`).
+
+        Con `dedup` ogni riga passa dal riconoscimento dei duplicati come in `add`;
+        senza, ogni segnalazione è un incidente a sé e l'inserimento è più veloce.
+        Restituisce il numero di righe salvate.
+        """
+        categoria, descrizione, lat, lon = (
+            COLONNE_INSERIMENTO.index(name) for name in ("categoria", "descrizione", "lat", "lon")
+        )
+        with self.conn as conn:
+            if dedup:
+                for row in rows:
+                    cur = conn.execute(INSERT_SQL, row)
+                    self._index_report(conn, cur.lastrowid, row[categoria], row[descrizione], row[lat], row[lon])
+            else:
+                conn.executemany(INSERT_SQL, rows)
+                conn.execute("UPDATE segnalazioni SET incidente_id = id WHERE incidente_id IS NULL")
+            self._bump_revision(conn)
+        return len(rows)
+
+    def update_status(self, report_id, stato):
+        """Aggiorna lo stato di una segnalazione."""
+        with self.conn as conn:
+            conn.execute(
+                "UPDATE segnalazioni SET stato = ?, aggiornato = ? WHERE id = ?",
+                (stato, format_date(datetime.datetime.now()), report_id),
+            )
+            self._bump_revision(conn)
+
+    def incident(self, report_id):
+        """Incidente della segnalazione: id e numero di segnalazioni che lo compongono."""
+        row = self.conn.execute(
+            "SELECT s.incidente_id, (SELECT COUNT(*) FROM segnalazioni d WHERE d.incidente_id = s.incidente_id) AS n "
+            "FROM segnalazioni s WHERE s.id = ?",
+            (report_id,),
+        ).fetchone()
+        return (row["incidente_id"], row["n"]) if row else (None, 0)
+
+    # --- Letture aggregate ---
+
+    def _counts(self, dimensione):
+        rows = self.conn.execute(
+            "SELECT valore, n FROM aggregati WHERE dimensione = ? ORDER BY n DESC, valore",
+            (dimensione,),
+        ).fetchall()
+        return [(row["valore"], row["n"]) for row in rows]
+
+    def summary(self, now=None):
+        """Totali per i riquadri delle dashboard, con la variazione settimanale.
+
+        La variazione confronta le segnalazioni create negli ultimi 7 giorni (oggi
+        compreso) con quelle dei 7 giorni precedenti, per ciascun gruppo di stati.
+        Legge solo i contatori: al più 14 giorni per stato.
+        """
+        week, prev_week = week_bounds(now)
+        weekly = self.conn.execute(
+            "SELECT stato, SUM(CASE WHEN giorno >= ? THEN n ELSE 0 END) AS settimana, "
+            "SUM(CASE WHEN giorno < ? THEN n ELSE 0 END) AS precedente "
+            "FROM aggregati_giornalieri WHERE giorno >= ? GROUP BY stato",
+            (week, week, prev_week),
+        ).fetchall()
+        deltas = {row["stato"]: row["settimana"] - row["precedente"] for row in weekly}
+        return build_summary(self._counts("stato"), deltas)
+
+    def count_by_category(self):
+        """Numero di segnalazioni per categoria."""
+        return self._counts("categoria")
+
+    def count_by_status(self):
+        """Numero di segnalazioni per stato."""
+        return self._counts("stato")
+
+    def count_by_quartiere(self):
+        """Numero di segnalazioni per quartiere (stringa vuota se non indicato)."""
+        return self._counts("quartiere")
+
+    def daily_counts(self, days=7, now=None):
+        """Segnalazioni per giorno negli ultimi `days` giorni (giorni vuoti inclusi)."""
+        now = now or datetime.datetime.now()
+        start = (now - datetime.timedelta(days=days - 1)).date()
+        rows = self.conn.execute(
+            "SELECT giorno, SUM(n) AS n FROM aggregati_giornalieri WHERE giorno >= ? GROUP BY giorno",
+            (start.isoformat(),),
+        ).fetchall()
+        counts = {row["giorno"]: row["n"] for row in rows}
+        return [
+            (start + datetime.timedelta(days=i), counts.get((start + datetime.timedelta(days=i)).isoformat(), 0))
+            for i in range(days)
+        ]
+
+    def trend_counts(self, resolution="giorno", filters=None, group=None):
+        """Segnalazioni per periodo (e per valore di `group`), dai contatori giornalieri.
+
+        Restituisce terne (inizio del periodo "YYYY-MM-DD", valore del gruppo, numero)
+        in ordine di periodo; senza `group` il valore è sempre la stringa vuota.
+        """
+        if group is not None and group not in GRUPPI_ANDAMENTO:
+            raise ValueError(f"Raggruppamento non valido: {group}")
+        where, params = self._filter_sql(filters, "giorno")
+        column = group or "''"
+        rows = self.conn.execute(
+            f"SELECT {PERIODI_SQL[resolution]} AS periodo, {column} AS gruppo, SUM(n) AS n "
+            f"FROM aggregati_andamento WHERE {where} GROUP BY periodo, gruppo ORDER BY periodo",
+            params,
+        ).fetchall()
+        return [(row["periodo"], row["gruppo"], row["n"]) for row in rows]
+
+    def count_in_bbox(self, bbox, filters=None):
+        """Numero di segnalazioni nel riquadro."""
+        where, params = self._bbox_filter(bbox, filters)
+        return self.conn.execute(f"SELECT COUNT(*) FROM segnalazioni WHERE {where}", params).fetchone()[0]
+
+    def points_in_bbox(self, bbox, limit=300, filters=None):
+        """Incidenti più recenti nel riquadro: la prima segnalazione di ciascuno, con il numero di duplicati."""
+        where, params = self._bbox_filter(bbox, filters)
+        rows = self.conn.execute(
+            "SELECT id, lat, lon, categoria, descrizione, stato, livello_pericolosita, "
+            "(SELECT COUNT(*) FROM segnalazioni d WHERE d.incidente_id = segnalazioni.id) AS segnalazioni "
+            f"FROM segnalazioni WHERE {where} AND (incidente_id IS NULL OR incidente_id = id) "
+            "ORDER BY data DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def grid_clusters(self, bbox, cell, filters=None):
+        """Segnalazioni del riquadro raggruppate in celle di `cell` gradi di lato.
+
+        Per ogni cella: numero di segnalazioni, baricentro, livello massimo e
+        categoria più frequente.
+        """
+        where, params = self._bbox_filter(bbox, filters)
+        rows = self.conn.execute(
+            "SELECT CAST((lat + 90) / ? AS INTEGER) AS gy, CAST((lon + 180) / ? AS INTEGER) AS gx, "
+            "categoria, COUNT(*) AS n, SUM(lat) AS sum_lat, SUM(lon) AS sum_lon, "
+            "MAX(livello_pericolosita) AS livello "
+            f"FROM segnalazioni WHERE {where} GROUP BY gy, gx, categoria",
+            (cell, cell, *params),
+        ).fetchall()
+        cells = {}
+        for row in rows:
+            entry = cells.setdefault((row["gy"], row["gx"]), {
+                "n": 0, "sum_lat": 0.0, "sum_lon": 0.0, "livello": 0, "categorie": {},
+            })
+            entry["n"] += row["n"]
+            entry["sum_lat"] += row["sum_lat"]
+            entry["sum_lon"] += row["sum_lon"]
+            entry["livello"] = max(entry["livello"], row["livello"])
+            entry["categorie"][row["categoria"]] = row["n"]
+        return [
+            {
+                "lat": entry["sum_lat"] / entry["n"],
+                "lon": entry["sum_lon"] / entry["n"],
+                "n": entry["n"],
+                "livello_max": entry["livello"],
+                "categoria": max(entry["categorie"], key=entry["categorie"].get),
+                "categorie": entry["categorie"],
+            }
+            for entry in cells.values()
+        ]
+
+    def latest(self, limit=5):
+        """Ultime segnalazioni inserite."""
+        rows = self.conn.execute(
+            "SELECT id, data, categoria, descrizione, stato, location FROM segnalazioni "
+            "ORDER BY data DESC, id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def page(self, filters=None, order="data", descending=True, after=None, limit=20):
+        """Una pagina di segnalazioni con paginazione per chiave (keyset).
+
+        `after` è la chiave dell'ultima riga della pagina precedente: la query parte
+        da lì usando l'indice, senza contare le righe da saltare come farebbe OFFSET.
+        Restituisce le righe e la chiave per la pagina successiva (None se è l'ultima).
+        """
+        key = ORDINAMENTI[order]
+        direction = "DESC" if descending else "ASC"
+        where, params = self._filter_sql(filters)
+        if after is not None:
+            columns = ", ".join(key)
+            where += f" AND ({columns}) {'<' if descending else '>'} ({', '.join('?' for _ in key)})"
+            params.extend(after)
+        rows = self.conn.execute(
+            "SELECT id, data, categoria, descrizione, stato, location, livello_pericolosita FROM segnalazioni "
+            f"WHERE {where} ORDER BY {', '.join(f'{column} {direction}' for column in key)} LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        rows = [dict(row) for row in rows]
+        next_key = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_key = tuple(rows[-1][column] for column in key)
+        return rows, next_key
+
+    def index_rows(self, ids=None):
+        """Campi filtrabili delle segnalazioni (tutte o quelle di `ids`) in ordine di data."""
+        query = "SELECT id, substr(data, 1, 10) AS giorno, categoria, stato, quartiere FROM segnalazioni"
+        if ids is None:
+            return self.conn.execute(f"{query} ORDER BY data, id")
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows.extend(self.conn.execute(f"{query} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk))
+        return sorted(rows, key=lambda row: (row["giorno"], row["id"]))
+
+    # --- Letture in blocchi (export) ---
+
+    def report_chunks(self, filters=None, chunk_size=500, columns=COLONNE):
+        """Segnalazioni (filtrate), dalla più recente, in liste di al più `chunk_size` righe."""
+        where, params = self._filter_sql(filters)
+        cur = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM segnalazioni WHERE {where} ORDER BY data DESC, id DESC",
+            params,
+        )
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def iter_reports(self, chunk_size=500, filters=None):
+        """Tutte le segnalazioni (filtrate), dalla più recente, lette a blocchi di `chunk_size` righe."""
+        for rows in self.report_chunks(filters, chunk_size):
+            for row in rows:
+                yield dict(row)
+
+    def iter_assessments(self, chunk_size=500, filters=None):
+        """Come `iter_reports`, ma restituisce tuple `(id, stato, RiskAssessment)`."""
+        from core.schema import RiskAssessment
+
+        for row in self.iter_reports(chunk_size, filters):
+            yield row["id"], row["stato"], RiskAssessment(
+                data=datetime.datetime.strptime(row["data"], DATE_FORMAT),
+                location=row["location"],
+                quartiere=row["quartiere"],
+                lat=row["lat"],
+                lon=row["lon"],
+                raccomandazione=row["raccomandazione"],
+                livello_pericolosita=row["livello_pericolosita"],
+                descrizione=row["descrizione"],
+                categoria=row["categoria"],
+            )
+
+
+@lru_cache(maxsize=None)
+def get_store(path=DB_PATH):
+    """Restituisce l'istanza condivisa dell'archivio per il processo."""
+    return ReportStore(path)
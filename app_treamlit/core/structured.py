@@ -0,0 +1,176 @@
+"""Output strutturato del modello guidato dallo schema di `RiskAssessment`.
+
+Lo schema dei campi prodotti dal modello diventa la definizione di un tool (function
+calling): con Bedrock il modello è obbligato a rispondere con gli argomenti del tool.
+Gli argomenti arrivano in streaming e vengono analizzati man mano da
+`IncrementalJSONParser`, che valida ogni campo appena è completo: un valore non
+valido interrompe subito lo stream invece di aspettare la fine della risposta.
+"""
+import json
+import threading
+
+from pydantic import TypeAdapter, ValidationError, create_model
+
+from core import metrics
+from core.schema import RiskAssessment
+
+# Campi della valutazione prodotti dal modello (data e localizzazione li aggiunge l'app)
+OUTPUT_FIELDS = ("livello_pericolosita", "categoria", "descrizione", "raccomandazione")
+
+RiskAssessmentOutput = create_model(
+    "ValutazioneRischio",
+    **{name: (RiskAssessment.model_fields[name].annotation, RiskAssessment.model_fields[name])
+       for name in OUTPUT_FIELDS},
+)
+
+TOOL = {
+    "name": "registra_valutazione",
+    "description": "Registra la valutazione del rischio della criticità urbana mostrata nell'immagine.",
+    "input_schema": RiskAssessmentOutput.model_json_schema(),
+}
+
+_field_adapters = {name: TypeAdapter(RiskAssessment.model_fields[name].annotation) for name in OUTPUT_FIELDS}
+
+# Contatori di processo sull'esito dell'analisi delle risposte
+_stats_lock = threading.Lock()
+stats = {
+    "risposte": 0,
+    "json_non_valido": 0,
+    "campi_non_validi": 0,
+    "interruzioni_anticipate": 0,
+    "riparazioni": 0,
+    "riparazioni_riuscite": 0,
+}
+
+
+def count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+metrics.register_collector(lambda: [("structured_output_total", {"esito": name}, n) for name, n in stats.items()])
+
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """Analizza un oggetto JSON piatto ricevuto a pezzi.
+
+    `feed` restituisce le coppie (campo, valore) completate dall'ultimo pezzo. Il
+    testo prima della prima parentesi graffa (ad esempio una frase introduttiva
+    del modello) viene ignorato. Un errore di sintassi che non può dipendere da un
+    pezzo ancora da ricevere (chiave non stringa, due punti mancanti) ferma l'analisi
+    e viene descritto in `error`.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.values = {}
+        self.closed = False
+        self.error = None
+        self._decoder = json.JSONDecoder()
+
+    def _skip(self, chars):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+            self.pos += 1
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        if self.pos is None:
+            start = self.buffer.find("{")
+            if start < 0:
+                return completed
+            self.pos = start + 1
+
+        while not self.closed and self.error is None:
+            self._skip(_WHITESPACE + ",")
+            if self.pos >= len(self.buffer):
+                break
+            if self.buffer[self.pos] == "}":
+                self.closed = True
+                break
+            try:
+                key, key_end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                break
+            if not isinstance(key, str):
+                self.error = f"chiave non valida alla posizione {self.pos}: {key!r}"
+                break
+            colon = key_end
+            while colon < len(self.buffer) and self.buffer[colon] in _WHITESPACE:
+                colon += 1
+            if colon >= len(self.buffer):
+                break
+            if self.buffer[colon] != ":":
+                self.error = f"manca ':' dopo la chiave {key!r}"
+                break
+            value_start = colon + 1
+            while value_start < len(self.buffer) and self.buffer[value_start] in _WHITESPACE:
+                value_start += 1
+            try:
+                value, value_end = self._decoder.raw_decode(self.buffer, value_start)
+            except json.JSONDecodeError:
+                break
+            # Un numero o un letterale in fondo al buffer potrebbe continuare nel prossimo pezzo
+            if value_end >= len(self.buffer) and self.buffer[value_start] not in '"[{':
+                break
+            self.values[key] = value
+            completed.append((key, value))
+            self.pos = value_end
+        return completed
+
+
+def validate_field(name, value):
+    """Restituisce il messaggio d'errore se il valore non rispetta lo schema, altrimenti None."""
+    adapter = _field_adapters.get(name)
+    if adapter is None:
+        return None
+    try:
+        adapter.validate_python(value)
+    except ValidationError as error:
+        return f"{name}: {error.errors()[0]['msg']}"
+    return None
+
+
+def read_structured(chunks):
+    """Consuma i pezzi di testo di una risposta e restituisce (dati, errori, testo).
+
+    Lo stream viene chiuso al primo campo non valido: la risposta andrà comunque
+    ripetuta, quindi è inutile attenderne la fine.
+    """
+    count("risposte")
+    parser = IncrementalJSONParser()
+    errors = []
+    for chunk in chunks:
+        for name, value in parser.feed(chunk):
+            error = validate_field(name, value)
+            if error:
+                errors.append(error)
+        if errors or parser.error:
+            count("interruzioni_anticipate")
+            if hasattr(chunks, "close"):
+                chunks.close()
+            break
+
+    if not errors:
+        if parser.error:
+            count("json_non_valido")
+            return None, [f"JSON non valido: {parser.error}"], parser.buffer
+        if not parser.closed:
+            count("json_non_valido")
+            return None, ["la risposta non contiene un oggetto JSON completo"], parser.buffer
+        try:
+            return RiskAssessmentOutput.model_validate(parser.values).model_dump(), [], parser.buffer
+        except ValidationError as error:
+            errors = [f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors()]
+    count("campi_non_validi")
+    return None, errors, parser.buffer
+
+
+REPAIR_PROMPT = (
+    "La risposta precedente non rispetta lo schema richiesto:\n{errors}\n\n"
+    "Restituisci di nuovo la valutazione completa, correggendo solo questi problemi."
+)
@@ -0,0 +1,144 @@
+"""Andamento delle segnalazioni su periodi lunghi.
+
+I conteggi arrivano già aggregati per giorno, settimana o mese dai contatori
+dell'archivio (`ReportStore.trend_counts`): il costo non dipende dal numero di
+segnalazioni. Le serie sono completate con i periodi vuoti, la media mobile è
+calcolata con pandas su tutte le serie insieme e, prima di costruire la figura,
+ogni serie più lunga di `TREND_MAX_POINTS` punti è ridotta con LTTB (Largest
+Triangle Three Buckets), che conserva picchi e forma della curva: i dati inviati
+al browser restano pochi qualunque sia l'intervallo.
+"""
+import datetime
+from typing import NamedTuple
+
+from core.config import get_setting
+
+MAX_POINTS = int(get_setting("TREND_MAX_POINTS", 500))
+# Oltre questo numero di serie (ad esempio i quartieri) le minori confluiscono in "Altri"
+MAX_SERIES = 8
+
+
+class Resolution(NamedTuple):
+    etichetta: str
+    # Frequenza pandas dei periodi, allineata agli inizi calcolati dall'archivio
+    freq: str
+    # Periodi della media mobile
+    finestra: int
+    finestra_etichetta: str
+
+
+RISOLUZIONI = {
+    "giorno": Resolution("Giorno", "D", 7, "7 giorni"),
+    "settimana": Resolution("Settimana", "W-MON", 4, "4 settimane"),
+    "mese": Resolution("Mese", "MS", 3, "3 mesi"),
+}
+# Intervalli proposti nella dashboard (giorni, None per tutto lo storico)
+PERIODI = {
+    "Ultimo mese": 31,
+    "Ultimi 3 mesi": 92,
+    "Ultimo anno": 366,
+    "Ultimi 3 anni": 3 * 366,
+    "Tutto lo storico": None,
+}
+
+
+def period_start(day, resolution):
+    """Inizio del periodo che contiene `day` (le settimane iniziano il lunedì)."""
+    if resolution == "settimana":
+        return day - datetime.timedelta(days=day.weekday())
+    if resolution == "mese":
+        return day.replace(day=1)
+    return day
+
+
+def trend_frame(rows, resolution, start=None, end=None, grouped=False, max_series=MAX_SERIES):
+    """Tabella periodi x serie dalle terne di `trend_counts`, con i periodi vuoti a zero.
+
+    Senza raggruppamento l'unica serie si chiama "Totale"; `start` ed `end` (date)
+    estendono l'asse oltre il primo e l'ultimo periodo con segnalazioni.
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(rows, columns=["periodo", "gruppo", "n"])
+    frame["periodo"] = pd.to_datetime(frame["periodo"], format="%Y-%m-%d")
+    frame["gruppo"] = frame["gruppo"].replace("", "Non indicato") if grouped else "Totale"
+    if rows:
+        table = frame.pivot_table(index="periodo", columns="gruppo", values="n", aggfunc="sum", fill_value=0)
+    else:
+        table = pd.DataFrame({"Totale": []}, index=pd.DatetimeIndex([], name="periodo"))
+
+    first = [pd.Timestamp(period_start(start, resolution))] if start else []
+    last = [pd.Timestamp(period_start(end, resolution))] if end else []
+    bounds = first + list(table.index[:1]) + list(table.index[-1:]) + last
+    if bounds:
+        index = pd.date_range(min(bounds), max(bounds), freq=RISOLUZIONI[resolution].freq, name="periodo")
+        table = table.reindex(index, fill_value=0)
+
+    if len(table.columns) > max_series:
+        totals = table.sum().sort_values(ascending=False)
+        others = totals.index[max_series - 1:]
+        table = table.drop(columns=others).assign(Altri=table[others].sum(axis=1))
+    return table.astype("int64")
+
+
+def rolling_mean(table, resolution):
+    """Media mobile di tutte le serie sulla finestra della risoluzione."""
+    return table.rolling(RISOLUZIONI[resolution].finestra, min_periods=1).mean()
+
+
+def lttb(values, threshold=MAX_POINTS):
+    """Posizioni dei punti scelti da LTTB su una serie a intervalli regolari.
+
+    Il primo e l'ultimo punto restano; ogni gruppo intermedio conserva il punto che
+    forma il triangolo più grande con il punto scelto prima e con la media del gruppo
+    successivo.
+    """
+    import numpy as np
+
+    y = np.asarray(values, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def trend_figure(table, resolution, title, colors=None, rolling=True, max_points=MAX_POINTS):
+    """Figura plotly con una linea per serie e, se richiesta, la sua media mobile tratteggiata."""
+    import plotly.graph_objects as go
+
+    colors = colors or {}
+    averages = rolling_mean(table, resolution) if rolling else None
+    figure = go.Figure()
+    for column in table.columns:
+        series = table[column]
+        points = lttb(series.to_numpy(), max_points)
+        color = colors.get(column)
+        figure.add_trace(go.Scatter(
+            x=series.index[points], y=series.to_numpy()[points], mode="lines", name=str(column),
+            legendgroup=str(column), line={"color": color, "width": 1 if rolling else 2},
+            opacity=0.5 if rolling else 1.0,
+        ))
+        if rolling:
+            average = averages[column]
+            points = lttb(average.to_numpy(), max_points)
+            figure.add_trace(go.Scatter(
+                x=average.index[points], y=average.to_numpy()[points].round(2), mode="lines",
+                name=f"{column} (media {RISOLUZIONI[resolution].finestra_etichetta})",
+                legendgroup=str(column), line={"color": color, "width": 2, "dash": "dash"},
+            ))
+    figure.update_layout(title=title, xaxis_title=RISOLUZIONI[resolution].etichetta,
+                         yaxis_title="Numero", hovermode="x unified")
+    return figure
@@ -0,0 +1,69 @@
+"""Riscaldamento del processo dopo la prima pagina servita.
+
+Le pagine importano le librerie pesanti (grafici, mappe, modello, PDF) solo quando
+servono, quindi la pagina iniziale si apre subito. Subito dopo il primo rendering un
+thread in background apre l'archivio, riempie le cache della pagina iniziale e
+importa in anticipo i moduli delle altre pagine: il primo accesso alla dashboard o
+alla chat non paga più le importazioni. Disattivabile con `WARMUP = false`.
+"""
+import importlib
+import logging
+import threading
+import time
+
+import streamlit as st
+
+from core import metrics
+from core.config import get_flag
+
+logger = logging.getLogger(__name__)
+
+WARMUP = get_flag("WARMUP", True)
+
+# Moduli importati in anticipo, nell'ordine in cui servono: prima la dashboard, poi la chat
+PREIMPORT = (
+    "pandas", "plotly.express", "folium", "streamlit_folium", "core.geo",
+    "langchain.schema", "pydantic", "PIL.Image", "fpdf",
+    "core.llm", "core.assessment", "core.jobs", "core.batch", "core.pdf",
+)
+
+
+def warm_caches():
+    """Apre l'archivio e calcola i dati della pagina iniziale, del gazetteer e delle FAQ."""
+    from core import faq, geocoder, queries
+
+    queries.load_summary()
+    geocoder.get_gazetteer()
+    faq.get_faq_index()
+
+
+def preimport(modules=PREIMPORT):
+    """Importa i moduli indicati registrando il tempo di ognuno (`import_seconds`)."""
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # Dipendenza opzionale non installata: la pagina che la usa mostrerà l'errore
+            continue
+        metrics.observe("import_seconds", time.perf_counter() - start, modulo=name)
+
+
+def run():
+    with metrics.timer("warmup_seconds"):
+        try:
+            warm_caches()
+            preimport()
+        except Exception:
+            # Il riscaldamento è solo un'ottimizzazione: gli errori restano alle pagine
+            logger.exception("Riscaldamento non completato")
+
+
+@st.cache_resource(show_spinner=False)
+def start():
+    """Avvia (una sola volta per processo) il riscaldamento in background."""
+    if not WARMUP:
+        return None
+    thread = threading.Thread(target=run, name="riscaldamento", daemon=True)
+    thread.start()
+    return thread
@@ -1,9 +1,7 @@
 import streamlit as st
-from PIL import Image
-import base64
-import pandas as pd
-import folium
-from streamlit_folium import folium_static
+
+from core import queries
+from core.filters import sidebar_filters
 
 # Page configuration
 st.set_page_config(
@@ -134,36 +132,47 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# Sidebar with login and filters
+with st.sidebar:
+    st.markdown("### Login")
+    username = st.text_input("Username")
+    password = st.text_input("Password", type="password")
+    st.button("Accedi")
+
+    active_filters = sidebar_filters()
+
 # Dashboard statistics
+summary = queries.load_summary(active_filters)
+
 col1, col2, col3, col4 = st.columns(4)
 with col1:
-    st.markdown("""
+    st.markdown(f"""
     <div class='stat-box'>
-        <div class='stat-number'>1,234</div>
+        <div class='stat-number'>{summary['totali']['valore']:,}</div>
         <div class='stat-label'>Segnalazioni Totali</div>
     </div>
     """, unsafe_allow_html=True)
 
 with col2:
-    st.markdown("""
+    st.markdown(f"""
     <div class='stat-box'>
-        <div class='stat-number'>782</div>
+        <div class='stat-number'>{summary['risolte']['valore']:,}</div>
         <div class='stat-label'>Segnalazioni Risolte</div>
     </div>
     """, unsafe_allow_html=True)
 
 with col3:
-    st.markdown("""
+    st.markdown(f"""
     <div class='stat-box'>
-        <div class='stat-number'>328</div>
+        <div class='stat-number'>{summary['in_lavorazione']['valore']:,}</div>
         <div class='stat-label'>In Lavorazione</div>
     </div>
     """, unsafe_allow_html=True)
 
 with col4:
-    st.markdown("""
+    st.markdown(f"""
     <div class='stat-box'>
-        <div class='stat-number'>124</div>
+        <div class='stat-number'>{summary['nuove']['valore']:,}</div>
         <div class='stat-label'>Segnalazioni Nuove</div>
     </div>
     """, unsafe_allow_html=True)
@@ -176,21 +185,6 @@ if st.button("INVIA NUOVA SEGNALAZIONE", use_container_width=True):
     st.switch_page("views/chatbot.py")
 
 
-# Sidebar with login and filters
-with st.sidebar:
-    st.markdown("### Login")
-    username = st.text_input("Username")
-    password = st.text_input("Password", type="password")
-    st.button("Accedi")
-    
-    st.markdown("### Filtri")
-    st.multiselect("Categorie", ["Strade", "Parchi", "Rifiuti", "Traffico", "Altre"])
-    st.selectbox("Quartiere", ["Tutti", "Centro Storico", "Chiaia", "Vomero", "Fuorigrotta", "Posillipo", "Bagnoli"])
-    st.selectbox("Stato", ["Tutti", "Nuova", "Assegnata", "In lavorazione", "Risolta", "Chiusa"])
-    st.date_input("Da data")
-    st.date_input("A data")
-    st.button("Applica Filtri")
-
 #Footer
 st.markdown("""
 <div class='napoli-footer'>
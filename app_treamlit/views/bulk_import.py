@@ -0,0 +1,48 @@
+import io
+
+import streamlit as st
+
+from core import importer
+from core.choices import STATI
+
+# Importazione dello storico da CSV o Excel (core.importer), a blocchi: per file
+# molto grandi c'è anche `python -m core.importer`
+st.title("📥 Importa Segnalazioni")
+st.markdown(
+    "Carica un file **CSV** o **Excel** con lo storico delle segnalazioni. Colonne richieste: "
+    f"`{'`, `'.join(importer.OBBLIGATORIE)}`; facoltative: `location`, `stato`, `quartiere`, `lat`, `lon`, "
+    "`raccomandazione`. Le righe non valide vengono scartate e si possono scaricare con il motivo."
+)
+
+uploaded = st.file_uploader("File da importare", type=["csv", "xlsx"])
+col_stato, col_dedup = st.columns(2)
+with col_stato:
+    default_stato = st.selectbox("Stato delle righe senza stato", STATI)
+with col_dedup:
+    dedup = st.checkbox("Riconosci i duplicati", value=True,
+                        help="Più lento: ogni riga viene confrontata con gli incidenti aperti vicini.")
+
+if uploaded is not None and st.button("Importa"):
+    bar = st.progress(0.0, text="Importazione in corso...")
+    size = uploaded.size or 1
+
+    def progress(read, imported, rejected):
+        # Avanzamento stimato dalla posizione nel file caricato
+        bar.progress(min(uploaded.tell() / size, 1.0),
+                     text=f"{read:,} righe lette, {imported:,} importate, {rejected:,} scartate")
+
+    rejects = io.BytesIO()
+    result = importer.import_reports(uploaded, name=uploaded.name, rejects=rejects,
+                                     default_stato=default_stato, dedup=dedup, progress=progress)
+    bar.progress(1.0, text="Importazione completata")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Righe Lette", f"{result.lette:,}")
+    col2.metric("Importate", f"{result.importate:,}")
+    col3.metric("Scartate", f"{result.scartate:,}")
+    col4.metric("Righe al Secondo", f"{result.righe_al_secondo:,.0f}")
+
+    if result.scartate:
+        # download_button accetta bytes, non il buffer
+        st.download_button("⬇️ Scarica le righe scartate", data=rejects.getvalue(),
+                           file_name=f"{uploaded.name.rsplit('.', 1)[0]}_scarti.csv", mime="text/csv")
@@ -1,49 +1,30 @@
 import streamlit as st
-import base64
-import httpx
-import boto3
-from langchain_aws import ChatBedrock
-from botocore.config import Config
-import urllib3
-from langchain.prompts import PromptTemplate
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from fpdf import FPDF
 import datetime
-from pydantic import BaseModel, Field
-from typing import Optional, Literal, List, Union
-import json
-import re
 
-# Disabilita avvisi SSL
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from core import geocoder
+from core.assessment_cache import get_assessment_cache
+from core.batch import MAX_WORKERS as BATCH_MAX_WORKERS, assess_batch, export_zip, images_from_zip, results_rows
+from core.config import get_flag
+from core.context import ConversationContext, LLMSummarizer
+from core.images import prepare_image
+from core.intent import SEGNALAZIONE, get_classifier
+from core.jobs import COMPLETATO, ERRORE, IN_CODA, NON_INTERPRETABILE, STATI_FINALI, get_job_queue, load_result
+from core.llm import get_backend, stream_text
+from core.pdf import render_pdf_report
+from core.store import get_store
 
-# Pydantic model per la segnalazione
-class RiskAssessment(BaseModel):
-    data: datetime.datetime = Field(default_factory=datetime.datetime.now)
-    location: Optional[str] = Field(default=None, description="Localizzazione della segnalazione")
-    raccomandazione: str = Field(description="Raccomandazione per l'amministrazione comunale")
-    livello_pericolosita: Literal[1, 2, 3] = Field(description="Livello di pericolosità (1=Basso, 2=Medio, 3=Alto)")
-    descrizione: str = Field(description="Descrizione dettagliata della segnalazione")
-    categoria: Literal["Strada Pubblica", "Verde Urbano", "Edifici e Infrastrutture", "Altre criticità"] = Field(
-        description="Categoria della segnalazione"
-    )
+# Backend del modello condiviso da tutte le sessioni (client e pool creati una sola volta)
+llm_bedrock = get_backend()
+
+# Classificatore degli intenti della chat (reindirizzamenti senza chiamare il modello)
+intent_classifier = get_classifier()
 
-# Configura il client Bedrock
-bedrock_client = boto3.client(
-    service_name='bedrock-runtime',
-    region_name='eu-west-1',
-    aws_access_key_id=st.secrets["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=st.secrets["AWS_SECRET_ACCESS_KEY"],
-    verify=False,  # Disabilita la verifica SSL
-    config=Config(proxies={'https': None})
-)
+# Le risposte della chat generale vengono mostrate token per token (disattivabile)
+CHAT_STREAMING = get_flag("CHAT_STREAMING", True)
 
-# Inizializza il modello
-llm_bedrock = ChatBedrock(
-    model_id="anthropic.claude-3-haiku-20240307-v1:0",
-    client=bedrock_client,
-    model_kwargs={"temperature": 0.7, "max_tokens": 2000}
-)
+# Intervallo di aggiornamento dello stato delle valutazioni in corso (secondi)
+JOB_REFRESH = 2
 
 # Inizializza la cronologia della chat nella sessione se non esiste già
 if "messages" not in st.session_state:
@@ -51,22 +32,53 @@ if "messages" not in st.session_state:
         SystemMessage(content="Sei un assistente comunale che aiuta i cittadini con informazioni e segnalazioni. Rispondi in italiano.")
     ]
 
-# Inizializza le variabili di sessione per la gestione delle immagini
+# Contesto inviato al modello: budget di token, immagini vecchie rimosse e riassunto progressivo
+if "chat_context" not in st.session_state:
+    st.session_state.chat_context = ConversationContext(LLMSummarizer(llm_bedrock))
+
+# Inizializza le variabili di sessione per la gestione delle immagini (già ridimensionate e ricompresse)
 if "image_data" not in st.session_state:
     st.session_state.image_data = None
 if "image_source" not in st.session_state:
     st.session_state.image_source = None
 
+# Coda delle valutazioni in background (worker avviati una sola volta per processo)
+job_queue = get_job_queue()
+job_queue.start(llm_bedrock, cache=get_assessment_cache(), store=get_store())
+if "assessment_jobs" not in st.session_state:
+    st.session_state.assessment_jobs = []
+    st.session_state.job_pdfs = {}
+
 # Streamlit UI con tabs
 st.title("Assistente Comunale AI")
 
-tabs = st.tabs(["Chat Generale 💬", "Valutazione Rischio ⚠️"])
+tabs = st.tabs(["Chat Generale 💬", "Valutazione Rischio ⚠️", "Valutazione Multipla 📁"])
 
 with tabs[1]:
     st.header("Valutatore di Rischio")
     
-    # Input per la localizzazione
+    # Input per la localizzazione, con i suggerimenti del gazetteer di Napoli
     location_input = st.text_input("Inserisci la localizzazione (opzionale)", "")
+    # Luogo confermato dall'utente: è quello salvato con la segnalazione, senza nuova geocodifica
+    place = None
+    if location_input:
+        suggestions = list(geocoder.suggest(location_input))
+        best = geocoder.geocode(location_input)
+        if best is not None and best not in suggestions:
+            suggestions.insert(0, best)
+        if suggestions:
+            place = st.selectbox(
+                "Luogo riconosciuto",
+                suggestions + [None],
+                # Senza corrispondenza i suggerimenti approssimati vanno scelti esplicitamente
+                index=suggestions.index(best) if best in suggestions else len(suggestions),
+                format_func=lambda p: f"{p.nome} ({p.quartiere})" if p else "Nessuno: usa solo il testo inserito",
+            )
+            # Se l'utente sceglie un altro luogo, si salva il nome del luogo scelto
+            if place is not None and place != best:
+                location_input = place.nome
+        else:
+            st.caption("Localizzazione non riconosciuta: la segnalazione non comparirà sulla mappa.")
     
     # Radio button per selezionare la fonte dell'immagine
     image_source = st.radio(
@@ -80,7 +92,7 @@ with tabs[1]:
     if image_source == "Carica un'immagine":
         uploaded_file = st.file_uploader("Carica un'immagine per la valutazione del rischio", type=["jpg", "jpeg", "png"])
         if uploaded_file is not None:
-            st.session_state.image_data = base64.b64encode(uploaded_file.read()).decode("utf-8")
+            st.session_state.image_data = prepare_image(uploaded_file.getvalue())
             st.image(uploaded_file, caption="Immagine caricata", use_container_width=True)
         elif st.session_state.image_source != "Carica un'immagine":
             st.session_state.image_data = None
@@ -90,7 +102,7 @@ with tabs[1]:
             captured_image = st.camera_input("Scatta una foto")
         with camera_col2:
             if captured_image is not None:
-                st.session_state.image_data = base64.b64encode(captured_image.read()).decode("utf-8")
+                st.session_state.image_data = prepare_image(captured_image.getvalue())
                 if st.button("❌ Cancella foto", key="clear_camera"):
                     st.session_state.image_data = None
                     st.rerun()
@@ -99,150 +111,156 @@ with tabs[1]:
     if st.session_state.image_data is None:
         st.warning("Carica un'immagine o scatta una foto per ottenere una valutazione.")
 
-    # Definisci il prompt template
-    prompt_template = PromptTemplate(
-        input_variables=[],
-        template="""
-        Analizza l'immagine e assegna un livello di rischio:
-        - Basso rischio (1): Il problema non rappresenta un pericolo immediato ma richiede intervento per prevenire danni futuri.
-        - Medio rischio (2): Il problema può causare disagi e potenziali incidenti se non risolto in tempi brevi.
-        - Alto rischio (3): Il problema rappresenta un pericolo immediato per la sicurezza pubblica e richiede un intervento urgente.
-        
-        Categorie di valutazione:
-        1. Strada Pubblica
-        2. Verde Urbano
-        3. Edifici e Infrastrutture
-        4. Altre criticità (illuminazione, segnaletica, sicurezza urbana)
-        
-        Fornisci la risposta in formato JSON strutturato con i seguenti campi:
-        - livello_pericolosita: numero intero da 1 a 3
-        - categoria: una delle categorie elencate sopra
-        - descrizione: descrizione dettagliata del problema
-        - raccomandazione: suggerimento chiaro per l'amministrazione comunale
-        
-        Assicurati che il JSON sia valido e correttamente formattato.
-        """.strip()
-    )
+    if st.session_state.image_data and st.button("Valuta Rischio ⚠️"):
+        # La valutazione viene eseguita in background: la pagina resta utilizzabile
+        job_id = job_queue.submit(
+            st.session_state.image_data,
+            location=location_input if location_input else None,
+            place=place,
+        )
+        st.session_state.assessment_jobs.insert(0, job_id)
 
-    def extract_json_from_text(text):
-        """Estrae il JSON dalla risposta di testo."""
-        # Cerca un pattern JSON nella risposta
-        json_pattern = r'\{[\s\S]*\}'
-        match = re.search(json_pattern, text)
+    def show_assessment(job):
+        """Visualizza il risultato di una valutazione completata."""
+        assessment = load_result(job)
         
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except json.JSONDecodeError:
-                return None
-        return None
-
-    def create_pdf_report(assessment):
-        """Crea un report PDF basato sulla valutazione."""
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
+        # Visualizza i risultati
+        st.subheader("Risultati della Valutazione")
+        st.caption(f"Segnalazione n. {job['report_id']} registrata"
+                   + (" (valutazione già disponibile per questa immagine)" if job["cached"] else ""))
+        incidente_id, n_reports = get_store().incident(job["report_id"])
+        if n_reports > 1:
+            st.info(f"Problema già segnalato: la segnalazione è stata unita all'incidente n. {incidente_id} "
+                    f"({n_reports} segnalazioni).")
         
-        # Intestazione
-        pdf.set_font("Arial", style="B", size=16)
-        pdf.cell(200, 10, "Report di Valutazione del Rischio", ln=True, align='C')
-        pdf.ln(10)
+        # Mostra il livello di rischio con un colore appropriato
+        risk_colors = {1: "green", 2: "orange", 3: "red"}
+        risk_labels = {1: "Basso Rischio", 2: "Medio Rischio", 3: "Alto Rischio"}
         
-        # Contenuto
-        pdf.set_font("Arial", style="B", size=12)
-        pdf.cell(0, 10, f"Data: {assessment.data.strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
+        st.markdown(
+            f"<div style='background-color: {risk_colors[assessment.livello_pericolosita]}; padding: 10px; border-radius: 5px; color: white;'>"
+            f"<h3>{risk_labels[assessment.livello_pericolosita]}</h3></div>",
+            unsafe_allow_html=True
+        )
         
+        st.markdown(f"**Categoria:** {assessment.categoria}")
         if assessment.location:
-            pdf.cell(0, 10, f"Localizzazione: {assessment.location}", ln=True)
+            st.markdown(f"**Localizzazione:** {assessment.location}"
+                        + (f" ({assessment.quartiere})" if assessment.quartiere else ""))
         
-        pdf.cell(0, 10, f"Categoria: {assessment.categoria}", ln=True)
+        st.subheader("Descrizione")
+        st.write(assessment.descrizione)
         
-        # Livello di pericolosità con colore
-        risk_level_text = {1: "Basso", 2: "Medio", 3: "Alto"}
-        pdf.cell(0, 10, f"Livello di Pericolosità: {risk_level_text[assessment.livello_pericolosita]}", ln=True)
+        st.subheader("Raccomandazione")
+        st.write(assessment.raccomandazione)
         
-        pdf.ln(5)
-        pdf.set_font("Arial", style="B", size=12)
-        pdf.cell(0, 10, "Descrizione:", ln=True)
-        pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 10, assessment.descrizione)
-        
-        pdf.ln(5)
-        pdf.set_font("Arial", style="B", size=12)
-        pdf.cell(0, 10, "Raccomandazione:", ln=True)
-        pdf.set_font("Arial", size=12)
-        pdf.multi_cell(0, 10, assessment.raccomandazione)
-        
-        # Salvataggio del PDF
-        pdf_filename = f"report_rischio_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        pdf.output(pdf_filename)
+        # Crea e fornisci il PDF per il download (generato una sola volta per lavoro)
+        if job["id"] not in st.session_state.job_pdfs:
+            st.session_state.job_pdfs[job["id"]] = render_pdf_report(assessment)
+        st.download_button(
+            label="📄 Scarica il Report PDF",
+            data=st.session_state.job_pdfs[job["id"]],
+            file_name=f"report_rischio_{job['id']}.pdf",
+            mime="application/pdf",
+            key=f"pdf_{job['id']}",
+        )
+
+    def show_assessment_jobs():
+        """Stato delle valutazioni della sessione; si aggiorna da solo finché ce ne sono in corso."""
+        jobs = [job_queue.get(job_id) for job_id in st.session_state.assessment_jobs]
+        jobs = [job for job in jobs if job is not None]
+        for job in jobs:
+            if job["stato"] == COMPLETATO:
+                show_assessment(job)
+            elif job["stato"] == NON_INTERPRETABILE:
+                st.error("Non è stato possibile estrarre dati strutturati dalla risposta. Mostrando la risposta grezza:")
+                st.markdown(job["risposta"])
+            elif job["stato"] == ERRORE:
+                st.error(f"La valutazione non è riuscita: {job['errore']}")
+            elif job["stato"] == IN_CODA:
+                st.info(f"Valutazione in coda ({job_queue.position(job['id'])} prima della tua)...")
+            else:
+                st.info("Analizzando l'immagine...")
         
-        return pdf_filename
+        # Quando l'ultima valutazione termina, un rerun completo disattiva l'aggiornamento periodico
+        if st.session_state.jobs_pending and not any(job["stato"] not in STATI_FINALI for job in jobs):
+            st.session_state.jobs_pending = False
+            st.rerun()
 
-    if st.session_state.image_data and st.button("Valuta Rischio ⚠️"):
-        with st.spinner("Analizzando l'immagine..."):
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": prompt_template.format()},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{st.session_state.image_data}"}},
-                ],
-            )
-            
-            response = llm_bedrock.invoke([message])
-            
-            # Estrai il JSON dalla risposta
-            json_data = extract_json_from_text(response.content)
-            
-            if json_data:
-                # Crea l'oggetto Pydantic
-                assessment = RiskAssessment(
-                    data=datetime.datetime.now(),
-                    location=location_input if location_input else None,
-                    raccomandazione=json_data.get("raccomandazione", ""),
-                    livello_pericolosita=json_data.get("livello_pericolosita", 1),
-                    descrizione=json_data.get("descrizione", ""),
-                    categoria=json_data.get("categoria", "Altre criticità")
-                )
-                
-                # Visualizza i risultati
-                st.subheader("Risultati della Valutazione")
-                
-                # Mostra il livello di rischio con un colore appropriato
-                risk_colors = {1: "green", 2: "orange", 3: "red"}
-                risk_labels = {1: "Basso Rischio", 2: "Medio Rischio", 3: "Alto Rischio"}
-                
-                st.markdown(
-                    f"<div style='background-color: {risk_colors[assessment.livello_pericolosita]}; padding: 10px; border-radius: 5px; color: white;'>"
-                    f"<h3>{risk_labels[assessment.livello_pericolosita]}</h3></div>",
-                    unsafe_allow_html=True
-                )
-                
-                st.markdown(f"**Categoria:** {assessment.categoria}")
-                if assessment.location:
-                    st.markdown(f"**Localizzazione:** {assessment.location}")
-                
-                st.subheader("Descrizione")
-                st.write(assessment.descrizione)
-                
-                st.subheader("Raccomandazione")
-                st.write(assessment.raccomandazione)
-                
-                # Crea e fornisci il PDF per il download
-                pdf_file = create_pdf_report(assessment)
-                
-                with open(pdf_file, "rb") as file:
-                    st.download_button(
-                        label="📄 Scarica il Report PDF",
-                        data=file,
-                        file_name=pdf_file,
-                        mime="application/pdf"
-                    )
+    st.session_state.jobs_pending = any(
+        (job_queue.get(job_id) or {}).get("stato") not in STATI_FINALI
+        for job_id in st.session_state.assessment_jobs
+    )
+    st.fragment(show_assessment_jobs, run_every=JOB_REFRESH if st.session_state.jobs_pending else None)()
+
+
+# --- PAGINA VALUTAZIONE MULTIPLA ---
+with tabs[2]:
+    st.header("Valutazione Multipla")
+    st.write("Carica più foto (o un archivio ZIP) raccolte sul campo: vengono valutate in parallelo e salvate come segnalazioni.")
+    
+    batch_location = st.text_input("Localizzazione comune (opzionale)", "", key="batch_location")
+    batch_files = st.file_uploader(
+        "Carica le immagini o un archivio ZIP",
+        type=["jpg", "jpeg", "png", "zip"],
+        accept_multiple_files=True,
+        key="batch_files",
+    )
+    max_workers = st.slider("Valutazioni in parallelo", 1, max(BATCH_MAX_WORKERS, 8), BATCH_MAX_WORKERS)
+    
+    if batch_files and st.button("Valuta Tutte ⚠️"):
+        batch_images = []
+        for batch_file in batch_files:
+            if batch_file.name.lower().endswith(".zip"):
+                batch_images.extend(images_from_zip(batch_file.getvalue()))
             else:
-                st.error("Non è stato possibile estrarre dati strutturati dalla risposta. Mostrando la risposta grezza:")
-                st.markdown(response.content)
+                batch_images.append((batch_file.name, batch_file.getvalue()))
+        
+        progress = st.progress(0.0, text=f"0 di {len(batch_images)} immagini valutate")
+        
+        def show_progress(done, total, item):
+            progress.progress(done / total, text=f"{done} di {total} immagini valutate (ultima: {item.name}, {item.stato})")
+        
+        st.session_state.batch_results = assess_batch(
+            batch_images,
+            backend=llm_bedrock,
+            cache=get_assessment_cache(),
+            store=get_store(),
+            location=batch_location if batch_location else None,
+            place=geocoder.geocode(batch_location) if batch_location else None,
+            max_workers=max_workers,
+            on_progress=show_progress,
+        )
+        # L'archivio viene generato una sola volta, non a ogni rerun
+        st.session_state.batch_zip = export_zip(st.session_state.batch_results)
+    
+    if st.session_state.get("batch_results"):
+        st.subheader("Risultati")
+        st.dataframe(list(results_rows(st.session_state.batch_results)), use_container_width=True)
+        st.download_button(
+            label="🗂️ Scarica riepilogo e report PDF (ZIP)",
+            data=st.session_state.batch_zip,
+            file_name=f"valutazioni_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip",
+        )
 
 
 # --- PAGINA CHAT GENERALE ---
+def reply_from_model(messages):
+    """Mostra la risposta dell'assistente e restituisce l'AIMessage da salvare in cronologia.
+
+    In modalità streaming i token compaiono man mano che arrivano dal modello.
+    """
+    with st.chat_message("assistant"):
+        if CHAT_STREAMING:
+            text = st.write_stream(stream_text(llm_bedrock, messages))
+            return AIMessage(content=text)
+        with st.spinner("L'assistente sta scrivendo..."):
+            response = llm_bedrock.invoke(messages)
+        st.write(response.content)
+        return response
+
+
 with tabs[0]:
     st.header("Chat con l'Assistente Comunale")
     
@@ -274,10 +292,10 @@ with tabs[0]:
     if user_input:
         # Crea il contenuto del messaggio in base alla presenza o meno di un'immagine
         if chat_image:
-            image_data = base64.b64encode(chat_image.read()).decode("utf-8")
+            image_data = prepare_image(chat_image.getvalue())
             message_content = [
                 {"type": "text", "text": user_input},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
+                {"type": "image_url", "image_url": {"url": image_data.data_uri}}
             ]
         else:
             message_content = user_input
@@ -292,62 +310,32 @@ with tabs[0]:
             if chat_image:
                 st.image(chat_image, width=300)
         
-        # Ottieni la risposta dal modello
-        with st.spinner("L'assistente sta scrivendo..."):
-            response = llm_bedrock.invoke(st.session_state.messages)
-            
-            # Aggiungi la risposta dell'assistente alla cronologia
-            st.session_state.messages.append(response)
-            
-            # Visualizza la risposta dell'assistente
+        # Rilevamento dell'intento prima di qualsiasi chiamata al modello
+        intent = intent_classifier.classify(user_input)
+        
+        # Domande frequenti (solo testo): risposta predefinita, senza chiamare il modello
+        faq_answer = None if intent.is_redirect or chat_image else llm_bedrock.faq_answer(user_input)
+        
+        if intent.is_redirect:
+            # Risposta predefinita con reindirizzamento, senza chiamare il modello
+            response = AIMessage(content=intent.response)
             with st.chat_message("assistant"):
-                st.write(response.content)
-
-    if user_input:
-        # Rilevamento della richiesta di segnalazione
-        if "segnalazione" in user_input.lower() or "rischio" in user_input.lower() or "pericolo" in user_input.lower():
-            # Risposta del chatbot con reindirizzamento
-            response_content = "Per effettuare una segnalazione, vai alla scheda 'Valutazione Rischio' ⚠️."
-            
-            # Aggiungi il messaggio dell'utente e la risposta del chatbot alla cronologia
-            user_message = HumanMessage(content=user_input)
-            assistant_message = AIMessage(content=response_content)
-            st.session_state.messages.append(user_message)
-            st.session_state.messages.append(assistant_message)
-            
-            # Visualizza il messaggio dell'utente
-            with st.chat_message("user"):
-                st.write(user_input)
-            
-            # Visualizza la risposta del chatbot
+                st.write(intent.response)
+        elif faq_answer is not None:
+            response = AIMessage(content=faq_answer)
             with st.chat_message("assistant"):
-                st.write(response_content)
-            
+                st.write(faq_answer)
+        else:
+            # Una sola chiamata al modello per turno
+            response = reply_from_model(st.session_state.chat_context.build(st.session_state.messages))
+        
+        # Aggiungi la risposta dell'assistente alla cronologia
+        st.session_state.messages.append(response)
+        # Riassunto dei turni più vecchi, a risposta già mostrata
+        st.session_state.chat_context.refine()
+        
+        if intent.name == SEGNALAZIONE.name:
             # Pulsante per reindirizzare alla tab "Valutazione Rischio"
             if st.button("Vai a Valutazione Rischio ⚠️"):
                 tabs[1].__enter__() #simula il click sulla tab 0
                 st.rerun()
-                
-        else:
-            # Aggiungi il messaggio dell'utente alla cronologia
-            user_message = HumanMessage(content=message_content)
-            st.session_state.messages.append(user_message)
-            
-            # Visualizza il messaggio dell'utente
-            with st.chat_message("user"):
-                st.write(user_input)
-                if chat_image:
-                    st.image(chat_image, width=300)
-            
-            # Ottieni la risposta dal modello
-            with st.spinner("L'assistente sta scrivendo..."):
-                response = llm_bedrock.invoke(st.session_state.messages)
-                
-                # Aggiungi la risposta dell'assistente alla cronologia
-                st.session_state.messages.append(response)
-                
-                # Visualizza la risposta dell'assistente
-                with st.chat_message("assistant"):
-                    st.write(response.content)
-
-    
\ No newline at end of file
@@ -1,8 +1,9 @@
 import streamlit as st
-import folium
-from streamlit_folium import folium_static
-import pandas as pd
-import plotly.express as px
+
+from core import export, geo, metrics, queries, trends
+from core.filters import sidebar_filters
+from core.pdf import PDF_MAX_PAGES, get_renderer
+from core.store import get_store
 
 # Layout della pagina
 st.set_page_config(page_title="Dashboard Segnalazioni", layout="wide")
@@ -13,83 +14,168 @@ st.title("📊 Dashboard delle Segnalazioni Urbane")
 # Statistiche principali
 st.markdown("## 📌 Statistiche in Tempo Reale")
 
-col1, col2, col3, col4 = st.columns(4)
+# Filtri della sidebar, applicati a statistiche, grafici, mappa e tabella.
+# Ogni sezione registra il proprio tempo di esecuzione (core.metrics); i dati e le
+# figure sono condivisi tra le sessioni (core.queries)
+with st.sidebar:
+    active_filters = sidebar_filters()
+
+with metrics.timer("dashboard_section_seconds", sezione="statistiche"):
+    summary = queries.load_summary(active_filters)
+
+    col1, col2, col3, col4 = st.columns(4)
 
-with col1:
-    st.metric(label="Segnalazioni Totali", value="1,234", delta="+45 rispetto alla scorsa settimana")
-with col2:
-    st.metric(label="Segnalazioni Risolte", value="782", delta="+30")
-with col3:
-    st.metric(label="In Lavorazione", value="328", delta="-12")
-with col4:
-    st.metric(label="Segnalazioni Nuove", value="124", delta="+27")
+    with col1:
+        st.metric(label="Segnalazioni Totali", value=f"{summary['totali']['valore']:,}",
+                  delta=f"{summary['totali']['delta']:+d} rispetto alla scorsa settimana")
+    with col2:
+        st.metric(label="Segnalazioni Risolte", value=f"{summary['risolte']['valore']:,}", delta=f"{summary['risolte']['delta']:+d}")
+    with col3:
+        st.metric(label="In Lavorazione", value=f"{summary['in_lavorazione']['valore']:,}", delta=f"{summary['in_lavorazione']['delta']:+d}")
+    with col4:
+        st.metric(label="Segnalazioni Nuove", value=f"{summary['nuove']['valore']:,}", delta=f"{summary['nuove']['delta']:+d}")
 
 # Grafico delle segnalazioni per categoria
 st.markdown("## 📈 Distribuzione delle Segnalazioni")
-data_pie = pd.DataFrame({
-    "Categoria": ["Strade", "Rifiuti", "Parchi", "Traffico", "Altre"],
-    "Numero": [450, 320, 210, 150, 104]
-})
-category_colors = {"Strade": "#E63946", "Rifiuti": "#F4A261", "Parchi": "#2A9D8F", "Traffico": "#264653", "Altre": "#8A4FFF"}
-fig_pie = px.pie(data_pie, names='Categoria', values='Numero', title='Distribuzione per Categoria', 
-                 color='Categoria', color_discrete_map=category_colors)
-st.plotly_chart(fig_pie, use_container_width=True)
+with metrics.timer("dashboard_section_seconds", sezione="distribuzione"):
+    fig_pie = queries.load_category_chart(active_filters)
+    st.plotly_chart(fig_pie, use_container_width=True)
 
 # Mappa delle segnalazioni
 st.markdown("## 🗺️ Mappa delle Segnalazioni")
 
-map_data = [
-    {"lat": 40.8401, "lon": 14.2516, "category": "Strade", "desc": "Buca profonda in Via Toledo", "status": "In lavorazione"},
-    {"lat": 40.8470, "lon": 14.2513, "category": "Rifiuti", "desc": "Cassonetti non svuotati in Piazza Dante", "status": "Risolto"},
-    {"lat": 40.8344, "lon": 14.2351, "category": "Parchi", "desc": "Panchine rotte alla Villa Comunale", "status": "Assegnato"},
-    {"lat": 40.8517, "lon": 14.2720, "category": "Traffico", "desc": "Semaforo non funzionante a Piazza Garibaldi", "status": "In attesa"},
-    {"lat": 40.8367, "lon": 14.2450, "category": "Strade", "desc": "Marciapiede dissestato in Via Chiaia", "status": "Risolto"},
-    {"lat": 40.8550, "lon": 14.2427, "category": "Rifiuti", "desc": "Discarica abusiva in Vico San Pietro", "status": "Nuova"},
-    {"lat": 40.8322, "lon": 14.2388, "category": "Parchi", "desc": "Giochi danneggiati al Parco Virgiliano", "status": "In lavorazione"},
-]
-
-m = folium.Map(location=[40.8333, 14.2500], zoom_start=14)
-category_colors = {"Strade": "red", "Rifiuti": "green", "Parchi": "darkgreen", "Traffico": "orange", "Altre": "blue"}
-
-for point in map_data:
-    html = f"""
-    <div style='font-family:sans-serif;'>
-        <h4>{point['category']}</h4>
-        <p><b>Descrizione:</b> {point['desc']}</p>
-        <p><b>Stato:</b> {point['status']}</p>
-    </div>
-    """
-    color = category_colors.get(point['category'], 'blue')
-    folium.Marker(
-        [point['lat'], point['lon']], 
-        popup=folium.Popup(html, max_width=300),
-        icon=folium.Icon(color=color, icon="info-sign")
-    ).add_to(m)
-
-folium_static(m)
-
-# Grafico dell'andamento settimanale
-st.markdown("## 📊 Andamento delle Segnalazioni Settimanali")
-trend_data = pd.DataFrame({
-    "Giorno": ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"],
-    "Numero": [120, 150, 180, 140, 160, 130, 110]
-})
-fig_trend = px.line(trend_data, x='Giorno', y='Numero', markers=True, title='Numero di Segnalazioni negli Ultimi 7 Giorni')
-st.plotly_chart(fig_trend, use_container_width=True)
-
-# Tabella delle ultime segnalazioni
+with metrics.timer("dashboard_section_seconds", sezione="mappa"):
+    # folium è importato dalla sezione che lo usa: le statistiche compaiono prima
+    from streamlit_folium import st_folium
+
+    # Vista corrente della mappa: solo le segnalazioni nel riquadro visibile vengono caricate
+    if "map_view" not in st.session_state:
+        st.session_state.map_view = {"bbox": geo.NAPOLI_BBOX, "zoom": geo.DEFAULT_ZOOM, "center": geo.NAPOLI_CENTER}
+    map_view = st.session_state.map_view
+
+    zoom, tile_bbox = geo.view_key(map_view["bbox"], map_view["zoom"])
+    map_layer = queries.load_map_layer(zoom, tile_bbox, active_filters)
+
+    if map_layer["modo"] == "cluster":
+        st.caption(f"{map_layer['totale']:,} segnalazioni nell'area visibile, raggruppate per zona: avvicina la mappa per i dettagli.")
+
+    m = geo.build_map(map_layer, map_view["center"], zoom)
+    map_state = st_folium(m, key="mappa_segnalazioni", height=500, use_container_width=True,
+                          returned_objects=["bounds", "zoom", "center"])
+
+    # Quando l'utente sposta o ingrandisce la mappa su un'altra tile, si ricarica lo strato
+    # Al primo rendering st_folium restituisce i valori predefiniti, senza `center`
+    if map_state and map_state.get("bounds") and map_state.get("zoom"):
+        center = map_state.get("center")
+        new_view = {
+            "bbox": geo.bbox_from_bounds(map_state["bounds"]),
+            "zoom": map_state["zoom"],
+            "center": (center["lat"], center["lng"]) if center else map_view["center"],
+        }
+        if geo.view_key(new_view["bbox"], new_view["zoom"]) != (zoom, tile_bbox):
+            st.session_state.map_view = new_view
+            st.rerun()
+
+# Andamento su periodi lunghi, dai contatori giornalieri dell'archivio: le serie lunghe
+# sono ridotte prima dell'invio al browser (core.trends)
+st.markdown("## 📊 Andamento delle Segnalazioni")
+col_period, col_resolution, col_group, col_rolling = st.columns([2, 2, 2, 1])
+with col_period:
+    trend_period = st.selectbox("Periodo", list(trends.PERIODI), index=2, key="andamento_periodo")
+with col_resolution:
+    trend_resolution = st.selectbox("Risoluzione", list(trends.RISOLUZIONI), index=1, key="andamento_risoluzione",
+                                    format_func=lambda name: trends.RISOLUZIONI[name].etichetta)
+with col_group:
+    trend_group = st.selectbox("Suddividi per", ["Nessuna", "Categoria", "Quartiere", "Stato"], key="andamento_gruppo")
+with col_rolling:
+    trend_rolling = st.checkbox("Media mobile", value=True, key="andamento_media")
+with metrics.timer("dashboard_section_seconds", sezione="andamento"):
+    fig_trend = queries.load_trend_chart(
+        active_filters, trend_resolution, trends.PERIODI[trend_period],
+        None if trend_group == "Nessuna" else trend_group.lower(), trend_rolling,
+    )
+    st.plotly_chart(fig_trend, use_container_width=True)
+
+# Tabella delle ultime segnalazioni: filtri e ordinamento applicati dall'archivio,
+# al browser arriva solo la pagina visibile
 st.markdown("## 📝 Ultime Segnalazioni")
-data = {
-    'Data': ['12/03/2025', '11/03/2025', '10/03/2025', '09/03/2025', '08/03/2025'],
-    'Categoria': ['Strade', 'Rifiuti', 'Parchi', 'Traffico', 'Strade'],
-    'Descrizione': [
-        'Buca profonda in Via Toledo', 
-        'Cassonetti non svuotati in Piazza Dante', 
-        'Panchine rotte alla Villa Comunale', 
-        'Semaforo non funzionante a Piazza Garibaldi', 
-        'Marciapiede dissestato in Via Chiaia'
-    ],
-    'Stato': ['In lavorazione', 'Risolto', 'Assegnato', 'In attesa', 'Risolto']
-}
-df = pd.DataFrame(data)
-st.dataframe(df, use_container_width=True)
+table_order = st.selectbox("Ordina per", ["Più recenti", "Meno recenti", "Più pericolose"], key="tabella_ordine")
+order, descending = {"Più recenti": ("data", True), "Meno recenti": ("data", False),
+                     "Più pericolose": ("livello", True)}[table_order]
+PAGE_SIZE = 20
+
+# Chiavi delle pagine già visitate, azzerate quando cambiano filtri o ordinamento
+table_view = (active_filters, order, descending)
+if st.session_state.get("tabella_vista") != table_view:
+    st.session_state.tabella_vista = table_view
+    st.session_state.tabella_pagine = [None]
+pages = st.session_state.tabella_pagine
+
+with metrics.timer("dashboard_section_seconds", sezione="tabella"):
+    df, next_key = queries.load_reports_page(active_filters, order, descending, pages[-1], PAGE_SIZE)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ Precedente", disabled=len(pages) == 1):
+            pages.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Pagina {len(pages)}")
+    with col_next:
+        if st.button("Successiva ▶", disabled=next_key is None):
+            pages.append(next_key)
+            st.rerun()
+
+# Esportazione massiva dei report PDF delle segnalazioni filtrate. I file preparati
+# restano su disco e in session_state (fino al cambio dei filtri), così il pulsante
+# di download sopravvive ai rerun; il file viene letto solo al momento del download
+st.markdown("## 🗂️ Esporta i Report")
+if st.session_state.get("report_filtri") != active_filters:
+    st.session_state.report_filtri = active_filters
+    st.session_state.report_pronti = {}
+prepared = st.session_state.report_pronti
+
+
+def download_prepared(kind, label):
+    if kind in prepared:
+        fileobj, file_name, mime = prepared[kind]
+        st.download_button(label, data=lambda path=fileobj.name: open(path, "rb"), file_name=file_name,
+                           mime=mime, on_click="ignore", key=f"scarica_{kind}")
+
+
+st.caption(f"Le segnalazioni esportate sono quelle dei filtri attivi. Oltre {PDF_MAX_PAGES} segnalazioni "
+           "il PDF unico è diviso in più file dentro uno ZIP. Il file è preparato su disco, ma al "
+           "download Streamlit lo carica per intero in memoria.")
+col_pdf, col_zip = st.columns(2)
+with col_pdf:
+    if st.button("Prepara un PDF unico"):
+        with st.spinner("Generazione del PDF..."):
+            bulk_pdf, is_zip = get_renderer().export_pdf(get_store().iter_assessments(filters=active_filters))
+        prepared["pdf"] = ((bulk_pdf, "report_segnalazioni.zip", "application/zip") if is_zip
+                           else (bulk_pdf, "report_segnalazioni.pdf", "application/pdf"))
+    download_prepared("pdf", "📄 Scarica il PDF")
+with col_zip:
+    if st.button("Prepara uno ZIP di report"):
+        with st.spinner("Generazione dell'archivio..."):
+            bulk_zip = get_renderer().export_zip(get_store().iter_assessments(filters=active_filters))
+        prepared["zip"] = (bulk_zip, "report_segnalazioni.zip", "application/zip")
+    download_prepared("zip", "🗂️ Scarica lo ZIP")
+
+# Esportazione dei dati filtrati (CSV, Parquet per l'analisi, GeoJSON per i GIS),
+# generata a blocchi: per archivi molto grandi c'è anche `python -m core.export`
+st.markdown("## 💾 Esporta i Dati")
+col_format, col_data = st.columns([1, 3])
+with col_format:
+    export_format = st.selectbox("Formato", list(export.FORMATI), format_func=str.upper, key="formato_export")
+with col_data:
+    st.caption("Le segnalazioni esportate sono quelle dei filtri attivi.")
+    if st.button("Prepara l'esportazione"):
+        with st.spinner("Esportazione in corso..."):
+            export_data = export.export_file(get_store(), export_format, active_filters)
+        st.download_button(f"💾 Scarica il file {export_format.upper()}", data=export_data.read(),
+                           file_name=export.file_name(export_format), mime=export.FORMATI[export_format][1])
+
+# Prefetch della pagina successiva della tabella, a pagina già mostrata
+if next_key is not None:
+    queries.load_reports_page(active_filters, order, descending, next_key, PAGE_SIZE)